@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Add data_version column to user table (drives per-user response cache invalidation)
+"""
+
+from app import create_app, db
+
+def add_data_version_column():
+    """Add data_version column to user table"""
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            # Check if column exists
+            inspector = db.inspect(db.engine)
+            columns = [col['name'] for col in inspector.get_columns('user')]
+            
+            if 'data_version' not in columns:
+                print("Adding data_version column to user table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text('ALTER TABLE "user" ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0'))
+                print("Successfully added data_version column!")
+            else:
+                print("data_version column already exists!")
+                
+        except Exception as e:
+            print(f"Error adding column: {e}")
+            raise
+
+if __name__ == '__main__':
+    add_data_version_column()
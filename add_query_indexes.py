@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Add composite indexes for the hot EnergyData / EnergyInsight queries to an existing database
+"""
+
+from app import create_app, db
+from app.models import Upload, EnergyData, EnergyInsight, AIRecommendation
+
+def add_query_indexes():
+    """Create any index declared on the models that the database is missing"""
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            
+            for model in (Upload, EnergyData, EnergyInsight, AIRecommendation):
+                table = model.__table__
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                
+                for index in table.indexes:
+                    if index.name in existing:
+                        print(f"{index.name} already exists!")
+                        continue
+                    
+                    print(f"Creating {index.name} on {table.name}...")
+                    index.create(bind=db.engine, checkfirst=True)
+            
+            print("Query indexes are up to date!")
+            
+        except Exception as e:
+            print(f"Error creating indexes: {e}")
+            raise
+
+if __name__ == '__main__':
+    add_query_indexes()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Add content_sha256 column to upload table (byte-identical re-upload detection)
+
+Uploads processed before this column existed have no hash and are never matched;
+re-uploads of those files are still deduplicated row by row.
+"""
+
+from app import create_app, db
+
+def add_upload_hash_column():
+    """Add content_sha256 column and its lookup index to upload table"""
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            # Check if column exists
+            inspector = db.inspect(db.engine)
+            columns = [col['name'] for col in inspector.get_columns('upload')]
+            
+            if 'content_sha256' not in columns:
+                print("Adding content_sha256 column to upload table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text('ALTER TABLE upload ADD COLUMN content_sha256 VARCHAR(64)'))
+                    conn.execute(db.text('CREATE INDEX IF NOT EXISTS ix_upload_user_sha256 ON upload (user_id, content_sha256)'))
+                print("Successfully added content_sha256 column!")
+            else:
+                print("content_sha256 column already exists!")
+                
+        except Exception as e:
+            print(f"Error adding column: {e}")
+            raise
+
+if __name__ == '__main__':
+    add_upload_hash_column()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Create the upload table, link energy data / insights to it and backfill per-upload aggregates
+"""
+
+from collections import defaultdict
+from app import create_app, db
+from app.models import Upload, EnergyData, EnergyInsight
+
+def add_upload_table():
+    """Create Upload rows for every existing (user, file_name, upload_date) group"""
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            # create_app() already created the upload table; add the foreign key columns
+            inspector = db.inspect(db.engine)
+            for table in ('energy_data', 'energy_insight'):
+                columns = [col['name'] for col in inspector.get_columns(table)]
+                if 'upload_id' not in columns:
+                    print(f"Adding upload_id column to {table} table...")
+                    with db.engine.begin() as conn:
+                        conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN upload_id INTEGER REFERENCES upload(id)'))
+                        conn.execute(db.text(f'CREATE INDEX IF NOT EXISTS ix_{table}_user_upload ON {table} (user_id, upload_id)'))
+            
+            # Aggregate readings that don't belong to an upload yet
+            group_columns = (EnergyData.user_id, EnergyData.file_name, EnergyData.upload_date)
+            groups = db.session.query(
+                *group_columns,
+                db.func.count(EnergyData.id),
+                db.func.sum(EnergyData.energy_kwh),
+                db.func.sum(EnergyData.cost_inr),
+                db.func.sum(db.case((EnergyData.is_anomaly, 1), else_=0)),
+                db.func.min(EnergyData.timestamp),
+                db.func.max(EnergyData.timestamp)
+            ).filter(EnergyData.upload_id.is_(None)).group_by(*group_columns).order_by(EnergyData.upload_date).all()
+            
+            print(f"Found {len(groups)} uploads to backfill")
+            
+            department_rows = db.session.query(
+                *group_columns,
+                EnergyData.department,
+                db.func.sum(EnergyData.energy_kwh)
+            ).filter(EnergyData.upload_id.is_(None)).group_by(*group_columns, EnergyData.department).all()
+            
+            department_totals = defaultdict(dict)
+            for user_id, file_name, upload_date, department, consumption in department_rows:
+                department_totals[(user_id, file_name, upload_date)][department] = consumption or 0.0
+            
+            for user_id, file_name, upload_date, row_count, energy, cost, anomalies, start_time, end_time in groups:
+                upload = Upload(
+                    user_id=user_id,
+                    file_name=file_name,
+                    upload_date=upload_date,
+                    row_count=row_count,
+                    total_energy_kwh=energy or 0.0,
+                    total_cost_inr=cost or 0.0,
+                    anomaly_count=int(anomalies or 0),
+                    start_time=start_time,
+                    end_time=end_time,
+                    department_totals=department_totals[(user_id, file_name, upload_date)]
+                )
+                db.session.add(upload)
+                db.session.flush()
+                
+                EnergyData.query.filter(
+                    EnergyData.user_id == user_id,
+                    EnergyData.file_name.is_(None) if file_name is None else EnergyData.file_name == file_name,
+                    EnergyData.upload_date.is_(None) if upload_date is None else EnergyData.upload_date == upload_date,
+                    EnergyData.upload_id.is_(None)
+                ).update({EnergyData.upload_id: upload.id}, synchronize_session=False)
+                print(f"Created upload {upload.id} for {file_name} ({row_count} records)")
+            
+            # Insights only know their file name: attach each to the latest upload of that file made before it
+            insights = EnergyInsight.query.filter(EnergyInsight.upload_id.is_(None), EnergyInsight.file_name.isnot(None)).all()
+            for insight in insights:
+                candidates = Upload.query.filter_by(user_id=insight.user_id, file_name=insight.file_name)
+                upload = candidates.filter(Upload.upload_date <= insight.created_at).order_by(Upload.upload_date.desc()).first() \
+                    or candidates.order_by(Upload.upload_date.desc()).first()
+                if upload:
+                    insight.upload_id = upload.id
+            
+            db.session.commit()
+            print(f"Linked {len(insights)} insights to uploads")
+            print("Upload table migration completed successfully!")
+            
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    add_upload_table()
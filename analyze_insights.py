@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Run AI analysis for a user's insights concurrently under the Gemini rate limit
+
+Analyzes the given insight ids, or every insight of the chosen severity
+(optionally of one upload), largest potential savings first. Prints the
+latency of each analysis and the batch throughput.
+
+Usage: python analyze_insights.py USER_ID [--ids 1 2 3] [--severity high] [--upload-id N]
+                                          [--limit 50] [--workers 4] [--retries 2]
+"""
+
+import argparse
+import sys
+from app import create_app
+from app.ai_batch import analyze_insights, select_insights
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch AI analysis of energy insights')
+    parser.add_argument('user_id', type=int)
+    parser.add_argument('--ids', type=int, nargs='+', help='insight ids (default: select by severity)')
+    parser.add_argument('--severity', default='high', choices=['high', 'medium', 'low', 'all'])
+    parser.add_argument('--upload-id', type=int)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--workers', type=int, help='concurrent analyses (default: GEMINI_MAX_CONCURRENCY)')
+    parser.add_argument('--retries', type=int, default=2, help='extra attempts after a quota error')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        insight_ids = args.ids or select_insights(args.user_id, None if args.severity == 'all' else args.severity,
+                                                  args.upload_id, args.limit)
+    if not insight_ids:
+        print("No insights to analyze")
+        return 0
+
+    print(f"Analyzing {len(insight_ids)} insights for user {args.user_id}...")
+    batch = analyze_insights(app, args.user_id, insight_ids, args.workers, args.retries)
+
+    print(f"{'insight':>8} {'status':>10} {'source':>12} {'attempts':>9} {'latency':>10}  title")
+    for result in batch['results']:
+        print(f"{result['insight_id']:>8} {result['status']:>10} {result.get('source') or '-':>12} "
+              f"{result['attempts']:>9} {result['latency_ms']:>8.0f}ms  {result.get('title', '')}")
+
+    summary = batch['summary']
+    print(f"\n{summary['insights']} insights in {summary['wall_seconds']:.1f}s with {summary['workers']} workers "
+          f"({summary['insights_per_minute']:.1f}/min): {summary['analyzed']} analyzed, {summary['cached']} cached, "
+          f"{summary['fallback']} fallback, {summary['not_found']} not found; "
+          f"mean latency {summary['mean_latency_ms']:.0f}ms, max {summary['max_latency_ms']:.0f}ms")
+    return 1 if summary['fallback'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,8 +20,42 @@ def create_app():
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///wattwise.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['ADMIN_EMAILS'] = [email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()]  # may view process-wide stats
     app.config['UPLOAD_FOLDER'] = 'uploads'
-    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 2 * 1024 * 1024 * 1024))  # 2GB max file size
+    app.config['ENERGY_DATA_BATCH_SIZE'] = int(os.environ.get('ENERGY_DATA_BATCH_SIZE', 5000))  # rows per bulk insert batch
+    app.config['CSV_CHUNK_SIZE'] = int(os.environ.get('CSV_CHUNK_SIZE', 100000))  # rows per streamed CSV chunk
+    app.config['STREAMING_INGEST_THRESHOLD'] = int(os.environ.get('STREAMING_INGEST_THRESHOLD', 16 * 1024 * 1024))  # stream files larger than 16MB
+    app.config['INDUSTRIAL_ENERGY_RATE'] = float(os.environ.get('INDUSTRIAL_ENERGY_RATE', 8.50))  # INR per kWh without a user tariff
+    app.config['ANOMALY_METHOD'] = os.environ.get('ANOMALY_METHOD', 'seasonal')  # seasonal (hour-of-week median/MAD), zscore or multivariate
+    app.config['MULTIVARIATE_MODEL_SCOPE'] = os.environ.get('MULTIVARIATE_MODEL_SCOPE', 'user')  # one IsolationForest per user or per department
+    app.config['MULTIVARIATE_MODEL_FOLDER'] = os.environ.get('MULTIVARIATE_MODEL_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'models'))
+    app.config['MULTIVARIATE_RETRAIN_INTERVAL'] = int(os.environ.get('MULTIVARIATE_RETRAIN_INTERVAL', 5))  # data versions before retraining
+    app.config['MULTIVARIATE_TRAINING_ROWS'] = int(os.environ.get('MULTIVARIATE_TRAINING_ROWS', 100000))  # latest readings used for training
+    app.config['UPLOAD_JOB_WORKERS'] = int(os.environ.get('UPLOAD_JOB_WORKERS', 2))  # 0 runs uploads inline
+    app.config['JOB_STATE_FOLDER'] = os.environ.get('JOB_STATE_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
+    app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')  # memory, filesystem or none
+    app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 300))  # seconds
+    app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+    app.config['RESPONSE_CACHE_FOLDER'] = os.environ.get('RESPONSE_CACHE_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'cache'))
+    app.config['GEMINI_CLIENT_IDLE_TIMEOUT'] = int(os.environ.get('GEMINI_CLIENT_IDLE_TIMEOUT', 900))  # seconds an unused API key keeps its client
+    app.config['GEMINI_RATE_LIMIT_PER_MINUTE'] = int(os.environ.get('GEMINI_RATE_LIMIT_PER_MINUTE', 15))  # requests per API key
+    app.config['GEMINI_RATE_LIMIT_BURST'] = int(os.environ.get('GEMINI_RATE_LIMIT_BURST', 5))
+    app.config['GEMINI_MAX_CONCURRENCY'] = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 4))  # in-flight calls per API key
+    app.config['GEMINI_BREAKER_FAILURES'] = int(os.environ.get('GEMINI_BREAKER_FAILURES', 3))  # failures in a row that open a model's circuit
+    app.config['GEMINI_BREAKER_OPEN_SECONDS'] = int(os.environ.get('GEMINI_BREAKER_OPEN_SECONDS', 60))  # 0 disables the circuit breaker
+    app.config['GEMINI_BREAKER_FOLDER'] = os.environ.get('GEMINI_BREAKER_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], 'breakers'))
+    app.config['GEMINI_HEDGE_AFTER_MS'] = int(os.environ.get('GEMINI_HEDGE_AFTER_MS', 0))  # also ask the fallback model after this long, 0 disables
+    app.config['AI_BATCH_MAX_INSIGHTS'] = int(os.environ.get('AI_BATCH_MAX_INSIGHTS', 50))  # per /api/analyze-insights request
+    app.config['AI_BATCH_MAX_RETRIES'] = int(os.environ.get('AI_BATCH_MAX_RETRIES', 2))  # extra attempts after a quota error
+    app.config['AI_ANALYSIS_CACHE_TTL'] = int(os.environ.get('AI_ANALYSIS_CACHE_TTL', 86400))  # seconds; 0 disables the cache
+    app.config['AI_ANALYSIS_CACHE_MAX_ENTRIES'] = int(os.environ.get('AI_ANALYSIS_CACHE_MAX_ENTRIES', 500))  # stored analyses per user
+    app.config['AI_ANALYSIS_CACHE_MEMORY_ENTRIES'] = int(os.environ.get('AI_ANALYSIS_CACHE_MEMORY_ENTRIES', 256))  # in-process LRU, 0 disables
+    app.config['AI_PRECOMPUTE_ON_UPLOAD'] = os.environ.get('AI_PRECOMPUTE_ON_UPLOAD', 'False').lower() == 'true'  # analyze new insights in the background
+    app.config['AI_PRECOMPUTE_SEVERITY'] = os.environ.get('AI_PRECOMPUTE_SEVERITY', 'high')
+    app.config['AI_PRECOMPUTE_MAX_INSIGHTS'] = int(os.environ.get('AI_PRECOMPUTE_MAX_INSIGHTS', 20))  # per upload, largest savings first
+    app.config['AI_PRECOMPUTE_WORKERS'] = int(os.environ.get('AI_PRECOMPUTE_WORKERS', 2))  # background analysis threads per process
+    app.config['AI_PROMPT_TOKEN_BUDGET'] = int(os.environ.get('AI_PROMPT_TOKEN_BUDGET', 900))  # estimated tokens per analysis prompt, 0 disables compaction
     app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     
     logger.info(f"🚀 Starting WattWise AI")
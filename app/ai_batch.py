@@ -0,0 +1,96 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import db
+from app.models import EnergyInsight, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 2  # extra attempts per insight after a quota error
+
+def select_insights(user_id, severity='high', upload_id=None, limit=50):
+    """Ids of a user's insights to analyze, largest potential savings first"""
+    query = db.session.query(EnergyInsight.id).filter(EnergyInsight.user_id == user_id)
+    if severity:
+        query = query.filter(EnergyInsight.severity == severity)
+    if upload_id is not None:
+        query = query.filter(EnergyInsight.upload_id == upload_id)
+    query = query.order_by(db.func.coalesce(EnergyInsight.potential_savings_inr, 0).desc(), EnergyInsight.id)
+    return [insight_id for insight_id, in query.limit(limit).all()]
+
+def analyze_insights(app, user_id, insight_ids, max_workers=None, max_retries=DEFAULT_MAX_RETRIES, on_result=None):
+    """Run AI analysis for several insights concurrently and report latency and throughput
+
+    Each worker thread has its own app context and DB session. Gemini calls
+    go through the per-key rate limiter, so max_workers only bounds how many
+    analyses are in progress (cache lookups and prompt building included);
+    an analysis that hits a quota error is retried after the limiter's
+    backoff, up to max_retries times. on_result(done), if given, is called
+    after each finished insight with the number finished so far.
+    """
+    max_workers = max_workers or app.config['GEMINI_MAX_CONCURRENCY']
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-batch') as executor:
+        results = []
+        for result in executor.map(lambda insight_id: _analyze_one(app, user_id, insight_id, max_retries), insight_ids):
+            results.append(result)
+            if on_result:
+                on_result(len(results))
+
+    wall_seconds = time.perf_counter() - started
+    latencies = [result['latency_ms'] for result in results if result['status'] != 'not_found']
+    counts = {status: sum(1 for result in results if result['status'] == status)
+              for status in ('analyzed', 'cached', 'fallback', 'not_found')}
+
+    summary = {
+        'insights': len(results),
+        **counts,
+        'workers': max_workers,
+        'wall_seconds': round(wall_seconds, 3),
+        'insights_per_minute': round(len(latencies) / wall_seconds * 60, 1) if wall_seconds > 0 else 0.0,
+        'mean_latency_ms': round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        'max_latency_ms': round(max(latencies), 1) if latencies else 0.0
+    }
+    logger.info(f"Batch AI analysis for user {user_id}: {summary}")
+    return {'summary': summary, 'results': results}
+
+def _analyze_one(app, user_id, insight_id, max_retries):
+    from app.ai_consultant import AIConsultant
+
+    with app.app_context():
+        started = time.perf_counter()
+        insight = EnergyInsight.query.filter_by(id=insight_id, user_id=user_id).first()
+        if insight is None:
+            return {'insight_id': insight_id, 'status': 'not_found', 'attempts': 0, 'latency_ms': 0.0}
+
+        user = db.session.get(User, user_id)
+        for attempt in range(1, max_retries + 2):
+            # A fresh consultant per attempt; quota_exhausted only describes its own calls
+            consultant = AIConsultant(user=user)
+            analysis = consultant.get_insight_analysis(insight, user_id)
+            if not (consultant.quota_exhausted and analysis.get('source') == 'automated'):
+                break
+
+        # Prompt size and model latency of the Gemini call this attempt made (none for cached analyses)
+        call = (not analysis.get('cached') and analysis.get('prompt')) or {}
+        if analysis.get('cached'):
+            status = 'cached'
+        elif analysis.get('source') == 'automated':
+            status = 'fallback'
+        else:
+            status = 'analyzed'
+
+        return {
+            'insight_id': insight_id,
+            'title': insight.title,
+            'severity': insight.severity,
+            'status': status,
+            'source': analysis.get('source'),
+            'recommendations': len(analysis.get('recommendations') or []),
+            'attempts': attempt,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'prompt_tokens': call.get('prompt_tokens'),
+            'model_latency_ms': call.get('latency_ms'),
+            'error': analysis.get('error')
+        }
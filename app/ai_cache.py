@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.cache import MemoryCache
+from app.models import AIAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt or the response parsing changes so stored analyses are not reused
+PROMPT_VERSION = 2
+
+# Insight columns that end up in the prompt
+CONTEXT_FIELDS = ['id', 'insight_type', 'title', 'description', 'department', 'equipment', 'severity', 'potential_savings_inr']
+
+def analysis_key(insight, data_version):
+    """SHA-256 of everything the analysis prompt is built from
+
+    The readings and rollup totals in the prompt only change when the user's
+    data version does, so the insight plus that version stand in for them
+    without querying anything.
+    """
+    payload = {field: getattr(insight, field) for field in CONTEXT_FIELDS}
+    payload.update(user_id=insight.user_id, data_version=data_version or 0, prompt_version=PROMPT_VERSION)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+class AnalysisCache:
+    """Gemini analyses stored in the ai_analysis table behind an in-process LRU
+
+    Entries expire ttl seconds after the analysis was generated (the prompt
+    covers a rolling 30-day window). Each user keeps at most max_entries rows;
+    the least recently viewed ones are evicted when a new analysis is stored.
+    """
+
+    def __init__(self, ttl=86400, max_entries=500, memory_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = MemoryCache(memory_entries, ttl) if memory_entries else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """The stored analysis dict for key, or None"""
+        if not self.enabled:
+            return None
+
+        entry = self.memory.get(key) if self.memory is not None else None
+        if entry is not None:
+            self._count(True)
+            return entry[1]
+
+        now = datetime.utcnow()
+        row = AIAnalysis.query.filter(
+            AIAnalysis.context_hash == key,
+            AIAnalysis.created_at >= now - timedelta(seconds=self.ttl)
+        ).first()
+        self._count(row is not None)
+        if row is None:
+            return None
+
+        AIAnalysis.query.filter_by(id=row.id).update(
+            {AIAnalysis.last_used_at: now, AIAnalysis.hit_count: AIAnalysis.hit_count + 1},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if self.memory is not None:
+            self.memory.set(key, row.analysis)
+        return row.analysis
+
+    def set(self, key, insight, analysis, model_name=None):
+        """Store (or replace) the analysis of insight and evict the user's oldest entries"""
+        if not self.enabled:
+            return
+
+        now = datetime.utcnow()
+        record = {
+            'user_id': insight.user_id,
+            'insight_id': insight.id,
+            'context_hash': key,
+            'model_name': model_name,
+            'analysis': analysis,
+            'hit_count': 0,
+            'created_at': now,
+            'last_used_at': now
+        }
+        try:
+            connection = db.session.connection()
+            connection.execute(_upsert_statement(connection.dialect.name), [record])
+            self._evict(insight.user_id, now)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not store AI analysis of insight {insight.id}: {str(e)}")
+            return
+
+        if self.memory is not None:
+            self.memory.set(key, analysis)
+
+    def _evict(self, user_id, now):
+        AIAnalysis.query.filter(
+            AIAnalysis.user_id == user_id,
+            AIAnalysis.created_at < now - timedelta(seconds=self.ttl)
+        ).delete(synchronize_session=False)
+
+        keep = db.session.query(AIAnalysis.id).filter(AIAnalysis.user_id == user_id) \
+            .order_by(AIAnalysis.last_used_at.desc()).limit(self.max_entries)
+        AIAnalysis.query.filter(
+            AIAnalysis.user_id == user_id,
+            AIAnalysis.id.notin_(keep.scalar_subquery())
+        ).delete(synchronize_session=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'table' if self.enabled else 'none',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'memory_entries': len(self.memory) if self.memory is not None else 0
+        }
+
+def _upsert_statement(dialect_name):
+    table = AIAnalysis.__table__
+    statement = (postgresql if dialect_name == 'postgresql' else sqlite).insert(table)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=['context_hash'],
+        set_={column: getattr(excluded, column)
+              for column in ('model_name', 'analysis', 'hit_count', 'created_at', 'last_used_at')}
+    )
+
+def get_analysis_cache(app=None):
+    """The app's AnalysisCache, built from AI_ANALYSIS_CACHE_* config on first use"""
+    app = app or current_app
+    cache = app.extensions.get('analysis_cache')
+    if cache is None:
+        cache = app.extensions.setdefault('analysis_cache', AnalysisCache(
+            app.config['AI_ANALYSIS_CACHE_TTL'],
+            app.config['AI_ANALYSIS_CACHE_MAX_ENTRIES'],
+            app.config['AI_ANALYSIS_CACHE_MEMORY_ENTRIES']
+        ))
+    return cache
@@ -1,11 +1,24 @@
-import google.generativeai as genai
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta
-from app.models import EnergyData, EnergyInsight, AIRecommendation, db
+from flask import current_app
+from app.models import EnergyInsight, AIRecommendation, db
+from app.ai_cache import analysis_key, get_analysis_cache
+from app.prompt_context import estimate_tokens, fit_prompt, get_prompt_metrics, window_summary
+from app.gemini_clients import get_client_pool
+from app.rate_limit import get_rate_limiter, is_quota_error
+from app.circuit_breaker import CircuitOpenError, get_circuit_breaker, is_tripping_error
 import logging
 
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL = 'gemini-flash-latest'
+GEMINI_FALLBACK_MODEL = 'gemini-pro-latest'  # used while flash fails with quota, server or unknown model errors
+
+# Models tried in order, with the analysis source each one reports
+MODEL_CHAIN = [(GEMINI_MODEL, 'gemini'), (GEMINI_FALLBACK_MODEL, 'gemini-pro')]
+
 class AIConsultant:
     def __init__(self, user=None):
         # Configure Gemini AI
@@ -19,10 +32,13 @@ class AIConsultant:
         if not api_key:
             api_key = os.environ.get('GEMINI_API_KEY')
         
+        self.api_key = api_key
+        self.quota_exhausted = False  # set when Gemini rejected a call of this consultant with a quota error
+        self.prompt_compaction = None  # compaction level of the last prompt built
+        self.call_stats = None  # prompt size and model latency of the last successful call
         if api_key:
             try:
-                genai.configure(api_key=api_key)
-                self.model = genai.GenerativeModel('gemini-flash-latest')
+                self.model = get_client_pool().model(api_key, GEMINI_MODEL)
             except Exception as e:
                 logger.error(f"Error creating Gemini model: {str(e)}")
                 self.model = None
@@ -32,19 +48,9 @@ class AIConsultant:
     
     def get_insight_analysis(self, insight, user_id):
         """Get AI analysis for a specific energy insight"""
-        
-        # Get user to access API key directly if needed
-        from app.models import User
-        user = User.query.get(user_id)
-        if user:
-             if user.gemini_api_key and not self.model:
-                 # Re-initialize if model is missing but user has key
-                 try:
-                     genai.configure(api_key=user.gemini_api_key)
-                     # self.model = genai.GenerativeModel('gemini-flash-latest')
-                     self.model = genai.GenerativeModel('gemini-flash-latest')
-                 except Exception as e:
-                     logger.error(f"Failed to re-initialize model: {e}")
+        cache, cache_key, cached = self._cached_analysis(insight, user_id)
+        if cached is not None:
+            return cached
 
         if not self.model:
             return self._fallback_analysis(insight, "AI Model not initialized (Check API Key)")
@@ -56,75 +62,290 @@ class AIConsultant:
             # Create context for AI
             context = self._create_ai_context(insight, energy_data)
             
-            # Generate AI response
+            # Generate AI response (flash, or pro while flash's circuit is open or it fails)
             prompt = self._create_analysis_prompt(context)
-            response = self.model.generate_content(prompt)
+            response_text, model_name, source = self._generate_with_fallback(prompt)
             
             # Parse and save recommendations
-            ai_data = self._parse_ai_response(response.text, insight.id, user_id)
+            ai_data = self._parse_ai_response(response_text, insight.id, user_id)
             
-            return {
-                'analysis': ai_data.get('analysis', response.text),
-                'root_cause': ai_data.get('root_cause'),
-                'business_impact': ai_data.get('business_impact'),
-                'recommendations': ai_data.get('recommendations', []),
-                'timeline': ai_data.get('timeline', {}),
-                'context': context,
-                'source': 'gemini'
-            }
+            analysis = self._build_analysis(ai_data, response_text, context, source)
+            cache.set(cache_key, insight, analysis, model_name)
+            return analysis
             
         except Exception as e:
             logger.error(f"Error in AI analysis: {str(e)}")
-            error_msg = str(e)
-            
-            # Retry logic for Quota/Model issues
-            if ("429" in error_msg or "404" in error_msg) and not hasattr(self, '_retry_attempted'):
-                self._retry_attempted = True
-                try:
-                    # Try a standard Pro model as fallback
-                    fallback_model = genai.GenerativeModel('gemini-pro-latest')
-                    response = fallback_model.generate_content(prompt)
-                    
-                    # If successful, parse and return
-                    ai_data = self._parse_ai_response(response.text, insight.id, user_id)
-                    self._retry_attempted = False # Reset
-                    return {
-                        'analysis': ai_data.get('analysis', response.text),
-                        'root_cause': ai_data.get('root_cause'),
-                        'business_impact': ai_data.get('business_impact'),
-                        'recommendations': ai_data.get('recommendations', []),
-                        'timeline': ai_data.get('timeline', {}),
-                        'context': context,
-                        'source': 'gemini-pro'
-                    }
-                except Exception as retry_error:
-                    logger.error(f"Retry failed: {str(retry_error)}")
-            
-            if hasattr(self, '_retry_attempted'):
-                self._retry_attempted = False
-                
-            if "429" in error_msg or "quota" in error_msg.lower():
-                 error_msg = "AI Usage Limit Exceeded. Please wait a minute."
-                 
-            return self._fallback_analysis(insight, error_msg)
+            return self._fallback_analysis(insight, self._error_message(e))
     
-    def _get_relevant_data(self, insight, user_id):
-        """Get energy data relevant to the insight"""
-        query = EnergyData.query.filter_by(user_id=user_id)
+    def get_cached_analysis(self, insight, user_id):
+        """The stored analysis of an insight, or None when it has to be generated"""
+        return self._cached_analysis(insight, user_id)[2]
+    
+    def stream_insight_analysis(self, insight, user_id):
+        """Yield (event, data) pairs while Gemini writes the analysis of an insight
+        
+        'chunk' events carry model text as it arrives; a single 'result' event
+        carries the parsed analysis (the same dict get_insight_analysis
+        returns), followed by a 'timing' event with the time to the first
+        chunk and the total time in milliseconds.
+        """
+        started = time.perf_counter()
+        timing = {'ttfb_ms': None, 'total_ms': None, 'chunks': 0, 'characters': 0}
+        
+        def finish(analysis):
+            timing['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            timing['source'] = analysis.get('source')
+            timing['cached'] = bool(analysis.get('cached'))
+            logger.info(f"Streamed AI analysis of insight {insight.id}: first chunk "
+                        f"{timing['ttfb_ms'] if timing['ttfb_ms'] is not None else '-'}ms, total {timing['total_ms']}ms "
+                        f"({timing['chunks']} chunks, {timing['characters']} characters, source {timing['source']})")
+            return [('result', analysis), ('timing', timing)]
+        
+        cache, cache_key, cached = self._cached_analysis(insight, user_id)
+        if cached is not None:
+            yield from finish(cached)
+            return
         
-        if insight.department:
-            query = query.filter_by(department=insight.department)
+        if not self.model:
+            yield from finish(self._fallback_analysis(insight, "AI Model not initialized (Check API Key)"))
+            return
+        
+        try:
+            context = self._create_ai_context(insight, self._get_relevant_data(insight, user_id))
+            prompt = self._create_analysis_prompt(context)
+        except Exception as e:
+            logger.error(f"Error preparing AI analysis: {str(e)}")
+            yield from finish(self._fallback_analysis(insight, str(e)))
+            return
+        
+        breaker = get_circuit_breaker()
+        error = CircuitOpenError("Every Gemini model is paused after repeated errors")
+        for model_name, source in MODEL_CHAIN:
+            if not breaker.allow(model_name, self.api_key):
+                logger.info(f"Skipping {model_name}: its circuit is open")
+                continue
+            parts = []
+            try:
+                for text in self._generate_stream(self._model(model_name), prompt):
+                    if timing['ttfb_ms'] is None:
+                        timing['ttfb_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                    parts.append(text)
+                    timing['chunks'] += 1
+                    timing['characters'] += len(text)
+                    yield 'chunk', {'text': text}
+                
+                response_text = ''.join(parts)
+                ai_data = self._parse_ai_response(response_text, insight.id, user_id)
+                analysis = self._build_analysis(ai_data, response_text, context, source)
+                cache.set(cache_key, insight, analysis, model_name)
+                yield from finish(analysis)
+                return
+            
+            except Exception as e:
+                logger.error(f"Error in streamed AI analysis with {model_name}: {str(e)}")
+                error = e
+                # Only a call that failed before streaming anything can be retried with the fallback model
+                if parts or not is_tripping_error(e):
+                    break
+        
+        yield from finish(self._fallback_analysis(insight, self._error_message(error)))
+    
+    def _cached_analysis(self, insight, user_id):
+        """The analysis cache, this insight's key in it and the stored analysis (or None)"""
+        # Get user to access API key directly if needed
+        from app.models import User
+        user = User.query.get(user_id)
+        if user:
+             if user.gemini_api_key and not self.model:
+                 # Re-initialize if model is missing but user has key
+                 try:
+                     self.api_key = user.gemini_api_key
+                     self.model = get_client_pool().model(self.api_key, GEMINI_MODEL)
+                 except Exception as e:
+                     logger.error(f"Failed to re-initialize model: {e}")
+
+        # Serve a stored analysis while the insight and the user's data are unchanged
+        cache = get_analysis_cache()
+        cache_key = analysis_key(insight, user.data_version if user else 0)
+        cached = cache.get(cache_key)
+        return cache, cache_key, {**cached, 'cached': True} if cached is not None else None
+    
+    def _build_analysis(self, ai_data, response_text, context, source):
+        return {
+            'analysis': ai_data.get('analysis', response_text),
+            'root_cause': ai_data.get('root_cause'),
+            'business_impact': ai_data.get('business_impact'),
+            'recommendations': ai_data.get('recommendations', []),
+            'timeline': ai_data.get('timeline', {}),
+            'context': context,
+            'source': source,
+            'prompt': self.call_stats
+        }
+    
+    def _model(self, model_name):
+        if model_name == GEMINI_MODEL and self.model:
+            return self.model
+        return get_client_pool().model(self.api_key, model_name)
+    
+    def _generate_with_fallback(self, prompt):
+        """Response text, model name and source of the first model in MODEL_CHAIN that answers
         
-        if insight.equipment:
-            query = query.filter_by(equipment=insight.equipment)
+        Models whose circuit is open are skipped without a call; a model
+        failing with a quota, server or unknown model error passes the prompt
+        on to the next one. With GEMINI_HEDGE_AFTER_MS set, the next model is
+        also asked once the current one is that late, and the first answer
+        wins. Raises CircuitOpenError when every circuit is open.
+        """
+        breaker = get_circuit_breaker()
+        hedge_after = current_app.config['GEMINI_HEDGE_AFTER_MS'] / 1000
+        chain = list(MODEL_CHAIN)
+        error = CircuitOpenError("Every Gemini model is paused after repeated errors")
+        while chain:
+            model_name, source = chain.pop(0)
+            if not breaker.allow(model_name, self.api_key):
+                logger.info(f"Skipping {model_name}: its circuit is open")
+                continue
+            try:
+                if hedge_after and chain:
+                    return self._generate_hedged(prompt, (model_name, source), chain, hedge_after)
+                return self._generate(self._model(model_name), prompt).text, model_name, source
+            except Exception as e:
+                logger.error(f"Gemini {model_name} failed: {str(e)}")
+                error = e
+                if not is_tripping_error(e):
+                    break
+        raise error
+    
+    def _generate_hedged(self, prompt, primary, chain, hedge_after):
+        """Call the primary model and, if it has not answered after hedge_after seconds, the next one in chain too"""
+        app = current_app._get_current_object()
+        breaker = get_circuit_breaker()
         
-        # Get data from the last 30 days
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        query = query.filter(EnergyData.timestamp >= thirty_days_ago)
+        def call(model_name):
+            with app.app_context():
+                return self._call(self._model(model_name), prompt)
         
-        return query.order_by(EnergyData.timestamp.desc()).limit(100).all()
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='gemini-hedge')
+        try:
+            futures = {executor.submit(call, primary[0]): primary}
+            done, _ = wait(futures, timeout=hedge_after)
+            hedged = not done and breaker.allow(chain[0][0], self.api_key)
+            if hedged:
+                hedge = chain.pop(0)
+                logger.info(f"{primary[0]} slower than {hedge_after * 1000:.0f}ms; hedging with {hedge[0]}")
+                futures[executor.submit(call, hedge[0])] = hedge
+            
+            error = None
+            for future in as_completed(futures):
+                model_name, source = futures[future]
+                try:
+                    response, self.call_stats = future.result()
+                except Exception as e:
+                    if hedged:
+                        logger.warning(f"Hedged Gemini {model_name} call failed: {str(e)}")
+                    error = e
+                    continue
+                if hedged:
+                    breaker.record_hedge(won=model_name != primary[0])
+                return response.text, model_name, source
+            raise error
+        finally:
+            # The slower call is not waited for; its result is dropped when it arrives
+            executor.shutdown(wait=False)
+    
+    def _generate(self, model, prompt):
+        """generate_content under the API key's token bucket, concurrency cap and circuit breaker"""
+        response, self.call_stats = self._call(model, prompt)
+        return response
+    
+    def _call(self, model, prompt):
+        """The response and call stats of one generate_content; safe to run from several threads"""
+        model_name = model.model_name.split('/')[-1]
+        limiter = get_rate_limiter()
+        with limiter.slot(self.api_key):
+            started = time.perf_counter()
+            try:
+                response = model.generate_content(prompt)
+            except Exception as e:
+                self._record_error(model_name, e)
+                raise
+            latency_ms = (time.perf_counter() - started) * 1000
+        limiter.record_success(self.api_key)
+        get_circuit_breaker().record_success(model_name, self.api_key)
+        return response, self._record_call(model_name, prompt, latency_ms)
+    
+    def _generate_stream(self, model, prompt):
+        """Text of each streamed generate_content chunk, holding a rate-limit slot until the stream ends"""
+        model_name = model.model_name.split('/')[-1]
+        limiter = get_rate_limiter()
+        with limiter.slot(self.api_key):
+            started = time.perf_counter()
+            first_chunk_ms = None
+            try:
+                for chunk in model.generate_content(prompt, stream=True):
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue  # a chunk without text parts (e.g. only a finish reason)
+                    if text:
+                        if first_chunk_ms is None:
+                            first_chunk_ms = (time.perf_counter() - started) * 1000
+                        yield text
+            except Exception as e:
+                self._record_error(model_name, e)
+                raise
+            latency_ms = (time.perf_counter() - started) * 1000
+        limiter.record_success(self.api_key)
+        get_circuit_breaker().record_success(model_name, self.api_key)
+        self.call_stats = self._record_call(model_name, prompt, latency_ms, first_chunk_ms)
+    
+    def _record_error(self, model_name, error):
+        """Tell the rate limiter about quota errors and the circuit breaker about every tripping error"""
+        if is_quota_error(error):
+            self.quota_exhausted = True
+            get_rate_limiter().record_quota_error(self.api_key)
+        if is_tripping_error(error):
+            get_circuit_breaker().record_failure(model_name, self.api_key)
+    
+    def _record_call(self, model_name, prompt, latency_ms, first_chunk_ms=None):
+        """Prompt size and model latency of a successful call, also added to the process metrics"""
+        call_stats = {
+            'model': model_name,
+            'prompt_tokens': estimate_tokens(prompt),
+            'prompt_characters': len(prompt),
+            'compaction': self.prompt_compaction,
+            'latency_ms': round(latency_ms, 1)
+        }
+        if first_chunk_ms is not None:
+            call_stats['first_chunk_ms'] = round(first_chunk_ms, 1)
+        get_prompt_metrics().record(model_name, call_stats['prompt_tokens'], latency_ms,
+                                    self.prompt_compaction, first_chunk_ms)
+        logger.info(f"{model_name} answered a ~{call_stats['prompt_tokens']} token prompt "
+                    f"({self.prompt_compaction or 'uncompacted'}) in {latency_ms:.0f}ms")
+        return call_stats
+    
+    def _error_message(self, error):
+        """What the fallback analysis tells the user about a failed Gemini call"""
+        if isinstance(error, CircuitOpenError):
+            return "AI is paused after repeated Gemini errors. Please try again in a minute."
+        error_msg = str(error)
+        if "429" in error_msg or "quota" in error_msg.lower():
+            return "AI Usage Limit Exceeded. Please wait a minute."
+        return error_msg
+    
+    def _get_relevant_data(self, insight, user_id):
+        """Summary of the insight's series over the last 30 days: totals, daily rollups, hour-of-day profile, percentiles and top anomalies"""
+        return window_summary(
+            user_id,
+            department=insight.department,
+            equipment=insight.equipment,
+            start=self._context_window_start().replace(minute=0, second=0, microsecond=0)
+        )
     
-    def _create_ai_context(self, insight, energy_data):
+    def _context_window_start(self):
+        return datetime.now() - timedelta(days=30)
+    
+    def _create_ai_context(self, insight, summary):
         """Create context information for AI analysis"""
         context = {
             'insight_type': insight.insight_type,
@@ -134,29 +355,26 @@ class AIConsultant:
             'equipment': insight.equipment,
             'severity': insight.severity,
             'potential_savings_inr': insight.potential_savings_inr,
-            'data_points': len(energy_data),
-            'total_consumption': sum(d.energy_kwh for d in energy_data),
-            'total_cost': sum(d.cost_inr or 0 for d in energy_data),
-            'anomaly_count': sum(1 for d in energy_data if d.is_anomaly)
+            'data_points': summary['data_points'],
+            'total_consumption': summary['total_consumption'],
+            'total_cost': summary['total_cost'],
+            'anomaly_count': summary['anomaly_count'],
+            # Daily rollups, hour-of-day profile, percentiles and top anomalies instead of raw readings
+            'consumption_summary': {key: summary[key] for key in ('days', 'hour_profile', 'percentiles', 'top_anomalies')}
         }
         
-        # Add recent consumption patterns
-        if energy_data:
-            recent_data = energy_data[:10]  # Last 10 data points
-            context['recent_consumption'] = [
-                {
-                    'timestamp': d.timestamp.strftime('%Y-%m-%d %H:%M'),
-                    'energy_kwh': d.energy_kwh,
-                    'cost_inr': d.cost_inr,
-                    'is_anomaly': d.is_anomaly
-                }
-                for d in recent_data
-            ]
-        
         return context
     
     def _create_analysis_prompt(self, context):
-        """Create a comprehensive prompt for AI analysis"""
+        """Create a comprehensive prompt for AI analysis, compacted to fit AI_PROMPT_TOKEN_BUDGET"""
+        prompt, _, self.prompt_compaction = fit_prompt(
+            lambda summary_text: self._render_analysis_prompt(context, summary_text),
+            context['consumption_summary'],
+            current_app.config['AI_PROMPT_TOKEN_BUDGET']
+        )
+        return prompt
+    
+    def _render_analysis_prompt(self, context, summary_text):
         prompt = f"""
 You are an expert Energy Optimization Consultant for Indian industries. Analyze the following energy insight and provide professional, actionable recommendations.
 
@@ -175,8 +393,8 @@ ENERGY DATA SUMMARY:
 - Total Cost: ₹{context['total_cost']:.2f}
 - Anomalies Detected: {context['anomaly_count']}
 
-RECENT CONSUMPTION PATTERNS:
-{chr(10).join([f"- {d['timestamp']}: {d['energy_kwh']:.2f} kWh (₹{d['cost_inr']:.2f})" + (" [ANOMALY]" if d['is_anomaly'] else "") for d in context.get('recent_consumption', [])])}
+CONSUMPTION OVER THE LAST 30 DAYS:
+{summary_text}
 
 Please provide a valid JSON response with the following structure:
 {{
@@ -455,6 +673,8 @@ Next Steps:
             recommendations.extend(self._get_high_consumption_recommendations(insight))
         elif insight.insight_type == 'trend':
             recommendations.extend(self._get_trend_recommendations(insight))
+        elif insight.insight_type == 'baseline_shift':
+            recommendations.extend(self._get_baseline_shift_recommendations(insight))
         
         return recommendations
     
@@ -607,6 +827,31 @@ Next Steps:
         
         return recommendations
     
+    def _get_baseline_shift_recommendations(self, insight):
+        """Recommendations for a lasting step up in an equipment's daily consumption"""
+        recommendations = [
+            {
+                'text': f'Review maintenance logs, setpoint changes and newly connected loads on {insight.equipment} around the date the shift started.',
+                'priority': 'high',
+                'estimated_savings': insight.potential_savings_inr * 0.4 if insight.potential_savings_inr else 5000,
+                'difficulty': 'low'
+            },
+            {
+                'text': f'Inspect {insight.equipment} for wear such as clogged filters, leaks, misalignment or failing bearings that raise its running load.',
+                'priority': 'high',
+                'estimated_savings': insight.potential_savings_inr * 0.3 if insight.potential_savings_inr else 4000,
+                'difficulty': 'medium'
+            },
+            {
+                'text': f'If the higher load is intended, update the energy budget for {insight.department} so future alerts use the new baseline.',
+                'priority': 'low',
+                'estimated_savings': 0,
+                'difficulty': 'low'
+            }
+        ]
+        
+        return recommendations
+    
     def _get_department_analysis(self, insight):
         """Get department-specific analysis"""
         dept = insight.department.lower()
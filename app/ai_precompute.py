@@ -0,0 +1,210 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from flask import current_app
+from app import db
+from app.ai_cache import get_analysis_cache
+from app.models import EnergyInsight, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+
+COUNTERS = ('queued', 'analyzed', 'cached', 'fallback', 'failed')
+
+class PrecomputeQueue:
+    """Background AI analysis of new insights, largest potential savings first
+
+    Daemon threads of this process take insights off a priority queue and
+    run the regular AIConsultant analysis, which stores the result in the
+    analysis cache and as AIRecommendation rows, so the first page view of
+    the insight is a DB read. Gemini calls go through the same rate limiter
+    and circuit breaker as interactive requests. Queued work is lost when
+    the process exits; those insights are analyzed on their first view.
+
+    Upload jobs usually run in pool processes, each with its own queue, so
+    every queue writes its counters to ai-precompute-<pid>.json in
+    stats_folder and stats() adds up the files of live processes.
+    """
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, stats_folder=None):
+        self.app = app
+        self.workers = max(1, workers)
+        self.stats_folder = stats_folder
+        if stats_folder:
+            os.makedirs(stats_folder, exist_ok=True)
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()  # FIFO among equal savings
+        self._pending = set()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.analyzed = 0
+        self.cached = 0
+        self.fallback = 0
+        self.failed = 0
+
+    def submit(self, user_id, insights):
+        """Queue (insight_id, potential_savings_inr) pairs; returns how many were not already pending"""
+        added = 0
+        with self._lock:
+            self._start_workers()
+            for insight_id, savings in insights:
+                if insight_id in self._pending:
+                    continue
+                self._pending.add(insight_id)
+                self._queue.put((-(savings or 0.0), next(self._order), user_id, insight_id))
+                added += 1
+            self.queued += added
+            self._publish()
+        return added
+
+    def join(self):
+        """Block until every queued analysis has finished"""
+        self._queue.join()
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'ai-precompute-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            _, _, user_id, insight_id = self._queue.get()
+            try:
+                self._analyze(user_id, insight_id)
+            except Exception as e:
+                logger.error(f"Background AI analysis of insight {insight_id} failed: {str(e)}")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self._pending.discard(insight_id)
+                    self._publish()
+                self._queue.task_done()
+
+    def _analyze(self, user_id, insight_id):
+        from app.ai_consultant import AIConsultant
+
+        with self.app.app_context():
+            insight = EnergyInsight.query.filter_by(id=insight_id, user_id=user_id).first()
+            if insight is None:
+                return
+            started = time.perf_counter()
+            consultant = AIConsultant(user=db.session.get(User, user_id))
+            analysis = consultant.get_insight_analysis(insight, user_id)
+
+            if analysis.get('cached'):
+                status = 'cached'
+            elif analysis.get('source') == 'automated':
+                status = 'fallback'  # not stored; the page view will ask Gemini again
+            else:
+                status = 'analyzed'
+            with self._lock:
+                setattr(self, status, getattr(self, status) + 1)
+            logger.info(f"Background AI analysis of insight {insight_id} ({status}, "
+                        f"₹{insight.potential_savings_inr or 0:,.0f} potential savings) in "
+                        f"{(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def _counters(self):
+        return {
+            'workers': len([thread for thread in self._threads if thread.is_alive()]),
+            'pending': len(self._pending),
+            **{name: getattr(self, name) for name in COUNTERS}
+        }
+
+    def _publish(self):
+        """Write this process's counters for stats() in other processes; call with the lock held"""
+        if not self.stats_folder:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.stats_folder, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._counters(), f)
+            os.replace(tmp_path, os.path.join(self.stats_folder, f'ai-precompute-{os.getpid()}.json'))
+        except OSError as e:
+            logger.warning(f"Could not write background analysis counters: {str(e)}")
+
+    def stats(self):
+        """Counters of every live process's queue, or of this process's without stats_folder"""
+        if not self.stats_folder:
+            with self._lock:
+                return self._counters()
+
+        totals = {'processes': 0, 'workers': 0, 'pending': 0, **{name: 0 for name in COUNTERS}}
+        for name in os.listdir(self.stats_folder):
+            if not (name.startswith('ai-precompute-') and name.endswith('.json')):
+                continue
+            path = os.path.join(self.stats_folder, name)
+            pid = name[len('ai-precompute-'):-len('.json')]
+            if not pid.isdigit():
+                continue
+            if not _process_alive(int(pid)):
+                # Counters of exited processes go with them, as they would in memory
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    counters = json.load(f)
+            except (OSError, ValueError):
+                continue
+            totals['processes'] += 1
+            for key in totals:
+                if key != 'processes':
+                    totals[key] += counters.get(key, 0)
+        return totals
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def get_precompute_queue(app=None):
+    """The app's PrecomputeQueue, built from AI_PRECOMPUTE_WORKERS on first use"""
+    app = app or current_app._get_current_object()
+    precompute = app.extensions.get('ai_precompute')
+    if precompute is None:
+        precompute = app.extensions.setdefault('ai_precompute', PrecomputeQueue(
+            app, app.config['AI_PRECOMPUTE_WORKERS'], app.config['JOB_STATE_FOLDER']
+        ))
+    return precompute
+
+def queue_upload_insights(user_id, upload_id):
+    """Queue background analysis of an upload's insights of AI_PRECOMPUTE_SEVERITY; returns how many were queued
+
+    Nothing is queued when the analysis cache is disabled (the result would
+    not be kept) or the user has no Gemini API key.
+    """
+    if not get_analysis_cache().enabled:
+        return 0
+    user = db.session.get(User, user_id)
+    if not ((user and user.gemini_api_key) or os.environ.get('GEMINI_API_KEY')):
+        return 0
+
+    query = db.session.query(EnergyInsight.id, EnergyInsight.potential_savings_inr).filter(
+        EnergyInsight.user_id == user_id,
+        EnergyInsight.upload_id == upload_id,
+        EnergyInsight.severity == current_app.config['AI_PRECOMPUTE_SEVERITY']
+    )
+    query = query.order_by(db.func.coalesce(EnergyInsight.potential_savings_inr, 0).desc(), EnergyInsight.id)
+    insights = query.limit(current_app.config['AI_PRECOMPUTE_MAX_INSIGHTS']).all()
+    if not insights:
+        return 0
+
+    queued = get_precompute_queue().submit(user_id, insights)
+    logger.info(f"Queued background AI analysis of {queued} insights from upload {upload_id} for user {user_id}")
+    return queued
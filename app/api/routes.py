@@ -1,32 +1,111 @@
-from flask import jsonify, request
+from flask import current_app, jsonify, request, url_for
 from flask_login import login_required, current_user
 from app.api import bp
 from app.models import EnergyData, EnergyInsight, AIRecommendation
 from app.energy_analyzer import EnergyAnalyzer
 from app.ai_consultant import AIConsultant
+from app.ai_batch import select_insights
+from app.jobs import JOB_STAGES, create_ai_batch_job, get_job_store
+from app.rollups import date_window, usage_summary
+from app.ai_cache import get_analysis_cache
+from app.cache import get_user_cache
+from app.gemini_clients import get_client_pool, key_fingerprint
+from app.rate_limit import get_rate_limiter
+from app.prompt_context import get_prompt_metrics
+from app.circuit_breaker import get_circuit_breaker
+from app.ai_precompute import get_precompute_queue
+from app.forecasting import LEVELS, MAX_HORIZON, METHODS, forecast_consumption
 
 @bp.route('/energy-stats')
 @login_required
 def energy_stats():
-    """Get energy statistics for dashboard"""
-    data = EnergyData.query.filter_by(user_id=current_user.id).order_by(EnergyData.timestamp.desc()).limit(100).all()
-    
-    stats = {
-        'total_consumption': sum(d.energy_kwh for d in data),
-        'total_cost': sum(d.cost_inr or 0 for d in data),
-        'anomaly_count': sum(1 for d in data if d.is_anomaly),
-        'department_breakdown': {}
-    }
+    """Get energy statistics for dashboard, optionally for a start_date/end_date window"""
+    try:
+        start, end = date_window(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
     
-    # Department breakdown
-    for record in data:
-        dept = record.department
-        if dept not in stats['department_breakdown']:
-            stats['department_breakdown'][dept] = 0
-        stats['department_breakdown'][dept] += record.energy_kwh
+    stats = get_user_cache().get_or_compute(
+        current_user, 'energy_stats', lambda: _energy_stats(current_user.id, start, end),
+        start_date=request.args.get('start_date'), end_date=request.args.get('end_date')
+    )
     
     return jsonify(stats)
 
+def _energy_stats(user_id, start=None, end=None):
+    summary = usage_summary(user_id, start, end)
+    
+    return {
+        'total_consumption': summary['total_consumption'],
+        'total_cost': summary['total_cost'],
+        'anomaly_count': summary['anomaly_count'],
+        'data_points': summary['data_points'],
+        'department_breakdown': summary['department_breakdown']
+    }
+
+@bp.route('/forecast')
+@login_required
+def forecast():
+    """Daily kWh forecast per department or equipment, e.g. ?horizon=30&level=department&method=ets"""
+    try:
+        horizon = int(request.args.get('horizon', 7))
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'horizon and limit must be whole numbers'}), 400
+    level = request.args.get('level', 'equipment')
+    method = request.args.get('method', 'ets')
+    
+    if not 1 <= horizon <= MAX_HORIZON:
+        return jsonify({'error': f'horizon must be between 1 and {MAX_HORIZON} days'}), 400
+    if level not in LEVELS:
+        return jsonify({'error': f"level must be one of: {', '.join(LEVELS)}"}), 400
+    if method not in METHODS:
+        return jsonify({'error': f"method must be one of: {', '.join(METHODS)}"}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be at least 1'}), 400
+    
+    # Forecasts only change when an upload changes the user's data version
+    result = get_user_cache().get_or_compute(
+        current_user, 'forecast', lambda: forecast_consumption(current_user.id, horizon, level, method, limit),
+        horizon=horizon, level=level, method=method, limit=limit
+    )
+    
+    return jsonify(result)
+
+@bp.route('/cache-stats')
+@login_required
+def cache_stats():
+    """Hit/miss counters of this worker's response and AI analysis caches, its Gemini client pool, call metrics and background analyses
+
+    These are shared by every user, so only ADMIN_EMAILS see them; anyone
+    else gets the rate limit and circuits of their own Gemini API key.
+    """
+    if current_user.email.lower() not in current_app.config['ADMIN_EMAILS']:
+        return jsonify(_own_key_stats(current_user.gemini_api_key))
+    
+    return jsonify({
+        **get_user_cache().stats(),
+        'ai_analysis': get_analysis_cache().stats(),
+        'gemini_clients': get_client_pool().stats(),
+        'gemini_rate_limits': get_rate_limiter().stats(),
+        'gemini_prompts': get_prompt_metrics().stats(),
+        'gemini_circuits': get_circuit_breaker().stats(),
+        'ai_precompute': get_precompute_queue().stats()
+    })
+
+def _own_key_stats(api_key):
+    """Rate limit and circuit entries of the user's own key; none for users on the shared key"""
+    if not api_key:
+        return {'gemini_rate_limits': {}, 'gemini_circuits': {'circuits': {}}}
+    
+    fingerprint = key_fingerprint(api_key)
+    circuits = get_circuit_breaker().stats()['circuits']
+    return {
+        'gemini_rate_limits': {key: limit for key, limit in get_rate_limiter().stats().items() if key == fingerprint},
+        'gemini_circuits': {'circuits': {name: circuit for name, circuit in circuits.items()
+                                         if name.endswith(f'-{fingerprint}')}}
+    }
+
 @bp.route('/analyze-insight/<int:insight_id>')
 @login_required
 def analyze_insight(insight_id):
@@ -40,6 +119,40 @@ def analyze_insight(insight_id):
     
     return jsonify(analysis)
 
+@bp.route('/analyze-insights', methods=['POST'])
+@login_required
+def analyze_insights():
+    """Queue AI analysis for several insights, e.g. {"insight_ids": [1, 2]} or {"severity": "high", "upload_id": 3}
+
+    Gemini rate limits can stretch a batch well past a request timeout, so it
+    runs as a background job; poll /api/jobs/<job_id> for the results.
+    """
+    payload = request.get_json(silent=True) or {}
+    max_insights = current_app.config['AI_BATCH_MAX_INSIGHTS']
+    
+    insight_ids = payload.get('insight_ids')
+    if insight_ids is not None:
+        if not isinstance(insight_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in insight_ids):
+            return jsonify({'error': 'insight_ids must be a list of integers'}), 400
+        insight_ids = list(dict.fromkeys(insight_ids))
+        if len(insight_ids) > max_insights:
+            return jsonify({'error': f'At most {max_insights} insights can be analyzed per request'}), 400
+    else:
+        severity = payload.get('severity', 'high')
+        if severity not in ('high', 'medium', 'low', None):
+            return jsonify({'error': 'severity must be high, medium, low or null'}), 400
+        upload_id = payload.get('upload_id')
+        if upload_id is not None and not isinstance(upload_id, int):
+            return jsonify({'error': 'upload_id must be an integer'}), 400
+        insight_ids = select_insights(current_user.id, severity, upload_id, max_insights)
+    
+    job = create_ai_batch_job(current_user.id, insight_ids, current_app.config['AI_BATCH_MAX_RETRIES'])
+    return jsonify({
+        'job_id': job['id'],
+        'insights': len(insight_ids),
+        'status_url': url_for('api.job_status', job_id=job['id'])
+    }), 202
+
 @bp.route('/insight/<int:insight_id>')
 @login_required
 def get_insight_details(insight_id):
@@ -88,3 +201,26 @@ def get_insight_details(insight_id):
     }
     
     return jsonify(details)
+
+@bp.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """Get stage and progress of a background job (upload, tariff repricing, rebuild after a deletion or batch AI analysis)"""
+    job = get_job_store().load(job_id)
+    if not job or job.get('user_id') != current_user.id:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'id': job['id'],
+        'type': job.get('type', 'upload'),
+        'file_name': job.get('file_name'),
+        'status': job.get('status'),
+        'stage': job.get('stage'),
+        'stages': JOB_STAGES[job.get('type', 'upload')],
+        'progress': job.get('progress', 0),
+        'message': job.get('message'),
+        'error': job.get('error'),
+        'result': job.get('result'),
+        'created_at': job.get('created_at'),
+        'updated_at': job.get('updated_at')
+    })
@@ -0,0 +1,201 @@
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import EnergyData, EnergyProfile
+
+logger = logging.getLogger(__name__)
+
+ALL_HOURS = -1  # hour_of_week of the series-wide profile
+SERIES_KEYS = ['department', 'equipment']
+PROFILE_KEYS = SERIES_KEYS + ['hour_of_week']
+PROFILE_COLUMNS = ['median_kwh', 'mad_kwh', 'sample_count']
+
+# Hour-of-week slots with fewer readings fall back to the series-wide profile
+MIN_SLOT_SAMPLES = 3
+
+# MAD * 1.4826 estimates the standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+
+HOURS_PER_WEEK = 168
+
+def hour_of_week(timestamps):
+    """0 for Monday 00:00 through 167 for Sunday 23:00"""
+    return timestamps.dt.dayofweek * 24 + timestamps.dt.hour
+
+def _factorize_series(df):
+    """Integer code per reading for its (department, equipment) series
+    
+    Returns the codes plus the department and equipment name of each code.
+    """
+    department_codes, departments = pd.factorize(df['department'])
+    equipment_codes, equipment = pd.factorize(df['equipment'])
+    codes, pairs = pd.factorize(department_codes.astype(np.int64) * len(equipment) + equipment_codes)
+    return codes.astype(np.int64), np.asarray(departments)[pairs // len(equipment)], np.asarray(equipment)[pairs % len(equipment)]
+
+def compute_profiles(df):
+    """Median/MAD per (department, equipment, hour-of-week), plus one all-hours row per series
+    
+    Series are factorized to integer codes once, so the groupbys run on
+    integer keys instead of re-hashing the department/equipment strings.
+    """
+    series_codes, departments, equipment = _factorize_series(df)
+    energy = df['energy_kwh'].to_numpy(dtype=float)
+    slot_keys = series_codes * HOURS_PER_WEEK + hour_of_week(df['timestamp']).to_numpy()
+    
+    slot_keys, slot_profile = _median_mad(slot_keys, energy)
+    series_keys, series_profile = _median_mad(series_codes, energy)
+    
+    slot_series = slot_keys // HOURS_PER_WEEK
+    slot_profile.index = pd.MultiIndex.from_arrays(
+        [departments[slot_series], equipment[slot_series], slot_keys % HOURS_PER_WEEK],
+        names=PROFILE_KEYS
+    )
+    series_profile.index = pd.MultiIndex.from_arrays(
+        [departments[series_keys], equipment[series_keys], np.full(len(series_keys), ALL_HOURS)],
+        names=PROFILE_KEYS
+    )
+    return pd.concat([slot_profile, series_profile])
+
+def _median_mad(keys, values):
+    """Median, MAD and count of values per integer key"""
+    groups, unique_keys = pd.factorize(keys)
+    grouped = pd.Series(values).groupby(groups)
+    median = grouped.median().to_numpy()
+    
+    # Median absolute deviation from each group's own median
+    deviation = pd.Series(np.abs(values - median[groups]))
+    mad = deviation.groupby(groups).median().to_numpy()
+    
+    profile = pd.DataFrame({
+        'median_kwh': median,
+        'mad_kwh': mad,
+        'sample_count': np.bincount(groups, minlength=len(unique_keys))
+    })
+    return unique_keys, profile
+
+def merge_profiles(old, new):
+    """Blend two profile frames weighted by sample count
+
+    Medians and MADs can't be combined exactly without the raw readings; the
+    count-weighted blend converges on them as more uploads arrive.
+    """
+    if old is None or old.empty:
+        return new
+    if new is None or new.empty:
+        return old
+    
+    old, new = old[PROFILE_COLUMNS].align(new[PROFILE_COLUMNS], join='outer')
+    old_count = old['sample_count'].fillna(0)
+    new_count = new['sample_count'].fillna(0)
+    weight = new_count / (old_count + new_count)
+    
+    def blend(column):
+        return old[column].fillna(new[column]) * (1 - weight) + new[column].fillna(old[column]) * weight
+    
+    return pd.DataFrame({
+        'median_kwh': blend('median_kwh'),
+        'mad_kwh': blend('mad_kwh'),
+        'sample_count': (old_count + new_count).astype(int)
+    })
+
+def score_readings(df, profiles, min_samples=MIN_SLOT_SAMPLES):
+    """Robust z-scores and absolute kWh deviations of readings against their profiles
+    
+    Readings without a usable profile (or whose profile has no spread) get a
+    z-score of 0 and never flag as anomalies.
+    """
+    series_codes, departments, equipment = _factorize_series(df)
+    
+    # Lookup table of every (series, slot) the batch can hit; the last column is ALL_HOURS
+    slots = np.append(np.arange(HOURS_PER_WEEK), ALL_HOURS)
+    lookup = profiles.reindex(pd.MultiIndex.from_arrays([
+        np.repeat(departments, len(slots)),
+        np.repeat(equipment, len(slots)),
+        np.tile(slots, len(departments))
+    ]))
+    shape = (len(departments), len(slots))
+    median = lookup['median_kwh'].to_numpy().reshape(shape)
+    mad = lookup['mad_kwh'].to_numpy().reshape(shape)
+    count = lookup['sample_count'].to_numpy(dtype=float).reshape(shape)
+    
+    slot = hour_of_week(df['timestamp']).to_numpy()
+    use_slot = count[series_codes, slot] >= min_samples
+    row_median = np.where(use_slot, median[series_codes, slot], median[series_codes, -1])
+    row_mad = np.where(use_slot, mad[series_codes, slot], mad[series_codes, -1])
+    
+    deviation = np.abs(df['energy_kwh'].to_numpy(dtype=float) - row_median)
+    spread = MAD_SCALE * row_mad
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_score = np.where(spread > 0, deviation / spread, 0.0)
+    
+    return np.nan_to_num(z_score), np.nan_to_num(deviation)
+
+def load_profiles(user_id):
+    """A user's persisted profiles, indexed by (department, equipment, hour_of_week)"""
+    query = db.session.query(
+        EnergyProfile.department,
+        EnergyProfile.equipment,
+        EnergyProfile.hour_of_week,
+        EnergyProfile.median_kwh,
+        EnergyProfile.mad_kwh,
+        EnergyProfile.sample_count
+    ).filter(EnergyProfile.user_id == user_id)
+    
+    profiles = pd.DataFrame(query.all(), columns=PROFILE_KEYS + PROFILE_COLUMNS)
+    return profiles.set_index(PROFILE_KEYS)
+
+def save_profiles(user_id, profiles, batch_size=5000):
+    """Upsert profiles for a user (same transaction as the upload)"""
+    if profiles is None or profiles.empty:
+        return 0
+    
+    records = profiles.reset_index()
+    records.insert(0, 'user_id', user_id)
+    records['updated_at'] = datetime.utcnow()
+    records = records.astype(object).to_dict('records')
+    
+    connection = db.session.connection()
+    statement = _upsert_statement(connection.dialect.name)
+    for start in range(0, len(records), batch_size):
+        connection.execute(statement, records[start:start + batch_size])
+    
+    return len(records)
+
+def rebuild_profiles(user_id, chunk_size=100000):
+    """Recompute a user's profiles from raw EnergyData (e.g. after deleting an upload)
+    
+    Chunks are blended like uploads are, so the result matches what the
+    remaining readings would have built.
+    """
+    EnergyProfile.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    
+    data_query = db.session.query(
+        EnergyData.timestamp,
+        EnergyData.department,
+        EnergyData.equipment,
+        EnergyData.energy_kwh
+    ).filter(EnergyData.user_id == user_id)
+    
+    profiles = None
+    for chunk in pd.read_sql(data_query.statement, db.session.connection(), chunksize=chunk_size,
+                             parse_dates=['timestamp']):
+        profiles = merge_profiles(profiles, compute_profiles(chunk))
+    
+    return save_profiles(user_id, profiles)
+
+def _upsert_statement(dialect_name):
+    table = EnergyProfile.__table__
+    statement = (postgresql if dialect_name == 'postgresql' else sqlite).insert(table)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=['user_id'] + PROFILE_KEYS,
+        set_={
+            'median_kwh': excluded.median_kwh,
+            'mad_kwh': excluded.mad_kwh,
+            'sample_count': excluded.sample_count,
+            'updated_at': excluded.updated_at
+        }
+    )
@@ -0,0 +1,73 @@
+import io
+import logging
+import time
+from app import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+
+def bulk_insert_dataframe(table, df, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream a DataFrame into a table in batches inside the current session transaction.
+
+    PostgreSQL uses COPY FROM STDIN, every other backend uses an executemany of a
+    core INSERT. The DataFrame columns must match the table column names.
+    Returns the number of rows written.
+    """
+    if df.empty:
+        return 0
+
+    batch_size = max(int(batch_size or DEFAULT_BATCH_SIZE), 1)
+    connection = db.session.connection()
+
+    if connection.dialect.name == 'postgresql':
+        _copy_batches(connection, table, df, batch_size)
+    else:
+        _insert_batches(connection, table, df, batch_size)
+
+    return len(df)
+
+def _iter_batches(df, batch_size):
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start:start + batch_size]
+
+def _insert_batches(connection, table, df, batch_size):
+    """executemany of a core INSERT, one round trip per batch"""
+    statement = table.insert()
+    for batch in _iter_batches(df, batch_size):
+        records = batch.astype(object).where(batch.notna(), None).to_dict('records')
+        connection.execute(statement, records)
+
+def _copy_batches(connection, table, df, batch_size):
+    """COPY FROM STDIN on the session's own DBAPI connection (psycopg2)"""
+    columns = ', '.join(f'"{column}"' for column in df.columns)
+    copy_sql = f'COPY "{table.name}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        for batch in _iter_batches(df, batch_size):
+            buffer = io.StringIO()
+            batch.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+
+class InsertTimer:
+    """Context manager that logs rows/sec for a bulk write"""
+
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._start
+        if exc_type is None:
+            rate = self.rows / self.elapsed if self.elapsed > 0 else float('inf')
+            logger.info(f"{self.label}: wrote {self.rows} rows in {self.elapsed:.2f}s ({rate:,.0f} rows/sec)")
+        return False
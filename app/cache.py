@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app import db
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache whose entries expire after ttl seconds"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class FileCache:
+    """Pickled entries on a shared folder so every gunicorn worker reuses them
+
+    Stale versions are never read again (the data version is part of the key)
+    and are swept once they are past their TTL.
+    """
+
+    name = 'filesystem'
+
+    def __init__(self, folder, ttl=300):
+        self.folder = folder
+        self.ttl = ttl
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha256(key.encode()).hexdigest() + '.cache')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if entry[0] < time.time():
+            return None
+        return entry
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + self.ttl, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+    def sweep(self):
+        """Remove expired entry files"""
+        now = time.time()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if os.path.getmtime(path) + self.ttl < now:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.folder) if name.endswith('.cache'))
+
+class UserCache:
+    """Per-user response cache keyed by (user, data version, view, params)
+
+    Bumping a user's data version makes every entry of that user unreachable,
+    so nothing has to be deleted when their data changes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, user, name, compute, **params):
+        if self.backend is None:
+            return compute()
+
+        key = f"{user.id}:{user.data_version or 0}:{name}:{sorted(params.items())}"
+        entry = self.backend.get(key)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            return entry[1]
+
+        value = compute()
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            logger.warning(f"Could not cache {name} for user {user.id}: {str(e)}")
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend.name if self.backend else 'none',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'entries': len(self.backend) if self.backend else 0
+        }
+
+def get_user_cache(app=None):
+    """The app's UserCache, built from RESPONSE_CACHE_* config on first use"""
+    app = app or current_app
+    cache = app.extensions.get('user_cache')
+    if cache is None:
+        backend_name = app.config['RESPONSE_CACHE_BACKEND']
+        ttl = app.config['RESPONSE_CACHE_TTL']
+        if backend_name == 'filesystem':
+            backend = FileCache(app.config['RESPONSE_CACHE_FOLDER'], ttl)
+            backend.sweep()
+        elif backend_name == 'memory':
+            backend = MemoryCache(app.config['RESPONSE_CACHE_MAX_ENTRIES'], ttl)
+        else:
+            backend = None
+        cache = app.extensions.setdefault('user_cache', UserCache(backend))
+    return cache
+
+def bump_data_version(user_id):
+    """Invalidate a user's cached responses; committed with the caller's transaction"""
+    User.query.filter_by(id=user_id).update(
+        {User.data_version: db.func.coalesce(User.data_version, 0) + 1},
+        synchronize_session=False
+    )
+
+def row_to_dict(row):
+    """Plain column values of a model instance, safe to keep across requests and pickle"""
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
@@ -0,0 +1,91 @@
+import numpy as np
+
+DEFAULT_HISTORY_DAYS = 90
+MIN_SEGMENT_DAYS = 7        # days of data needed on each side of a shift
+MIN_T_STATISTIC = 5.0       # two-sample t statistic of the level change
+MIN_RELATIVE_SHIFT = 0.15   # ignore shifts smaller than 15% of the old level
+
+def mean_shifts(matrix, min_segment=MIN_SEGMENT_DAYS):
+    """Most likely single level shift of every row of a [series, day] matrix
+
+    Every split day is scored at once from cumulative sums (a CUSUM of the
+    data and its squares): the two-sample t statistic of the mean after the
+    split against the mean before it, with the pooled within-segment spread.
+    Missing days (NaN) are skipped. Returns, per series, the column where
+    the new level starts (-1 when no split has enough data on both sides),
+    the t statistic, and the mean before and after.
+    """
+    series_count, day_count = matrix.shape
+    if not day_count:
+        return np.full(series_count, -1), np.zeros(series_count), np.full(series_count, np.nan), np.full(series_count, np.nan)
+
+    observed = ~np.isnan(matrix)
+    values = np.where(observed, matrix, 0.0)
+
+    # Sums over days [0, k] for every split k; the last column holds the totals
+    count = np.cumsum(observed, axis=1, dtype=float)
+    total = np.cumsum(values, axis=1)
+    squares = np.cumsum(values ** 2, axis=1)
+    count_all, total_all, squares_all = count[:, -1:], total[:, -1:], squares[:, -1:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        before_n, after_n = count, count_all - count
+        before_mean = total / before_n
+        after_mean = (total_all - total) / after_n
+        within = (squares - total ** 2 / before_n) + ((squares_all - squares) - (total_all - total) ** 2 / after_n)
+        variance = within / (count_all - 2)
+        t_statistic = (after_mean - before_mean) / np.sqrt(variance * (1 / before_n + 1 / after_n))
+
+    # The new level has to start on an observed day, with enough days on both sides
+    starts_observed = np.zeros_like(observed)
+    starts_observed[:, :-1] = observed[:, 1:]
+    valid = starts_observed & (before_n >= min_segment) & (after_n >= min_segment) & (variance > 0)
+    scores = np.where(valid, t_statistic, -np.inf)
+
+    split = np.argmax(scores, axis=1)
+    rows = np.arange(series_count)
+    has_split = np.isfinite(scores[rows, split])
+
+    return (
+        np.where(has_split, split + 1, -1),
+        np.where(has_split, scores[rows, split], 0.0),
+        np.where(has_split, before_mean[rows, split], np.nan),
+        np.where(has_split, after_mean[rows, split], np.nan)
+    )
+
+def baseline_shifts(series, matrix, days, min_segment=MIN_SEGMENT_DAYS,
+                    min_t=MIN_T_STATISTIC, min_relative=MIN_RELATIVE_SHIFT):
+    """Upward level shifts that are significant and large enough, one row per series"""
+    start, t_statistic, before, after = mean_shifts(matrix, min_segment)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = (after - before) / before
+    found = (start >= 0) & (t_statistic >= min_t) & (relative >= min_relative)
+
+    shifts = series[found].to_frame(index=False)
+    shifts['shift_date'] = days[start[found]]
+    shifts['before_kwh_per_day'] = before[found]
+    shifts['after_kwh_per_day'] = after[found]
+    shifts['relative_shift'] = relative[found]
+    shifts['t_statistic'] = t_statistic[found]
+    return shifts.sort_values('relative_shift', ascending=False, ignore_index=True)
+
+def baseline_shift_insights(shifts, rate):
+    """One insight per shifted series; savings assume the old level can be restored for a month"""
+    insights = []
+
+    for shift in shifts.itertuples(index=False):
+        excess_kwh = shift.after_kwh_per_day - shift.before_kwh_per_day
+        potential_savings = excess_kwh * 30 * rate
+
+        insights.append({
+            'insight_type': 'baseline_shift',
+            'title': f'Baseline Shift - {shift.equipment}',
+            'description': f'Daily consumption of {shift.equipment} in {shift.department} department stepped up from {shift.before_kwh_per_day:.2f} kWh to {shift.after_kwh_per_day:.2f} kWh per day (+{shift.relative_shift * 100:.1f}%) starting {shift.shift_date.strftime("%Y-%m-%d")}, and has stayed at the new level. Check for setting changes, wear or new load on this equipment around that date.',
+            'department': shift.department,
+            'equipment': shift.equipment,
+            'severity': 'high' if shift.relative_shift >= 0.5 else 'medium',
+            'potential_savings_inr': potential_savings
+        })
+
+    return insights
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from app.gemini_clients import key_fingerprint
+from app.rate_limit import is_quota_error
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_THRESHOLD = 3  # consecutive failures that open a circuit
+DEFAULT_OPEN_SECONDS = 60      # first open period; doubled each time a half-open probe fails
+MAX_OPEN_SECONDS = 600
+PROBE_TIMEOUT = 60             # seconds before another caller may probe if the probe never reports back
+
+# Errors that say the model is unusable for a while: quota, server errors and unknown model
+TRIPPING_STATUS_CODES = {404, 429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """Every Gemini model's circuit is open for this API key"""
+
+def is_tripping_error(error):
+    """Whether a Gemini exception counts against the circuit of the model that raised it"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and code in TRIPPING_STATUS_CODES:
+        return True
+    return is_quota_error(error) or str(error).startswith(tuple(str(code) for code in TRIPPING_STATUS_CODES))
+
+class CircuitBreaker:
+    """Per model and API key circuit breaker whose state is shared through files
+
+    closed: calls go through; failures in a row are counted and
+    failure_threshold of them open the circuit. open: calls are refused
+    until open_seconds have passed. half_open: one caller probes the model;
+    success closes the circuit, failure opens it again for twice as long.
+    One small JSON file per circuit (locked with flock where available) lets
+    every thread and gunicorn worker see the same state, like the job store.
+    """
+
+    def __init__(self, folder, failure_threshold=DEFAULT_FAILURE_THRESHOLD, open_seconds=DEFAULT_OPEN_SECONDS):
+        self.folder = folder
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.open_seconds > 0
+
+    def _path(self, model_name, api_key):
+        return os.path.join(self.folder, f'{model_name}-{key_fingerprint(api_key or "")}.json')
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'closed', 'failures': 0, 'open_until': 0.0, 'open_seconds': 0,
+                    'probe_until': 0.0, 'opened': 0, 'half_opened': 0, 'closed': 0, 'rejected': 0}
+
+    def _save(self, path, circuit):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(circuit, f)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def _circuit(self, model_name, api_key):
+        """Read-modify-write one circuit's state under a thread lock and, across processes, an flock"""
+        path = self._path(model_name, api_key)
+        with self._lock:
+            if fcntl is None:
+                yield path, self._load(path)
+                return
+            with open(path + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield path, self._load(path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def allow(self, model_name, api_key):
+        """Whether a call to model_name may go out now; the first caller after the open period becomes the probe"""
+        if not self.enabled:
+            return True
+        with self._circuit(model_name, api_key) as (path, circuit):
+            now = time.time()
+            if circuit['state'] == 'closed':
+                return True
+            if circuit['state'] == 'open' and now >= circuit['open_until']:
+                circuit.update(state='half_open', probe_until=now + PROBE_TIMEOUT, half_opened=circuit['half_opened'] + 1)
+                self._save(path, circuit)
+                logger.info(f"Gemini circuit {model_name}/{key_fingerprint(api_key or '')} half-open; probing")
+                return True
+            if circuit['state'] == 'half_open' and now >= circuit['probe_until']:
+                circuit['probe_until'] = now + PROBE_TIMEOUT  # the previous probe never reported back
+                self._save(path, circuit)
+                return True
+            circuit['rejected'] += 1
+            self._save(path, circuit)
+            return False
+
+    def record_success(self, model_name, api_key):
+        if not self.enabled:
+            return
+        with self._circuit(model_name, api_key) as (path, circuit):
+            if circuit['state'] == 'closed' and not circuit['failures']:
+                return
+            if circuit['state'] != 'closed':
+                circuit['closed'] += 1
+                logger.info(f"Gemini circuit {model_name}/{key_fingerprint(api_key or '')} closed")
+            circuit.update(state='closed', failures=0, open_seconds=0)
+            self._save(path, circuit)
+
+    def record_failure(self, model_name, api_key):
+        """Count a tripping error; opens the circuit at the threshold or when a half-open probe fails"""
+        if not self.enabled:
+            return
+        with self._circuit(model_name, api_key) as (path, circuit):
+            circuit['failures'] += 1
+            if circuit['state'] == 'half_open' or (circuit['state'] == 'closed' and circuit['failures'] >= self.failure_threshold):
+                open_seconds = min(MAX_OPEN_SECONDS, circuit['open_seconds'] * 2 or self.open_seconds)
+                circuit.update(state='open', open_until=time.time() + open_seconds, open_seconds=open_seconds,
+                               opened=circuit['opened'] + 1)
+                logger.warning(f"Gemini circuit {model_name}/{key_fingerprint(api_key or '')} open for {open_seconds}s "
+                               f"after {circuit['failures']} failures")
+            self._save(path, circuit)
+
+    def record_hedge(self, won):
+        with self._lock:
+            self.hedges += 1
+            self.hedge_wins += int(won)
+
+    def stats(self):
+        """State and transition counts of every circuit, plus this process's hedged calls"""
+        circuits = {}
+        now = time.time()
+        for name in sorted(os.listdir(self.folder)):
+            if not name.endswith('.json'):
+                continue
+            circuit = self._load(os.path.join(self.folder, name))
+            circuits[name[:-len('.json')]] = {
+                'state': circuit['state'],
+                'failures': circuit['failures'],
+                'open_seconds_left': round(max(0.0, circuit['open_until'] - now), 1) if circuit['state'] == 'open' else 0.0,
+                'opened': circuit['opened'],
+                'half_opened': circuit['half_opened'],
+                'closed': circuit['closed'],
+                'rejected': circuit['rejected']
+            }
+        with self._lock:
+            return {'circuits': circuits, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins}
+
+def get_circuit_breaker(app=None):
+    """The app's CircuitBreaker, built from GEMINI_BREAKER_* config on first use"""
+    app = app or current_app
+    breaker = app.extensions.get('gemini_circuit_breaker')
+    if breaker is None:
+        breaker = app.extensions.setdefault('gemini_circuit_breaker', CircuitBreaker(
+            app.config['GEMINI_BREAKER_FOLDER'],
+            app.config['GEMINI_BREAKER_FAILURES'],
+            app.config['GEMINI_BREAKER_OPEN_SECONDS']
+        ))
+    return breaker
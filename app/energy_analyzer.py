@@ -1,45 +1,358 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from app.models import EnergyData, EnergyInsight, db
+from flask import current_app, has_app_context
+from app.models import EnergyData, EnergyInsight, Upload, db
+from app.cache import bump_data_version
+from app.bulk_insert import DEFAULT_BATCH_SIZE, InsertTimer, bulk_insert_dataframe
+from app.memory_monitor import PeakMemoryMonitor
+from app.running_stats import (SERIES_KEYS, batch_moments, group_moments, load_running_stats, merge_moments,
+                               moments_to_baseline, save_running_stats)
+from app.rollups import update_rollups
+from app.baselines import compute_profiles, load_profiles, merge_profiles, save_profiles, score_readings
+from app.insight_rules import InsightEngine
+from app.tariffs import compile_rates, default_energy_rate, load_tariff, price_readings
+from app.multivariate import (DEFAULT_MODEL_SCOPE, DEFAULT_RETRAIN_INTERVAL, DEFAULT_TRAINING_ROWS, ModelStore,
+                              get_detector)
+from app.ai_precompute import queue_upload_insights
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CSV_CHUNK_SIZE = 100000
+DEFAULT_ANOMALY_METHOD = 'seasonal'  # or 'zscore' for per-department mean/std, 'multivariate' for IsolationForest
+
+# Methods that score readings against the hour-of-week profiles (and keep them up to date)
+PROFILE_METHODS = ('seasonal', 'multivariate')
+
+# Columns filled in by the insight builders; user/upload columns are added on save
+INSIGHT_COLUMNS = ['insight_type', 'title', 'description', 'department', 'equipment', 'severity', 'potential_savings_inr']
+
 class EnergyAnalyzer:
-    def __init__(self):
-        self.industrial_energy_rate = 8.50  # INR per kWh for Indian industries
+    def __init__(self, progress_callback=None):
+        self.industrial_energy_rate = default_energy_rate()  # INR per kWh, replaced by the user's tariff
+        self.rates = compile_rates()  # INR per kWh for each hour of the week
         self.anomaly_threshold = 2.0  # Standard deviations for anomaly detection
+        self.seasonal_anomaly_threshold = 3.5  # Robust (median/MAD) z-score for seasonal profiles
+        self.anomaly_method = current_app.config.get('ANOMALY_METHOD', DEFAULT_ANOMALY_METHOD) if has_app_context() else DEFAULT_ANOMALY_METHOD
+        self.batch_size = current_app.config.get('ENERGY_DATA_BATCH_SIZE', DEFAULT_BATCH_SIZE) if has_app_context() else DEFAULT_BATCH_SIZE
+        self.chunk_size = current_app.config.get('CSV_CHUNK_SIZE', DEFAULT_CSV_CHUNK_SIZE) if has_app_context() else DEFAULT_CSV_CHUNK_SIZE
+        
+        # IsolationForest settings for the multivariate method
+        config = current_app.config if has_app_context() else {}
+        self.model_scope = config.get('MULTIVARIATE_MODEL_SCOPE', DEFAULT_MODEL_SCOPE)
+        self.training_rows = config.get('MULTIVARIATE_TRAINING_ROWS', DEFAULT_TRAINING_ROWS)
+        self.model_folder = config.get('MULTIVARIATE_MODEL_FOLDER', os.path.join('uploads', 'models'))
+        self.retrain_interval = config.get('MULTIVARIATE_RETRAIN_INTERVAL', DEFAULT_RETRAIN_INTERVAL)
+        
+        # Queue background AI analysis of the upload's new high-severity insights
+        self.precompute_ai = config.get('AI_PRECOMPUTE_ON_UPLOAD', False)
+        
+        # Optional progress(stage, percent) hook used by background upload jobs
+        self.progress_callback = progress_callback
         
-    def process_energy_data(self, df, user_id):
-        """Process uploaded CSV data and generate insights"""
+        # Filled in by each processing run
+        self.records_saved = 0
+        self.duplicates_skipped = 0
+        self.peak_memory_mb = None
+        self.upload = None
+        self.detector_timings = None
+        self.insight_timings = None
+        self.ai_analyses_queued = 0
+        
+    def process_energy_data(self, df, user_id, content_sha256=None, precompute_ai=None):
+        """Process uploaded CSV data and generate insights
+        
+        precompute_ai (default AI_PRECOMPUTE_ON_UPLOAD) queues background AI
+        analysis of the new insights once the upload is committed.
+        """
         try:
-            # Extract file name from dataframe if available
+            memory = PeakMemoryMonitor()
+            
+            # Extract file name and upload date from dataframe if available
             file_name = df['file_name'].iloc[0] if 'file_name' in df.columns else None
+            upload_date = df['upload_date'].iloc[0] if 'upload_date' in df.columns else None
+            self.upload = self._create_upload(user_id, file_name, upload_date)
+            self._load_tariff(user_id)
             
-            # Clean and validate data
+            # Clean and validate data, skipping readings an earlier upload already stored
+            self._report_progress('clean', 10)
             df = self._clean_data(df)
+            df = self._drop_existing_readings(df, user_id)
+            if df.empty:
+                self._discard_empty_upload(user_id)
+                return 0
             
-            # Calculate costs
-            df['cost_inr'] = df['energy_kwh'] * self.industrial_energy_rate
+            # Calculate costs from the user's time-of-use tariff
+            df['cost_inr'] = price_readings(df, self.rates)
+            
+            # Fold the batch into the user's running statistics (O(batch), no history scan)
+            running_stats = merge_moments(load_running_stats(user_id), batch_moments(df, SERIES_KEYS))
             
             # Detect anomalies
-            df = self._detect_anomalies(df)
+            self._report_progress('detect', 25)
+            if self.anomaly_method in PROFILE_METHODS:
+                profiles = merge_profiles(load_profiles(user_id), compute_profiles(df))
+                if self.anomaly_method == 'multivariate':
+                    detector = self._get_detector(user_id, profiles, fallback=df)
+                    df = self._detect_multivariate_anomalies(df, detector, profiles)
+                else:
+                    df = self._detect_seasonal_anomalies(df, profiles)
+                save_profiles(user_id, profiles, self.batch_size)
+            else:
+                df = self._detect_anomalies(df, moments_to_baseline(group_moments(running_stats)))
+            memory.sample()
             
             # Save to database
-            records_saved = self._save_energy_data(df, user_id)
+            self._report_progress('persist', 40)
+            save_running_stats(user_id, running_stats, self.batch_size)
+            self._record_upload_stats(self.upload, df)
+            update_rollups(df, user_id, self.batch_size)
+            self.records_saved = self._save_energy_data(df, user_id, self.upload.id)
             
             # Generate insights
-            insights_generated = self._generate_insights(df, user_id, file_name)
+            self._report_progress('insights', 75)
+            insights_generated = self._generate_insights(df, user_id, file_name, self.upload.id)
             
+            # Only a fully processed upload is matched by later byte-identical uploads
+            self.upload.content_sha256 = content_sha256
+            
+            # Invalidate the user's cached dashboard/stats responses and commit
+            # readings, rollups and insights as one transaction
+            bump_data_version(user_id)
+            db.session.commit()
+            
+            memory.sample()
+            self.peak_memory_mb = memory.peak_mb
+            logger.info(f"Processed {self.records_saved} records for user {user_id} ({memory.describe()})")
+            
+            if insights_generated:
+                self._queue_ai_analysis(user_id, precompute_ai)
             return insights_generated
             
         except Exception as e:
             logger.error(f"Error processing energy data: {str(e)}")
+            db.session.rollback()
+            raise
+    
+    def process_energy_file(self, filepath, user_id, file_name=None, upload_date=None, content_sha256=None,
+                            precompute_ai=None):
+        """Stream a CSV file in chunks so memory stays bounded regardless of file size.
+        
+        A first pass reads only the columns needed for the anomaly baselines; the
+        second pass cleans, costs, scores and persists one chunk at a time.
+        Readings already stored (by earlier uploads or earlier chunks) are skipped.
+        Everything is written in one transaction, committed once at the end.
+        precompute_ai works as in process_energy_data.
+        """
+        try:
+            memory = PeakMemoryMonitor()
+            started = time.perf_counter()
+            self.upload = self._create_upload(user_id, file_name, upload_date)
+            upload_id = self.upload.id
+            upload_date = self.upload.upload_date
+            self._load_tariff(user_id)
+            
+            # Pass 1: department baselines or hour-of-week profiles
+            self._report_progress('parse', 0)
+            stored_stats = load_running_stats(user_id)
+            detector = None
+            if self.anomaly_method in PROFILE_METHODS:
+                stored_profiles = load_profiles(user_id)
+                file_profiles, total_rows = self._compute_file_profiles(filepath, user_id)
+                profiles = merge_profiles(stored_profiles, file_profiles)
+                if self.anomaly_method == 'multivariate':
+                    detector = self._get_detector(user_id, profiles)
+            else:
+                file_moments, total_rows = self._compute_file_moments(filepath, user_id)
+                baselines = moments_to_baseline(group_moments(merge_moments(stored_stats, file_moments)))
+            memory.sample()
+            
+            # Pass 2: clean, cost, score and persist chunk by chunk
+            self.records_saved = 0
+            rows_read = 0
+            saved_moments = None
+            saved_profiles = None
+            engine = InsightEngine(self.industrial_energy_rate, user_id=user_id)
+            
+            for chunk in pd.read_csv(filepath, chunksize=self.chunk_size):
+                # Chunks span 10-80% of the job, the whole-file insights the rest
+                done = 10 + 70 * rows_read / max(total_rows, 1)
+                rows_read += len(chunk)
+                
+                chunk['file_name'] = file_name
+                chunk['upload_date'] = upload_date
+                
+                self._report_progress('clean', done)
+                chunk = self._drop_existing_readings(self._clean_data(chunk), user_id)
+                if chunk.empty:
+                    continue
+                
+                chunk['cost_inr'] = price_readings(chunk, self.rates)
+                self._report_progress('detect', done)
+                if self.anomaly_method == 'multivariate':
+                    # A user without stored readings gets a model trained on the first chunk
+                    detector = detector or self._get_detector(user_id, profiles, fallback=chunk)
+                    chunk = self._detect_multivariate_anomalies(chunk, detector, profiles)
+                elif self.anomaly_method == 'seasonal':
+                    chunk = self._detect_seasonal_anomalies(chunk, profiles)
+                else:
+                    chunk = self._detect_anomalies(chunk, baselines)
+                
+                self._report_progress('persist', done)
+                self._record_upload_stats(self.upload, chunk)
+                update_rollups(chunk, user_id, self.batch_size)
+                self.records_saved += self._save_energy_data(chunk, user_id, upload_id)
+                saved_moments = merge_moments(saved_moments, batch_moments(chunk, SERIES_KEYS))
+                if self.anomaly_method in PROFILE_METHODS:
+                    saved_profiles = merge_profiles(saved_profiles, compute_profiles(chunk))
+                
+                # Keep only the small aggregates the whole-file insight rules need
+                engine.add(chunk)
+                
+                memory.sample()
+            
+            if not self.records_saved:
+                self._discard_empty_upload(user_id)
+                return 0
+            
+            self._report_progress('insights', 80)
+            insights = engine.run()
+            insights_generated = self._save_insights(insights, user_id, file_name, upload_id)
+            self.insight_timings = engine.timings
+            
+            # Persist baselines of the readings actually saved, as the in-memory path does
+            if saved_profiles is not None:
+                save_profiles(user_id, merge_profiles(stored_profiles, saved_profiles), self.batch_size)
+            if saved_moments is not None:
+                save_running_stats(user_id, merge_moments(stored_stats, saved_moments), self.batch_size)
+            
+            self.upload.content_sha256 = content_sha256
+            bump_data_version(user_id)
+            db.session.commit()
+            
+            memory.sample()
+            self.peak_memory_mb = memory.peak_mb
+            elapsed = time.perf_counter() - started
+            logger.info(f"Streamed {self.records_saved} records from {file_name or filepath} for user {user_id} "
+                        f"in {elapsed:.2f}s ({self.records_saved / max(elapsed, 1e-9):,.0f} rows/sec, {memory.describe()})")
+            
+            if insights_generated:
+                self._queue_ai_analysis(user_id, precompute_ai)
+            return insights_generated
+            
+        except Exception as e:
+            logger.error(f"Error processing energy file: {str(e)}")
+            db.session.rollback()
             raise
     
+    def _queue_ai_analysis(self, user_id, precompute_ai=None):
+        """Hand the committed upload's new insights to the background AI analysis pool"""
+        if not (self.precompute_ai if precompute_ai is None else precompute_ai) or not has_app_context():
+            return
+        try:
+            self.ai_analyses_queued = queue_upload_insights(user_id, self.upload.id)
+        except Exception as e:
+            # The upload itself is already committed; its insights are analyzed on first view instead
+            logger.warning(f"Could not queue AI analysis for upload {self.upload.id}: {str(e)}")
+    
+    def _create_upload(self, user_id, file_name=None, upload_date=None):
+        """Register the upload so readings and insights can reference it"""
+        upload = Upload(
+            user_id=user_id,
+            file_name=file_name,
+            upload_date=pd.Timestamp(upload_date).to_pydatetime() if upload_date is not None else datetime.utcnow(),
+            row_count=0,
+            total_energy_kwh=0.0,
+            total_cost_inr=0.0,
+            anomaly_count=0,
+            department_totals={}
+        )
+        db.session.add(upload)
+        db.session.flush()
+        return upload
+    
+    def _discard_empty_upload(self, user_id):
+        """Roll back the upload row of a file with no new readings; nothing else was written and cached responses stay valid"""
+        db.session.rollback()
+        self.upload = None
+        logger.info(f"No new readings for user {user_id} ({self.duplicates_skipped} already stored); upload not recorded")
+    
+    def _record_upload_stats(self, upload, df):
+        """Fold a cleaned and scored batch into the upload's aggregates"""
+        if df.empty:
+            return
+        
+        upload.row_count += len(df)
+        upload.total_energy_kwh += float(df['energy_kwh'].sum())
+        upload.total_cost_inr += float(df['cost_inr'].sum())
+        upload.anomaly_count += int(df['is_anomaly'].sum())
+        
+        start_time = df['timestamp'].min().to_pydatetime()
+        end_time = df['timestamp'].max().to_pydatetime()
+        upload.start_time = min(upload.start_time, start_time) if upload.start_time else start_time
+        upload.end_time = max(upload.end_time, end_time) if upload.end_time else end_time
+        
+        # Reassign so the JSON column is flagged as changed
+        totals = dict(upload.department_totals or {})
+        for dept, consumption in df.groupby('department')['energy_kwh'].sum().items():
+            totals[dept] = totals.get(dept, 0.0) + float(consumption)
+        upload.department_totals = totals
+    
+    def _load_tariff(self, user_id):
+        """Compile the user's tariff into the hour-of-week rate table used for cost_inr"""
+        tariff = load_tariff(user_id)
+        self.rates = compile_rates(tariff)
+        if tariff:
+            self.industrial_energy_rate = tariff.energy_rate_inr
+    
+    def _report_progress(self, stage, percent):
+        if self.progress_callback:
+            self.progress_callback(stage, percent)
+    
+    def _compute_file_moments(self, filepath, user_id):
+        """Lightweight first pass: per-(department, equipment) moments merged chunk by chunk.
+        
+        Returns the moments and the raw row count of the file.
+        """
+        moments = None
+        total_rows = 0
+        
+        for rows, chunk in self._first_pass_chunks(filepath, user_id):
+            total_rows += rows
+            if not chunk.empty:
+                moments = merge_moments(moments, batch_moments(chunk, SERIES_KEYS))
+        
+        return moments, total_rows
+    
+    def _compute_file_profiles(self, filepath, user_id):
+        """Lightweight first pass: hour-of-week profiles blended chunk by chunk.
+        
+        Returns the profiles and the raw row count of the file.
+        """
+        profiles = None
+        total_rows = 0
+        
+        for rows, chunk in self._first_pass_chunks(filepath, user_id):
+            total_rows += rows
+            if not chunk.empty:
+                profiles = merge_profiles(profiles, compute_profiles(chunk))
+        
+        return profiles, total_rows
+    
+    def _first_pass_chunks(self, filepath, user_id):
+        """Yield each chunk's raw row count and its new readings, cleaned as in pass 2
+        
+        Readings already stored are left out so the scoring baselines match
+        the in-memory path. Only duplicates that fall in two different chunks
+        are still counted here; pass 2 drops them before anything is saved.
+        """
+        columns = ['timestamp', 'energy_kwh', 'department', 'equipment']
+        for chunk in pd.read_csv(filepath, usecols=columns, chunksize=self.chunk_size):
+            yield len(chunk), self._drop_existing_readings(self._clean_data(chunk), user_id, count_skipped=False)
+    
     def _clean_data(self, df):
         """Clean and validate the energy data"""
         # Convert timestamp to datetime
@@ -59,175 +372,154 @@ class EnergyAnalyzer:
         
         return df
     
-    def _detect_anomalies(self, df):
-        """Detect energy consumption anomalies using statistical methods"""
-        # Calculate baseline statistics for each department
-        dept_stats = {}
-        
-        for dept in df['department'].unique():
-            dept_data = df[df['department'] == dept]['energy_kwh']
-            dept_stats[dept] = {
-                'mean': dept_data.mean(),
-                'std': dept_data.std(),
-                'median': dept_data.median()
-            }
-        
-        # Detect anomalies based on department baselines
-        anomalies = []
-        for idx, row in df.iterrows():
-            dept = row['department']
-            consumption = row['energy_kwh']
-            
-            if dept in dept_stats:
-                stats = dept_stats[dept]
-                z_score = abs(consumption - stats['mean']) / stats['std'] if stats['std'] > 0 else 0
-                
-                # Mark as anomaly if significantly different from baseline
-                is_anomaly = z_score > self.anomaly_threshold
-                anomalies.append(is_anomaly)
-            else:
-                anomalies.append(False)
+    def _drop_existing_readings(self, df, user_id, count_skipped=True):
+        """Anti-join a cleaned batch against the user's stored (timestamp, department, equipment) keys"""
+        if df.empty:
+            return df
+        
+        keys = ['timestamp', 'department', 'equipment']
+        existing_query = db.session.query(
+            EnergyData.timestamp, EnergyData.department, EnergyData.equipment
+        ).filter(
+            EnergyData.user_id == user_id,
+            EnergyData.timestamp >= df['timestamp'].min().to_pydatetime(),
+            EnergyData.timestamp <= df['timestamp'].max().to_pydatetime()
+        )
+        existing = pd.DataFrame(existing_query.all(), columns=keys)
+        if existing.empty:
+            return df
+        
+        existing['timestamp'] = pd.to_datetime(existing['timestamp'])
+        merged = df.merge(existing.drop_duplicates(), on=keys, how='left', indicator=True)
+        is_new = (merged['_merge'] == 'left_only').to_numpy()
+        
+        skipped = int((~is_new).sum())
+        if skipped and count_skipped:
+            self.duplicates_skipped += skipped
+            logger.info(f"Skipping {skipped} readings already stored for user {user_id}")
+        return df[is_new]
+    
+    def _detect_anomalies(self, df, baselines=None):
+        """Detect energy consumption anomalies using statistical methods
+        
+        baselines is an optional frame of per-department mean/std (normally the
+        user's persisted running statistics); when omitted they are computed
+        from df itself.
+        """
+        # Baseline statistics for each department, broadcast back onto every row
+        if baselines is None:
+            dept_groups = df.groupby('department', sort=False)['energy_kwh']
+            dept_mean = dept_groups.transform('mean')
+            dept_std = dept_groups.transform('std')
+        else:
+            dept_mean = df['department'].map(baselines['mean'])
+            dept_std = df['department'].map(baselines['std'])
+        
+        # Deviation from the department baseline
+        deviation = (df['energy_kwh'] - dept_mean).abs()
         
-        df['is_anomaly'] = anomalies
-        df['anomaly_score'] = [abs(row['energy_kwh'] - dept_stats.get(row['department'], {}).get('mean', row['energy_kwh'])) 
-                               for idx, row in df.iterrows()]
+        # Mark as anomaly if significantly different from baseline
+        # (departments with zero or undefined spread never flag anomalies)
+        has_spread = dept_std > 0
+        z_score = (deviation / dept_std.where(has_spread)).fillna(0)
+        
+        df['is_anomaly'] = (z_score > self.anomaly_threshold).to_numpy()
+        df['anomaly_score'] = deviation.to_numpy()
         
         return df
     
-    def _save_energy_data(self, df, user_id):
-        """Save energy data to database"""
-        records_saved = 0
-        
-        for _, row in df.iterrows():
-            energy_record = EnergyData(
-                user_id=user_id,
-                timestamp=row['timestamp'],
-                energy_kwh=row['energy_kwh'],
-                department=row['department'],
-                equipment=row['equipment'],
-                building=row.get('building', ''),
-                cost_inr=row['cost_inr'],
-                is_anomaly=row['is_anomaly'],
-                anomaly_score=row['anomaly_score'],
-                file_name=row.get('file_name'),
-                upload_date=row.get('upload_date')
-            )
-            
-            db.session.add(energy_record)
-            records_saved += 1
-        
-        db.session.commit()
-        return records_saved
-    
-    def _generate_insights(self, df, user_id, file_name=None):
-        """Generate energy insights from the data"""
-        insights_generated = 0
-        
-        # 1. Detect significant spikes
-        spike_insights = self._detect_energy_spikes(df, user_id, file_name)
-        insights_generated += len(spike_insights)
-        
-        # 2. Identify high consumption departments
-        high_consumption_insights = self._identify_high_consumption(df, user_id, file_name)
-        insights_generated += len(high_consumption_insights)
-        
-        # 3. Analyze trends
-        trend_insights = self._analyze_trends(df, user_id, file_name)
-        insights_generated += len(trend_insights)
-        
-        return insights_generated
-    
-    def _detect_energy_spikes(self, df, user_id, file_name=None):
-        """Detect and create insights for energy spikes"""
-        insights = []
-        
-        # Find significant anomalies
-        anomalies = df[df['is_anomaly'] == True]
-        
-        for _, row in anomalies.iterrows():
-            # Calculate potential savings (assuming 30% reduction possible)
-            potential_savings = row['energy_kwh'] * 0.3 * self.industrial_energy_rate
-            
-            insight = EnergyInsight(
-                user_id=user_id,
-                insight_type='spike',
-                title=f'Energy Spike Detected - {row["department"]}',
-                description=f'Unusual energy consumption of {row["energy_kwh"]:.2f} kWh detected in {row["department"]} department on {row["timestamp"].strftime("%Y-%m-%d %H:%M")}. This is significantly higher than the normal consumption pattern.',
-                department=row['department'],
-                equipment=row['equipment'],
-                severity='high' if row['anomaly_score'] > 100 else 'medium',
-                potential_savings_inr=potential_savings,
-                file_name=file_name
-            )
-            
-            db.session.add(insight)
-            insights.append(insight)
-        
-        db.session.commit()
-        return insights
-    
-    def _identify_high_consumption(self, df, user_id, file_name=None):
-        """Identify departments with high energy consumption"""
-        insights = []
-        
-        # Calculate total consumption by department
-        dept_consumption = df.groupby('department')['energy_kwh'].sum().sort_values(ascending=False)
-        
-        # Get top 3 consuming departments
-        top_departments = dept_consumption.head(3)
-        
-        for dept, consumption in top_departments.items():
-            # Calculate potential savings (assuming 15% reduction possible through optimization)
-            potential_savings = consumption * 0.15 * self.industrial_energy_rate
-            
-            insight = EnergyInsight(
-                user_id=user_id,
-                insight_type='high_consumption',
-                title=f'High Energy Consumption - {dept}',
-                description=f'The {dept} department has consumed {consumption:.2f} kWh, which is among the highest in your facility. Consider implementing energy-saving measures in this area.',
-                department=dept,
-                severity='medium',
-                potential_savings_inr=potential_savings,
-                file_name=file_name
-            )
-            
-            db.session.add(insight)
-            insights.append(insight)
-        
-        db.session.commit()
-        return insights
-    
-    def _analyze_trends(self, df, user_id, file_name=None):
-        """Analyze energy consumption trends"""
-        insights = []
-        
-        # Group by day to analyze daily trends
-        daily_consumption = df.groupby(df['timestamp'].dt.date)['energy_kwh'].sum()
-        
-        if len(daily_consumption) >= 7:
-            # Calculate 7-day moving average
-            moving_avg = daily_consumption.rolling(window=7).mean()
-            
-            # Check for increasing trend
-            if len(moving_avg) >= 2 and moving_avg.iloc[-1] > moving_avg.iloc[-2] * 1.1:
-                latest_consumption = daily_consumption.iloc[-1]
-                avg_consumption = daily_consumption.mean()
-                
-                if latest_consumption > avg_consumption * 1.2:
-                    potential_savings = (latest_consumption - avg_consumption) * 0.5 * self.industrial_energy_rate
-                    
-                    insight = EnergyInsight(
-                        user_id=user_id,
-                        insight_type='trend',
-                        title='Increasing Energy Consumption Trend',
-                        description=f'Energy consumption has been increasing over the past week. Latest daily consumption ({latest_consumption:.2f} kWh) is {((latest_consumption/avg_consumption)-1)*100:.1f}% higher than the average.',
-                        severity='medium',
-                        potential_savings_inr=potential_savings,
-                        file_name=file_name
-                    )
-                    
-                    db.session.add(insight)
-                    insights.append(insight)
-        
-        db.session.commit()
-        return insights
+    def _detect_seasonal_anomalies(self, df, profiles):
+        """Detect anomalies against hour-of-week median/MAD profiles per (department, equipment)
+        
+        Night-time and daytime readings are each compared with their own
+        slot, so regular load cycles don't show up as spikes.
+        """
+        z_score, deviation = score_readings(df, profiles)
+        
+        df['is_anomaly'] = z_score > self.seasonal_anomaly_threshold
+        df['anomaly_score'] = deviation
+        
+        return df
+    
+    def _get_detector(self, user_id, profiles, fallback=None):
+        """The user's cached IsolationForest detector, trained on their history when stale or missing"""
+        store = ModelStore(self.model_folder, self.retrain_interval)
+        detector, trained = get_detector(user_id, profiles, store, self.model_scope,
+                                         training_rows=self.training_rows, fallback=fallback)
+        if detector is None:
+            return None
+        
+        # Cached detectors cost nothing to train in this run
+        self.detector_timings = {
+            'trained': trained,
+            'train_seconds': detector.train_seconds if trained else 0.0,
+            'score_seconds': 0.0,
+            'scored_rows': 0
+        }
+        return detector
+    
+    def _detect_multivariate_anomalies(self, df, detector, profiles):
+        """Flag readings the user's IsolationForest isolates from their history
+        
+        Features are hour, weekday, kWh, a rolling mean per equipment and the
+        deviation from the equipment's hour-of-week profile. anomaly_score
+        stays the kWh deviation from the profile, as in the seasonal method.
+        """
+        started = time.perf_counter()
+        is_anomaly, deviation = detector.predict(df, profiles)
+        df['is_anomaly'] = is_anomaly
+        df['anomaly_score'] = deviation
+        
+        elapsed = time.perf_counter() - started
+        self.detector_timings['score_seconds'] += elapsed
+        self.detector_timings['scored_rows'] += len(df)
+        logger.info(f"Scored {len(df)} readings with IsolationForest in {elapsed:.2f}s "
+                    f"({len(df) / max(elapsed, 1e-9):,.0f} rows/sec, {int(is_anomaly.sum())} anomalies)")
+        return df
+    
+    def _save_energy_data(self, df, user_id, upload_id=None):
+        """Save energy data to database in bulk batches (committed by the caller)"""
+        now = datetime.utcnow()
+        
+        records = pd.DataFrame({
+            'user_id': user_id,
+            'upload_id': upload_id,
+            'timestamp': df['timestamp'],
+            'energy_kwh': df['energy_kwh'],
+            'department': df['department'],
+            'equipment': df['equipment'],
+            'building': df['building'].fillna('') if 'building' in df.columns else '',
+            'cost_inr': df['cost_inr'],
+            'is_anomaly': df['is_anomaly'].astype(bool),
+            'anomaly_score': df['anomaly_score'],
+            'file_name': df['file_name'] if 'file_name' in df.columns else None,
+            'upload_date': df['upload_date'] if 'upload_date' in df.columns else now,
+            'created_at': now
+        })
+        
+        with InsertTimer(f"energy_data upload for user {user_id}") as timer:
+            timer.rows = bulk_insert_dataframe(EnergyData.__table__, records, self.batch_size)
+        
+        return timer.rows
+    
+    def _generate_insights(self, df, user_id, file_name=None, upload_id=None):
+        """Generate energy insights by running the registered rules over shared aggregates"""
+        engine = InsightEngine(self.industrial_energy_rate, user_id=user_id)
+        engine.add(df)
+        insights = engine.run()
+        self.insight_timings = engine.timings
+        
+        return self._save_insights(insights, user_id, file_name, upload_id)
+    
+    def _save_insights(self, insights, user_id, file_name=None, upload_id=None):
+        """Write insight records with one bulk insert in the upload's transaction"""
+        if not insights:
+            return 0
+        
+        records = pd.DataFrame(insights, columns=INSIGHT_COLUMNS)
+        records.insert(0, 'user_id', user_id)
+        records['file_name'] = file_name
+        records['upload_id'] = upload_id
+        records['created_at'] = datetime.utcnow()
+        
+        return bulk_insert_dataframe(EnergyInsight.__table__, records, self.batch_size)
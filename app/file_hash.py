@@ -0,0 +1,23 @@
+import hashlib
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def save_and_hash(file_storage, filepath, block_size=HASH_BLOCK_SIZE):
+    """Write an uploaded file to disk and return its SHA-256 hex digest in the same pass"""
+    digest = hashlib.sha256()
+    with open(filepath, 'wb') as out:
+        while True:
+            block = file_storage.stream.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest()
+
+def hash_file(filepath, block_size=HASH_BLOCK_SIZE):
+    """SHA-256 hex digest of a file already on disk"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,157 @@
+import logging
+import time
+import warnings
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from app import db
+from app.models import EnergyRollup
+from app.rollups import _filter_rollups
+
+logger = logging.getLogger(__name__)
+
+SEASON_LENGTH = 7  # days; weekday/weekend cycles dominate daily totals
+DEFAULT_HISTORY_DAYS = 56
+DEFAULT_HORIZON = 7
+MAX_HORIZON = 90
+METHODS = ('ets', 'seasonal_naive')
+LEVELS = {
+    'department': ['department'],
+    'equipment': ['department', 'equipment']
+}
+
+# Damped additive Holt-Winters smoothing parameters, shared by every series
+ALPHA = 0.3   # level
+BETA = 0.05   # trend
+GAMMA = 0.2   # weekly season
+PHI = 0.9     # trend damping
+
+def daily_matrix(user_id, level='equipment', history_days=DEFAULT_HISTORY_DAYS):
+    """Daily kWh of every series over the user's latest history_days as a [series, day] matrix
+
+    Returns the series index, the matrix (NaN for days without readings) and
+    the day of each column. The window ends at the user's latest rollup day.
+    """
+    keys = LEVELS[level]
+    latest = _filter_rollups(db.session.query(db.func.max(EnergyRollup.bucket_start)), user_id, 'day').scalar()
+    if latest is None:
+        return pd.MultiIndex.from_tuples([], names=keys), np.empty((0, 0)), pd.DatetimeIndex([])
+
+    latest = pd.Timestamp(latest).normalize()
+    start = latest - timedelta(days=history_days - 1)
+    query = db.session.query(
+        EnergyRollup.bucket_start,
+        EnergyRollup.department,
+        EnergyRollup.equipment,
+        EnergyRollup.energy_kwh_sum
+    )
+    query = _filter_rollups(query, user_id, 'day', start=start.to_pydatetime())
+    rollups = pd.DataFrame(query.all(), columns=['bucket_start', 'department', 'equipment', 'energy_kwh'])
+    rollups['bucket_start'] = pd.to_datetime(rollups['bucket_start'])
+
+    days = pd.date_range(start, latest, freq='D')
+    matrix = rollups.pivot_table(index=keys, columns='bucket_start', values='energy_kwh', aggfunc='sum')
+    matrix = matrix.reindex(columns=days)
+    series = matrix.index if isinstance(matrix.index, pd.MultiIndex) else pd.MultiIndex.from_arrays([matrix.index], names=keys)
+    return series, matrix.to_numpy(dtype=float), days
+
+def _seasonal_start(days):
+    """Season slot of the first column, so slots line up with weekdays"""
+    return int(days[0].dayofweek) if len(days) else 0
+
+def exponential_smoothing(matrix, horizon, season_start=0, m=SEASON_LENGTH,
+                          alpha=ALPHA, beta=BETA, gamma=GAMMA, phi=PHI):
+    """Damped additive Holt-Winters fitted to every row of matrix at once
+
+    The loop runs over days, not series: each step updates the level, trend
+    and season of all series with one vector operation. Missing days (NaN)
+    leave a series' state untouched.
+    """
+    series_count, day_count = matrix.shape
+    slots = (season_start + np.arange(day_count + horizon)) % m
+
+    # Initial state from the whole window: mean level, weekday offsets, no trend
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # series without readings average to NaN
+        level = np.nan_to_num(np.nanmean(matrix, axis=1))
+        season = np.zeros((series_count, m))
+        for slot in range(m):
+            columns = matrix[:, slots[:day_count] == slot]
+            if columns.shape[1]:
+                season[:, slot] = np.nan_to_num(np.nanmean(columns, axis=1) - level)
+    trend = np.zeros(series_count)
+    rows = np.arange(series_count)
+
+    for day in range(day_count):
+        observed = matrix[:, day]
+        has_value = ~np.isnan(observed)
+        slot = slots[day]
+
+        new_level = alpha * (observed - season[:, slot]) + (1 - alpha) * (level + phi * trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        new_season = gamma * (observed - new_level) + (1 - gamma) * season[:, slot]
+
+        level = np.where(has_value, new_level, level)
+        trend = np.where(has_value, new_trend, trend)
+        season[rows, slot] = np.where(has_value, new_season, season[:, slot])
+
+    damping = np.cumsum(phi ** np.arange(1, horizon + 1))
+    forecast = level[:, None] + damping[None, :] * trend[:, None] + season[:, slots[day_count:]]
+    return np.clip(forecast, 0, None)
+
+def seasonal_naive(matrix, horizon, weeks=4, m=SEASON_LENGTH):
+    """Each future day is the mean of the same weekday over the last few weeks"""
+    series_count, day_count = matrix.shape
+    recent = matrix[:, -weeks * m:] if day_count >= m else matrix
+    offset = (day_count - recent.shape[1]) % m
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # series without readings average to NaN
+        fallback = np.nan_to_num(np.nanmean(recent, axis=1))
+        by_slot = np.empty((series_count, m))
+        for slot in range(m):
+            columns = recent[:, (offset + np.arange(recent.shape[1])) % m == slot]
+            by_slot[:, slot] = np.nanmean(columns, axis=1) if columns.shape[1] else np.nan
+    by_slot = np.where(np.isnan(by_slot), fallback[:, None], by_slot)
+
+    return by_slot[:, (day_count + np.arange(horizon)) % m]
+
+def forecast_matrix(matrix, days, horizon=DEFAULT_HORIZON, method='ets'):
+    """[series, horizon] daily kWh forecasts for every row of a daily matrix"""
+    if method == 'seasonal_naive':
+        return seasonal_naive(matrix, horizon)
+    return exponential_smoothing(matrix, horizon, _seasonal_start(days))
+
+def forecast_consumption(user_id, horizon=DEFAULT_HORIZON, level='equipment', method='ets', limit=20):
+    """Next-horizon-day forecasts per series plus the facility total"""
+    started = time.perf_counter()
+    series, matrix, days = daily_matrix(user_id, level)
+    if not len(series):
+        return {'method': method, 'level': level, 'horizon': horizon, 'dates': [], 'total': [], 'series': [],
+                'series_count': 0, 'fit_seconds': 0.0}
+
+    forecast = forecast_matrix(matrix, days, horizon, method)
+    fit_seconds = time.perf_counter() - started
+
+    dates = pd.date_range(days[-1] + timedelta(days=1), periods=horizon, freq='D')
+    totals = forecast.sum(axis=1)
+    top = np.argsort(-totals, kind='stable')[:limit]
+    names = series.names
+
+    logger.info(f"Forecast {len(series)} {level} series {horizon} days ahead for user {user_id} "
+                f"with {method} in {fit_seconds:.3f}s")
+
+    return {
+        'method': method,
+        'level': level,
+        'horizon': horizon,
+        'dates': [day.strftime('%Y-%m-%d') for day in dates],
+        'total': [round(float(value), 2) for value in forecast.sum(axis=0)],
+        'series': [{
+            **dict(zip(names, series[row])),
+            'forecast': [round(float(value), 2) for value in forecast[row]],
+            'total_kwh': round(float(totals[row]), 2)
+        } for row in top],
+        'series_count': len(series),
+        'fit_seconds': round(fit_seconds, 4)
+    }
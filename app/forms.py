@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SubmitField, FileField
-from wtforms.validators import DataRequired, Length
+from wtforms import StringField, TextAreaField, SubmitField, FileField, FloatField, IntegerField, BooleanField
+from wtforms.validators import DataRequired, InputRequired, Length, NumberRange, Optional, ValidationError
 from werkzeug.utils import secure_filename
 
 class SettingsForm(FlaskForm):
@@ -10,3 +10,92 @@ class SettingsForm(FlaskForm):
 class UploadForm(FlaskForm):
     file = FileField('Energy Data File', validators=[DataRequired()])
     submit = SubmitField('Upload and Analyze')
+
+class TariffForm(FlaskForm):
+    name = StringField('Tariff Name', validators=[Optional(), Length(max=100)])
+    energy_rate_inr = FloatField('Energy Rate (₹/kWh)', validators=[InputRequired(), NumberRange(min=0)])
+    peak_start_hour = IntegerField('Peak Starts (hour)', validators=[Optional(), NumberRange(min=0, max=23)])
+    peak_end_hour = IntegerField('Peak Ends (hour)', validators=[Optional(), NumberRange(min=0, max=24)])
+    peak_surcharge_inr = FloatField('Peak Surcharge (₹/kWh)', validators=[Optional(), NumberRange(min=0)])
+    peak_weekdays_only = BooleanField('Weekdays only')
+    off_peak_start_hour = IntegerField('Off-Peak Starts (hour)', validators=[Optional(), NumberRange(min=0, max=23)])
+    off_peak_end_hour = IntegerField('Off-Peak Ends (hour)', validators=[Optional(), NumberRange(min=0, max=24)])
+    off_peak_rebate_inr = FloatField('Off-Peak Rebate (₹/kWh)', validators=[Optional(), NumberRange(min=0)])
+    slabs = TextAreaField('Monthly Slabs', validators=[Optional()])
+    demand_charge_inr_per_kw = FloatField('Demand Charge (₹/kW)', validators=[Optional(), NumberRange(min=0)])
+    submit = SubmitField('Save Tariff')
+    
+    def validate_slabs(self, field):
+        try:
+            parse_slabs(field.data)
+        except ValueError as e:
+            raise ValidationError(str(e))
+    
+    def windows(self):
+        """Time-of-day windows for Tariff.time_of_day; peak comes last so it wins any overlap"""
+        windows = []
+        if self.off_peak_start_hour.data is not None and self.off_peak_end_hour.data is not None and self.off_peak_rebate_inr.data:
+            windows.append({'name': 'off_peak', 'days': list(range(7)),
+                            'start_hour': self.off_peak_start_hour.data, 'end_hour': self.off_peak_end_hour.data,
+                            'surcharge_inr': -self.off_peak_rebate_inr.data})
+        if self.peak_start_hour.data is not None and self.peak_end_hour.data is not None and self.peak_surcharge_inr.data:
+            windows.append({'name': 'peak', 'days': list(range(5)) if self.peak_weekdays_only.data else list(range(7)),
+                            'start_hour': self.peak_start_hour.data, 'end_hour': self.peak_end_hour.data,
+                            'surcharge_inr': self.peak_surcharge_inr.data})
+        return windows
+    
+    def populate_tariff(self, tariff):
+        tariff.name = self.name.data or 'Custom tariff'
+        tariff.energy_rate_inr = self.energy_rate_inr.data
+        tariff.time_of_day = self.windows()
+        tariff.slabs = parse_slabs(self.slabs.data)
+        tariff.demand_charge_inr_per_kw = self.demand_charge_inr_per_kw.data or 0.0
+    
+    def load_tariff(self, tariff, default_rate):
+        """Pre-fill from a saved tariff, or the flat default rate"""
+        if tariff is None:
+            self.energy_rate_inr.data = default_rate
+            return
+        
+        self.name.data = tariff.name
+        self.energy_rate_inr.data = tariff.energy_rate_inr
+        self.demand_charge_inr_per_kw.data = tariff.demand_charge_inr_per_kw
+        self.slabs.data = format_slabs(tariff.slabs)
+        for window in tariff.time_of_day or []:
+            if window.get('name') == 'peak':
+                self.peak_start_hour.data = window['start_hour']
+                self.peak_end_hour.data = window['end_hour']
+                self.peak_surcharge_inr.data = window['surcharge_inr']
+                self.peak_weekdays_only.data = len(window.get('days') or range(7)) < 7
+            elif window.get('name') == 'off_peak':
+                self.off_peak_start_hour.data = window['start_hour']
+                self.off_peak_end_hour.data = window['end_hour']
+                self.off_peak_rebate_inr.data = -window['surcharge_inr']
+
+def parse_slabs(text):
+    """'UP_TO_KWH RATE' per line, '* RATE' for the open-ended last block"""
+    slabs = []
+    for number, line in enumerate((text or '').splitlines(), start=1):
+        if not line.strip():
+            continue
+        parts = line.split()
+        if len(parts) != 2:
+            raise ValueError(f'Slab line {number} must be "<up to kWh> <rate>" or "* <rate>"')
+        if slabs and slabs[-1]['up_to_kwh'] is None:
+            raise ValueError('The open-ended "*" slab must be the last one')
+        try:
+            up_to_kwh = None if parts[0] == '*' else float(parts[0])
+            rate_inr = float(parts[1])
+        except ValueError:
+            raise ValueError(f'Slab line {number} must contain numbers')
+        if up_to_kwh is not None and slabs and up_to_kwh <= slabs[-1]['up_to_kwh']:
+            raise ValueError('Slab limits must increase from one line to the next')
+        slabs.append({'up_to_kwh': up_to_kwh, 'rate_inr': rate_inr})
+    return slabs
+
+def format_slabs(slabs):
+    lines = []
+    for slab in slabs or []:
+        limit = '*' if slab['up_to_kwh'] is None else f"{slab['up_to_kwh']:g}"
+        lines.append(f"{limit} {slab['rate_inr']:g}")
+    return '\n'.join(lines)
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import threading
+import time
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 900  # seconds an unused API key keeps its client
+
+# google-generativeai releases whose private client manager and GenerativeModel._client
+# were checked; other versions bind keys through the public genai.configure()
+PRIVATE_CLIENT_VERSIONS = ('0.3.',)
+
+def _private_clients_supported():
+    return (getattr(genai, '__version__', '').startswith(PRIVATE_CLIENT_VERSIONS)
+            and hasattr(genai_client, '_ClientManager'))
+
+PRIVATE_CLIENTS = _private_clients_supported()
+
+_configure_lock = threading.Lock()
+
+def key_fingerprint(api_key):
+    """Short hash identifying an API key in logs and stats without revealing it"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+class _ConfiguredModel:
+    """A GenerativeModel bound to one API key through the public genai.configure()
+
+    A GenerativeModel takes the default client on its first call and keeps
+    it, so only that first call runs under a process-wide lock right after
+    configure(api_key); later calls go straight through.
+    """
+
+    def __init__(self, api_key, model_name):
+        self.api_key = api_key
+        self.model = genai.GenerativeModel(model_name)
+        self.model_name = self.model.model_name
+        self._bound = False
+
+    def generate_content(self, *args, **kwargs):
+        if not self._bound:
+            with _configure_lock:
+                if not self._bound:
+                    genai.configure(api_key=self.api_key)
+                    try:
+                        return self.model.generate_content(*args, **kwargs)
+                    finally:
+                        self._bound = True
+        return self.model.generate_content(*args, **kwargs)
+
+class _KeyClients:
+    """The gRPC client of one API key and the model handles bound to it"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.client = None
+        if PRIVATE_CLIENTS:
+            # A private client manager instead of genai.configure(), which would
+            # switch the process-wide default key under other threads
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=api_key)
+            self.client = manager.make_client('generative')
+        self.models = {}
+        self.last_used = time.monotonic()
+
+    def model(self, model_name):
+        model = self.models.get(model_name)
+        if model is None:
+            if self.client is None:
+                model = _ConfiguredModel(self.api_key, model_name)
+            else:
+                model = genai.GenerativeModel(model_name)
+                model._client = self.client  # generate_content uses this client instead of the global default
+            self.models[model_name] = model
+        return model
+
+    def close(self):
+        if self.client is None:
+            return
+        try:
+            self.client.transport.close()
+        except Exception as e:
+            logger.debug(f"Error closing Gemini client: {str(e)}")
+
+class GeminiClientPool:
+    """Reusable Gemini model handles per API key, shared by every request thread
+
+    Handles are created once per (key, model) and bound to that key's own
+    client, so concurrent requests with different keys never share
+    credentials. Keys unused for idle_timeout seconds are closed and dropped.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + idle_timeout
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def model(self, api_key, model_name):
+        """The GenerativeModel for model_name authenticated with api_key"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get(api_key)
+            if entry is None:
+                entry = self._keys[api_key] = _KeyClients(api_key)
+                self.created += 1
+                logger.info(f"Created Gemini client for key {key_fingerprint(api_key)}")
+            else:
+                self.reused += 1
+            entry.last_used = now
+            model = entry.model(model_name)
+            expired = self._sweep(now)
+
+        for idle in expired:
+            idle.close()
+        return model
+
+    def _sweep(self, now):
+        """Drop keys idle for longer than idle_timeout; the caller closes them outside the lock"""
+        if now < self._next_sweep:
+            return []
+        self._next_sweep = now + self.idle_timeout
+        expired = [key for key, entry in self._keys.items() if now - entry.last_used > self.idle_timeout]
+        self.evicted += len(expired)
+        return [self._keys.pop(key) for key in expired]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'binding': 'client' if PRIVATE_CLIENTS else 'configure',
+                'keys': len(self._keys),
+                'models': sum(len(entry.models) for entry in self._keys.values()),
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted
+            }
+
+def get_client_pool(app=None):
+    """The app's GeminiClientPool, built from GEMINI_CLIENT_IDLE_TIMEOUT on first use"""
+    app = app or current_app
+    pool = app.extensions.get('gemini_clients')
+    if pool is None:
+        pool = app.extensions.setdefault('gemini_clients', GeminiClientPool(app.config['GEMINI_CLIENT_IDLE_TIMEOUT']))
+    return pool
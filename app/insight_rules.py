@@ -0,0 +1,276 @@
+import logging
+import time
+from collections import namedtuple
+import pandas as pd
+from app.changepoints import DEFAULT_HISTORY_DAYS, MIN_SEGMENT_DAYS, baseline_shift_insights, baseline_shifts
+from app.forecasting import daily_matrix
+
+logger = logging.getLogger(__name__)
+
+# A spike event is a run of anomalous readings of one piece of equipment
+SPIKE_KEYS = ['department', 'equipment']
+SPIKE_COLUMNS = ['timestamp', 'department', 'equipment', 'energy_kwh', 'anomaly_score', 'is_anomaly']
+
+Rule = namedtuple('Rule', ['name', 'needs', 'build'])
+
+# Aggregate name -> class accumulating it batch by batch; rule name -> Rule, in registration order
+AGGREGATES = {}
+RULES = {}
+
+def aggregate(name):
+    """Register an aggregate class under the name rules ask for
+
+    Each engine builds its aggregates with the uploading user's id, which
+    history aggregates use to read the user's stored data.
+    """
+    def register(cls):
+        AGGREGATES[name] = cls
+        return cls
+    return register
+
+def rule(name, needs):
+    """Register build(aggregates, rate) -> [insight dict] as an insight rule needing the named aggregates"""
+    def register(build):
+        RULES[name] = Rule(name, tuple(needs), build)
+        return build
+    return register
+
+class _GroupedSum:
+    """kWh summed per value of key_column (or per keys(df) in subclasses), added up across batches"""
+
+    key_column = None
+
+    def __init__(self, user_id=None):
+        self.totals = pd.Series(dtype=float)
+
+    def keys(self, df):
+        return df[self.key_column]
+
+    def add(self, df):
+        self.totals = self.totals.add(df.groupby(self.keys(df))['energy_kwh'].sum(), fill_value=0)
+
+    def result(self):
+        return self.totals
+
+@aggregate('department_totals')
+class DepartmentTotals(_GroupedSum):
+    key_column = 'department'
+
+@aggregate('daily_totals')
+class DailyTotals(_GroupedSum):
+    def keys(self, df):
+        return df['timestamp'].dt.date
+
+    def result(self):
+        return self.totals.sort_index()
+
+@aggregate('spike_events')
+class SpikeEvents:
+    """Spike events, stitched across batches so a spike spanning two chunks is one event"""
+
+    def __init__(self, user_id=None):
+        self.events = []
+        self.open_spikes = None
+
+    def add(self, df):
+        events, self.open_spikes = spike_events(pd.concat([self.open_spikes, df[SPIKE_COLUMNS]]), hold_open=True)
+        self.events.append(events)
+
+    def result(self):
+        if self.open_spikes is not None:
+            self.events.append(spike_events(self.open_spikes)[0])
+            self.open_spikes = None
+        return pd.concat(self.events, ignore_index=True) if self.events else spike_events(pd.DataFrame(columns=SPIKE_COLUMNS))[0]
+
+@aggregate('daily_history')
+class DailyHistory:
+    """Daily kWh of every equipment series over the user's latest history, read from the rollups
+
+    Batches only move the upload's first day; the rollups are read in
+    result(), once the upload's readings (and rollups) have been written.
+    """
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self.first_day = None
+
+    def add(self, df):
+        first_day = df['timestamp'].min().normalize()
+        self.first_day = first_day if self.first_day is None else min(self.first_day, first_day)
+
+    def result(self):
+        series, matrix, days = daily_matrix(self.user_id, 'equipment', DEFAULT_HISTORY_DAYS)
+        return {'series': series, 'matrix': matrix, 'days': days, 'first_day': self.first_day}
+
+def spike_events(readings, hold_open=False):
+    """Group consecutive anomalous readings per (department, equipment) into spike events
+
+    A run of anomalies ends at the series' next normal reading. With hold_open,
+    runs still open at the end of the batch are returned as carry-over rows so
+    the next streamed chunk can extend them instead of starting a new event.
+    """
+    readings = readings[SPIKE_COLUMNS].sort_values(SPIKE_KEYS + ['timestamp'], kind='stable')
+    is_anomaly = readings['is_anomaly'].astype(bool)
+
+    series_start = (readings[SPIKE_KEYS] != readings[SPIKE_KEYS].shift()).any(axis=1)
+    run_id = (series_start | (is_anomaly != is_anomaly.shift())).cumsum()
+    spikes = readings.assign(run_id=run_id)[is_anomaly]
+
+    carry = spikes.iloc[:0][SPIKE_COLUMNS]
+    if hold_open:
+        last_run = run_id.groupby([readings['department'], readings['equipment']]).transform('last')
+        is_open = spikes['run_id'] == last_run[is_anomaly]
+        carry = spikes.loc[is_open, SPIKE_COLUMNS]
+        spikes = spikes[~is_open]
+
+    events = spikes.groupby('run_id', sort=False).agg(
+        department=('department', 'first'),
+        equipment=('equipment', 'first'),
+        start=('timestamp', 'min'),
+        end=('timestamp', 'max'),
+        readings=('energy_kwh', 'size'),
+        peak_kwh=('energy_kwh', 'max'),
+        total_kwh=('energy_kwh', 'sum'),
+        max_score=('anomaly_score', 'max')
+    ).reset_index(drop=True)
+
+    return events, carry
+
+@rule('spike', needs=['spike_events'])
+def spike_insights(aggregates, rate):
+    """One insight per spike event"""
+    insights = []
+
+    for event in aggregates['spike_events'].itertuples(index=False):
+        # Calculate potential savings (assuming 30% reduction possible)
+        potential_savings = event.total_kwh * 0.3 * rate
+
+        if event.readings == 1:
+            description = f'Unusual energy consumption of {event.peak_kwh:.2f} kWh detected in {event.department} department on {event.start.strftime("%Y-%m-%d %H:%M")}. This is significantly higher than the normal consumption pattern.'
+        else:
+            description = f'{event.readings} consecutive readings of unusual energy consumption detected on {event.equipment} in {event.department} department between {event.start.strftime("%Y-%m-%d %H:%M")} and {event.end.strftime("%Y-%m-%d %H:%M")}, peaking at {event.peak_kwh:.2f} kWh ({event.total_kwh:.2f} kWh in total). This is significantly higher than the normal consumption pattern.'
+
+        insights.append({
+            'insight_type': 'spike',
+            'title': f'Energy Spike Detected - {event.department}',
+            'description': description,
+            'department': event.department,
+            'equipment': event.equipment,
+            'severity': 'high' if event.max_score > 100 else 'medium',
+            'potential_savings_inr': potential_savings
+        })
+
+    return insights
+
+@rule('high_consumption', needs=['department_totals'])
+def high_consumption_insights(aggregates, rate):
+    """Insights for the top 3 consuming departments"""
+    insights = []
+    top_departments = aggregates['department_totals'].sort_values(ascending=False).head(3)
+
+    for dept, consumption in top_departments.items():
+        # Calculate potential savings (assuming 15% reduction possible through optimization)
+        potential_savings = consumption * 0.15 * rate
+
+        insights.append({
+            'insight_type': 'high_consumption',
+            'title': f'High Energy Consumption - {dept}',
+            'description': f'The {dept} department has consumed {consumption:.2f} kWh, which is among the highest in your facility. Consider implementing energy-saving measures in this area.',
+            'department': dept,
+            'severity': 'medium',
+            'potential_savings_inr': potential_savings
+        })
+
+    return insights
+
+@rule('trend', needs=['daily_totals'])
+def trend_insights(aggregates, rate):
+    """Rising 7-day moving average with the latest day well above the average"""
+    insights = []
+    daily_consumption = aggregates['daily_totals']
+
+    if len(daily_consumption) >= 7:
+        # Calculate 7-day moving average
+        moving_avg = daily_consumption.rolling(window=7).mean()
+
+        # Check for increasing trend
+        if len(moving_avg) >= 2 and moving_avg.iloc[-1] > moving_avg.iloc[-2] * 1.1:
+            latest_consumption = daily_consumption.iloc[-1]
+            avg_consumption = daily_consumption.mean()
+
+            if latest_consumption > avg_consumption * 1.2:
+                potential_savings = (latest_consumption - avg_consumption) * 0.5 * rate
+
+                insights.append({
+                    'insight_type': 'trend',
+                    'title': 'Increasing Energy Consumption Trend',
+                    'description': f'Energy consumption has been increasing over the past week. Latest daily consumption ({latest_consumption:.2f} kWh) is {((latest_consumption/avg_consumption)-1)*100:.1f}% higher than the average.',
+                    'severity': 'medium',
+                    'potential_savings_inr': potential_savings
+                })
+
+    return insights
+
+@rule('baseline_shift', needs=['daily_history'])
+def baseline_shift_rule(aggregates, rate):
+    """Lasting step ups in daily consumption, each reported by the upload whose readings first confirm it
+
+    A shift is confirmed once MIN_SEGMENT_DAYS days at the new level exist,
+    so later uploads do not repeat it.
+    """
+    history = aggregates['daily_history']
+    shifts = baseline_shifts(history['series'], history['matrix'], history['days'])
+
+    if history['first_day'] is not None:
+        confirmed = shifts['shift_date'] + pd.Timedelta(days=MIN_SEGMENT_DAYS - 1)
+        shifts = shifts[confirmed >= history['first_day']]
+
+    return baseline_shift_insights(shifts, rate)
+
+class InsightEngine:
+    """Runs the registered rules over aggregates computed once per batch
+
+    Only the aggregates some rule needs are computed. add() can be called per
+    streamed chunk; run() finalizes the aggregates and evaluates every rule,
+    recording its wall time and insight count in timings. Rules over stored
+    history need user_id, and run() must come after the batches are saved.
+    """
+
+    def __init__(self, rate, rules=None, user_id=None):
+        self.rate = rate
+        self.rules = list(RULES.values()) if rules is None else rules
+        self.aggregates = {name: AGGREGATES[name](user_id=user_id) for rule in self.rules for name in rule.needs}
+        self.timings = {name: {'seconds': 0.0} for name in self.aggregates}
+
+    def add(self, df):
+        """Fold a scored batch into every needed aggregate"""
+        if df.empty:
+            return
+        for name, accumulator in self.aggregates.items():
+            started = time.perf_counter()
+            accumulator.add(df)
+            self.timings[name]['seconds'] += time.perf_counter() - started
+
+    def run(self):
+        """Insight dicts from every rule, in registration order"""
+        results = {}
+        for name, accumulator in self.aggregates.items():
+            started = time.perf_counter()
+            results[name] = accumulator.result()
+            self.timings[name]['seconds'] += time.perf_counter() - started
+
+        insights = []
+        for rule in self.rules:
+            started = time.perf_counter()
+            rule_insights = rule.build(results, self.rate)
+            self.timings[f'rule:{rule.name}'] = {
+                'seconds': time.perf_counter() - started,
+                'insights': len(rule_insights)
+            }
+            insights += rule_insights
+
+        logger.info("Insight rules: " + ", ".join(
+            f"{name} {timing['seconds'] * 1000:.1f}ms" + (f" ({timing['insights']} insights)" if 'insights' in timing else '')
+            for name, timing in self.timings.items()
+        ))
+        return insights
@@ -0,0 +1,362 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['parse', 'clean', 'detect', 'persist', 'insights']
+
+# Stages of each job type, in order; jobs without a type are uploads
+JOB_STAGES = {
+    'upload': STAGES,
+    'reprice': ['reprice'],
+    'rebuild': ['stats', 'profiles', 'rollups'],
+    'ai_batch': ['analyze']
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker_app = None
+
+class JobStore:
+    """Upload job state kept as one JSON file per job.
+
+    Files live on local disk so every gunicorn worker and every pool process
+    sees the same state without touching the database transaction that the
+    job itself is writing.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    def load(self, job_id):
+        # Job ids are uuid4 hex strings; anything else can't be a job file
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, job):
+        job['updated_at'] = datetime.utcnow().isoformat()
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['id']))
+        return job
+
+    def update(self, job_id, **fields):
+        job = self.load(job_id) or {'id': job_id}
+        job.update(fields)
+        return self.save(job)
+
+def get_job_store(app=None):
+    app = app or current_app
+    return JobStore(app.config['JOB_STATE_FOLDER'])
+
+def upload_path(folder, file_name):
+    """A path in folder that no other upload uses, so concurrent uploads of the same file name never collide"""
+    return os.path.join(folder, f'{uuid.uuid4().hex}_{file_name}')
+
+def remove_upload_file(filepath):
+    try:
+        os.remove(filepath)
+    except OSError as e:
+        logger.warning(f"Could not remove uploaded file {filepath}: {str(e)}")
+
+def create_upload_job(user_id, filepath, file_name, upload_date=None, content_sha256=None, remove_file=False):
+    """Record a queued upload job and hand it to the worker pool
+    
+    With remove_file the job owns filepath and deletes it once it has run.
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'type': 'upload',
+        'user_id': user_id,
+        'filepath': os.path.abspath(filepath),
+        'remove_file': remove_file,
+        'file_name': file_name,
+        'content_sha256': content_sha256,
+        'upload_date': (upload_date or datetime.utcnow()).isoformat(),
+        'status': 'queued',
+        'stage': None,
+        'progress': 0,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    get_job_store().save(job)
+    _submit(_run_job, job['id'])
+    return job
+
+def create_reprice_job(user_id):
+    """Queue re-costing a user's stored readings and upload totals under their current tariff"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'type': 'reprice',
+        'user_id': user_id,
+        'status': 'queued',
+        'stage': None,
+        'progress': 0,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    get_job_store().save(job)
+    _submit(_run_reprice_job, job['id'])
+    return job
+
+def create_rebuild_job(user_id):
+    """Queue rebuilding a user's running stats, profiles and rollups from their stored readings"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'type': 'rebuild',
+        'user_id': user_id,
+        'status': 'queued',
+        'stage': None,
+        'progress': 0,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    get_job_store().save(job)
+    _submit(_run_rebuild_job, job['id'])
+    return job
+
+def create_ai_batch_job(user_id, insight_ids, max_retries):
+    """Queue AI analysis of several insights; Gemini rate limits can make a batch outlast a request"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'type': 'ai_batch',
+        'user_id': user_id,
+        'insight_ids': insight_ids,
+        'max_retries': max_retries,
+        'status': 'queued',
+        'stage': None,
+        'progress': 0,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    get_job_store().save(job)
+    _submit(_run_ai_batch_job, job['id'])
+    return job
+
+def _submit(runner, job_id):
+    """Run runner(app, job_id) in the worker pool"""
+    if current_app.config['UPLOAD_JOB_WORKERS'] > 0:
+        _get_executor(current_app.config['UPLOAD_JOB_WORKERS']).submit(run_in_worker, runner, job_id)
+    else:
+        # No pool configured: run inline within this request
+        runner(current_app._get_current_object(), job_id)
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Each pool process builds its own app (and DB engine) in _init_worker
+            _executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+        return _executor
+
+def _init_worker():
+    """Build one Flask app per pool process"""
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+
+def run_in_worker(runner, job_id):
+    """Entry point executed inside a pool process"""
+    if _worker_app is None:
+        _init_worker()
+    runner(_worker_app, job_id)
+
+def _run_job(app, job_id):
+    from app import db
+    from app.energy_analyzer import EnergyAnalyzer
+
+    with app.app_context():
+        store = get_job_store(app)
+        job = store.load(job_id)
+        if job is None:
+            logger.error(f"Upload job {job_id} not found")
+            return
+
+        def report(stage, progress):
+            store.update(job_id, stage=stage, progress=round(progress, 1))
+
+        store.update(job_id, status='running', stage='parse', progress=0, started_at=datetime.utcnow().isoformat())
+
+        try:
+            analyzer = EnergyAnalyzer(progress_callback=report)
+            upload_date = datetime.fromisoformat(job['upload_date'])
+            filepath = job['filepath']
+
+            if os.path.getsize(filepath) >= app.config['STREAMING_INGEST_THRESHOLD']:
+                # Large export: stream it in chunks with bounded memory
+                insights_generated = analyzer.process_energy_file(filepath, job['user_id'], job['file_name'], upload_date,
+                                                                   content_sha256=job.get('content_sha256'))
+            else:
+                df = pd.read_csv(filepath)
+                df['file_name'] = job['file_name']
+                df['upload_date'] = upload_date
+                insights_generated = analyzer.process_energy_data(df, job['user_id'], content_sha256=job.get('content_sha256'))
+            
+            if analyzer.upload is None:
+                message = (f'No new energy records: all {analyzer.duplicates_skipped} readings were already uploaded.'
+                           if analyzer.duplicates_skipped else 'No valid energy records found in the file.')
+            else:
+                message = (f'Successfully uploaded and analyzed {analyzer.records_saved} energy records. '
+                           f'Generated {insights_generated} insights.')
+            if analyzer.upload is not None and analyzer.duplicates_skipped:
+                message += f' Skipped {analyzer.duplicates_skipped} readings that were already uploaded.'
+            if analyzer.ai_analyses_queued:
+                message += (f' AI analysis of {analyzer.ai_analyses_queued} new '
+                            f'insight{"s" if analyzer.ai_analyses_queued != 1 else ""} is running in the background.')
+
+            store.update(job_id,
+                         status='finished',
+                         stage='insights',
+                         progress=100,
+                         finished_at=datetime.utcnow().isoformat(),
+                         result={
+                             'upload_id': analyzer.upload.id if analyzer.upload else None,
+                             'records_saved': analyzer.records_saved,
+                             'duplicates_skipped': analyzer.duplicates_skipped,
+                             'insights_generated': insights_generated,
+                             'ai_analyses_queued': analyzer.ai_analyses_queued,
+                             'peak_memory_mb': analyzer.peak_memory_mb,
+                             'detector_timings': analyzer.detector_timings,
+                             'insight_timings': analyzer.insight_timings
+                         },
+                         message=message)
+
+        except Exception as e:
+            logger.error(f"Upload job {job_id} failed: {str(e)}")
+            db.session.rollback()
+            store.update(job_id,
+                         status='failed',
+                         finished_at=datetime.utcnow().isoformat(),
+                         error=str(e),
+                         message=f'Error processing file: {str(e)}')
+        
+        finally:
+            if job.get('remove_file'):
+                remove_upload_file(job['filepath'])
+
+def _run_reprice_job(app, job_id):
+    from app import db
+    from app.cache import bump_data_version
+    from app.tariffs import compile_rates, load_tariff, reprice_readings
+
+    with app.app_context():
+        store = get_job_store(app)
+        job = store.load(job_id)
+        if job is None:
+            logger.error(f"Reprice job {job_id} not found")
+            return
+
+        store.update(job_id, status='running', stage='reprice', progress=0, started_at=datetime.utcnow().isoformat())
+        try:
+            # The tariff saved last wins, however many saves queued a job
+            repriced = reprice_readings(job['user_id'], compile_rates(load_tariff(job['user_id'])))
+            bump_data_version(job['user_id'])
+            db.session.commit()
+
+            store.update(job_id,
+                         status='finished',
+                         progress=100,
+                         finished_at=datetime.utcnow().isoformat(),
+                         result={'readings_repriced': repriced},
+                         message=f'Repriced {repriced} stored readings.')
+
+        except Exception as e:
+            logger.error(f"Reprice job {job_id} failed: {str(e)}")
+            db.session.rollback()
+            store.update(job_id,
+                         status='failed',
+                         finished_at=datetime.utcnow().isoformat(),
+                         error=str(e),
+                         message=f'Error repricing readings: {str(e)}')
+
+def _run_rebuild_job(app, job_id):
+    from app import db
+    from app.baselines import rebuild_profiles
+    from app.cache import bump_data_version
+    from app.rollups import rebuild_rollups
+    from app.running_stats import rebuild_running_stats
+
+    with app.app_context():
+        store = get_job_store(app)
+        job = store.load(job_id)
+        if job is None:
+            logger.error(f"Rebuild job {job_id} not found")
+            return
+
+        user_id = job['user_id']
+        store.update(job_id, status='running', stage='stats', progress=0, started_at=datetime.utcnow().isoformat())
+        try:
+            # Each rebuild reads the whole history, so the latest stored readings win
+            rebuild_running_stats(user_id)
+            store.update(job_id, stage='profiles', progress=30)
+            rebuild_profiles(user_id)
+            store.update(job_id, stage='rollups', progress=60)
+            # Responses cached from the old rollups go stale with this commit
+            bump_data_version(user_id)
+            readings = rebuild_rollups(user_id)  # commits all three
+
+            store.update(job_id,
+                         status='finished',
+                         progress=100,
+                         finished_at=datetime.utcnow().isoformat(),
+                         result={'readings': readings},
+                         message=f'Rebuilt baselines and rollups from {readings} stored readings.')
+
+        except Exception as e:
+            logger.error(f"Rebuild job {job_id} failed: {str(e)}")
+            db.session.rollback()
+            store.update(job_id,
+                         status='failed',
+                         finished_at=datetime.utcnow().isoformat(),
+                         error=str(e),
+                         message=f'Error rebuilding baselines and rollups: {str(e)}')
+
+def _run_ai_batch_job(app, job_id):
+    from app.ai_batch import analyze_insights
+
+    with app.app_context():
+        store = get_job_store(app)
+        job = store.load(job_id)
+        if job is None:
+            logger.error(f"AI batch job {job_id} not found")
+            return
+
+        store.update(job_id, status='running', stage='analyze', progress=0, started_at=datetime.utcnow().isoformat())
+        total = len(job['insight_ids'])
+
+        def report(done):
+            store.update(job_id, progress=int(done / total * 100))
+
+        try:
+            batch = analyze_insights(app, job['user_id'], job['insight_ids'],
+                                     max_retries=job['max_retries'], on_result=report)
+            summary = batch['summary']
+            store.update(job_id,
+                         status='finished',
+                         progress=100,
+                         finished_at=datetime.utcnow().isoformat(),
+                         result=batch,
+                         message=f"Analyzed {summary['analyzed']}, cached {summary['cached']}, "
+                                 f"fallback {summary['fallback']} of {total} insight(s).")
+
+        except Exception as e:
+            logger.error(f"AI batch job {job_id} failed: {str(e)}")
+            store.update(job_id,
+                         status='failed',
+                         finished_at=datetime.utcnow().isoformat(),
+                         error=str(e),
+                         message=f'Error analyzing insights: {str(e)}')
@@ -1,13 +1,20 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, jsonify
+from flask import Blueprint, Response, render_template, request, flash, redirect, url_for, current_app, jsonify, stream_with_context
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import pandas as pd
+import json
 import os
 from datetime import datetime
-from app.models import EnergyData, EnergyInsight, AIRecommendation
-from app.energy_analyzer import EnergyAnalyzer
+from app.models import AIAnalysis, EnergyData, EnergyInsight, AIRecommendation, Tariff, Upload
 from app.ai_consultant import AIConsultant
-from app.forms import SettingsForm, UploadForm
+from app.jobs import create_rebuild_job, create_reprice_job, create_upload_job, remove_upload_file, upload_path
+from app.rollups import date_window, time_series, usage_summary
+from app.running_stats import baseline_summary
+from app.multivariate import ModelStore
+from app.tariffs import compile_rates, default_energy_rate, load_tariff, monthly_bills, reprice_rollups
+from app.cache import bump_data_version, get_user_cache, row_to_dict
+from app.file_hash import hash_file, save_and_hash
+from app.forms import SettingsForm, TariffForm, UploadForm
 from app import db
 from . import bp
 
@@ -18,27 +25,60 @@ def index():
 @bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's energy data
-    energy_data = EnergyData.query.filter_by(user_id=current_user.id).order_by(EnergyData.timestamp.desc()).limit(100).all()
-    insights = EnergyInsight.query.filter_by(user_id=current_user.id).order_by(EnergyInsight.created_at.desc()).limit(10).all()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    try:
+        start, end = date_window(start_date, end_date)
+    except ValueError:
+        flash('Dates must be formatted as YYYY-MM-DD', 'error')
+        start_date = end_date = start = end = None
+    
+    # Responses only change when the user's data does, so serve them from the per-user cache
+    page = get_user_cache().get_or_compute(
+        current_user, 'dashboard', lambda: _dashboard_data(current_user.id, start, end),
+        start_date=start_date, end_date=end_date
+    )
+    
+    return render_template('dashboard.html', 
+                         title='Energy Dashboard',
+                         current_start_date=start_date,
+                         current_end_date=end_date,
+                         **page)
+
+def _dashboard_data(user_id, start=None, end=None):
+    """Stats, chart series and the rows the dashboard tables show"""
+    # Only the rows the tables show are loaded
+    readings_query = EnergyData.query.filter_by(user_id=user_id)
+    if start:
+        readings_query = readings_query.filter(EnergyData.timestamp >= start)
+    if end:
+        readings_query = readings_query.filter(EnergyData.timestamp < end)
+    energy_data = readings_query.order_by(EnergyData.timestamp.desc()).limit(10).all()
+    insights = EnergyInsight.query.filter_by(user_id=user_id).order_by(EnergyInsight.created_at.desc()).limit(10).all()
     
-    # Calculate summary statistics
-    total_consumption = sum(data.energy_kwh for data in energy_data)
-    total_cost = sum(data.cost_inr or 0 for data in energy_data)
-    anomaly_count = sum(1 for data in energy_data if data.is_anomaly)
+    # Summary statistics come from one aggregate query over the daily rollups
+    summary = usage_summary(user_id, start, end)
+    daily_series = time_series(user_id, 'day', start=start, end=end, limit=30)
     
     stats = {
-        'total_consumption_kwh': round(total_consumption, 2),
-        'total_cost_inr': round(total_cost, 2),
-        'anomaly_count': anomaly_count,
-        'data_points': len(energy_data)
+        'total_consumption_kwh': round(summary['total_consumption'], 2),
+        'total_cost_inr': round(summary['total_cost'], 2),
+        'anomaly_count': summary['anomaly_count'],
+        'data_points': summary['data_points']
     }
     
-    return render_template('dashboard.html', 
-                         title='Energy Dashboard',
-                         energy_data=energy_data,
-                         insights=insights,
-                         stats=stats)
+    chart = {
+        'labels': [bucket.strftime('%d %b') for bucket, _, _ in daily_series],
+        'energy_kwh': [round(energy, 2) for _, energy, _ in daily_series]
+    }
+    
+    return {
+        'energy_data': [row_to_dict(row) for row in energy_data],
+        'insights': [row_to_dict(insight) for insight in insights],
+        'stats': stats,
+        'chart': chart,
+        'baselines': baseline_summary(user_id)
+    }
 
 @bp.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -47,41 +87,51 @@ def upload_data():
     if form.validate_on_submit():
         file = form.file.data
         if file and file.filename.endswith('.csv'):
+            filepath = None
             try:
-                # Save file
+                # Save file under a path of its own, hashing it on the way to disk
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                
-                # Process CSV
-                df = pd.read_csv(filepath)
+                filepath = upload_path(current_app.config['UPLOAD_FOLDER'], filename)
+                content_sha256 = save_and_hash(file, filepath)
                 
-                # Add file name and upload date to all records for tracking
-                df['file_name'] = filename
-                df['upload_date'] = datetime.utcnow()
+                # A byte-identical file was already processed: point at its results
+                existing = _find_identical_upload(content_sha256)
+                if existing:
+                    flash(f'This file was already uploaded as {existing.file_name} on '
+                          f'{existing.upload_date.strftime("%d %b %Y")}. Showing its results.', 'info')
+                    return redirect(url_for('main.insights', upload=existing.id))
                 
-                # Validate required columns
+                # Validate required columns from the header only
+                columns = pd.read_csv(filepath, nrows=0).columns
                 required_columns = ['timestamp', 'energy_kwh', 'department', 'equipment']
-                missing_columns = [col for col in required_columns if col not in df.columns]
+                missing_columns = [col for col in required_columns if col not in columns]
                 if missing_columns:
                     flash(f'Missing required columns: {", ".join(missing_columns)}', 'error')
                     return render_template('upload.html', form=form, title='Upload Energy Data')
                 
-                # Process data
-                analyzer = EnergyAnalyzer()
-                insights_generated = analyzer.process_energy_data(df, current_user.id)
-                
-                flash(f'Successfully uploaded and analyzed {len(df)} energy records. Generated {insights_generated} insights.', 'success')
-                return redirect(url_for('main.dashboard'))
+                # Hand the heavy lifting to the background worker pool; the job deletes the file when done
+                job = create_upload_job(current_user.id, filepath, filename, content_sha256=content_sha256,
+                                        remove_file=True)
+                filepath = None
+                return redirect(url_for('main.upload_data', job=job['id']))
                 
             except Exception as e:
                 flash(f'Error processing file: {str(e)}', 'error')
                 return render_template('upload.html', form=form, title='Upload Energy Data')
+            
+            finally:
+                # A file no job took over is not needed any more
+                if filepath and os.path.exists(filepath):
+                    remove_upload_file(filepath)
         else:
             flash('Please upload a CSV file', 'error')
             return render_template('upload.html', form=form, title='Upload Energy Data')
     
-    return render_template('upload.html', form=form, title='Upload Energy Data')
+    return render_template('upload.html', form=form, title='Upload Energy Data', job_id=request.args.get('job'))
+
+def _find_identical_upload(content_sha256):
+    """The user's fully processed upload with the same file contents, if any"""
+    return Upload.query.filter_by(user_id=current_user.id, content_sha256=content_sha256).first()
 
 @bp.route('/upload-sample-data', methods=['POST'])
 @login_required
@@ -106,10 +156,6 @@ def upload_sample_data():
                 'message': 'Invalid CSRF token'
             })
         
-        import pandas as pd
-        import os
-        from datetime import datetime
-        
         # Path to sample data file
         sample_file_path = os.path.join(current_app.root_path, '..', 'sample_data', 'it_company_energy_data.csv')
         
@@ -119,20 +165,25 @@ def upload_sample_data():
                 'message': 'Sample data file not found'
             })
         
-        # Read the sample CSV
-        df = pd.read_csv(sample_file_path)
-        
-        # Add file name and upload date for tracking
-        df['file_name'] = 'it_company_energy_data.csv'
-        df['upload_date'] = datetime.utcnow()
+        content_sha256 = hash_file(sample_file_path)
+        existing = _find_identical_upload(content_sha256)
+        if existing:
+            return jsonify({
+                'success': True,
+                'duplicate': True,
+                'upload_id': existing.id,
+                'redirect_url': url_for('main.insights', upload=existing.id),
+                'message': 'Sample data was already uploaded. Showing its results.'
+            })
         
-        # Process the data using the existing analyzer
-        analyzer = EnergyAnalyzer()
-        insights_generated = analyzer.process_energy_data(df, current_user.id)
+        # Queue the sample file like any other upload
+        job = create_upload_job(current_user.id, sample_file_path, 'it_company_energy_data.csv',
+                                content_sha256=content_sha256)
         
         return jsonify({
             'success': True,
-            'message': f'Successfully uploaded and analyzed {len(df)} IT company energy records. Generated {insights_generated} insights.'
+            'job_id': job['id'],
+            'message': 'Sample IT company data queued for analysis.'
         })
         
     except Exception as e:
@@ -146,105 +197,156 @@ def upload_sample_data():
 @login_required
 def insights():
     # Get filter parameters
+    upload_filter = request.args.get('upload', type=int)
     file_filter = request.args.get('file')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
+    # Parse dates up front so bad input fails before anything is cached
+    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+    
+    page = get_user_cache().get_or_compute(
+        current_user, 'insights',
+        lambda: _insights_data(current_user.id, upload_filter, file_filter, start_date_obj, end_date_obj),
+        upload=upload_filter, file=file_filter, start_date=start_date, end_date=end_date
+    )
+    
+    return render_template('insights.html', 
+                     title='Energy Insights', 
+                     insights=page['insights'],
+                     upload_history=page['upload_history'],
+                     current_file_filter=page['file_filter'],
+                     current_start_date=start_date,
+                     current_end_date=end_date)
+
+def _insights_data(user_id, upload_filter=None, file_filter=None, start_date=None, end_date=None):
+    """Filtered insights and the numbered upload history"""
     # Base query for insights
-    insights_query = EnergyInsight.query.filter_by(user_id=current_user.id)
+    insights_query = EnergyInsight.query.filter_by(user_id=user_id)
     
-    # Apply file filter if provided
-    if file_filter:
+    # Apply upload / file filter if provided
+    if upload_filter:
+        insights_query = insights_query.filter(EnergyInsight.upload_id == upload_filter)
+        selected_upload = Upload.query.filter_by(id=upload_filter, user_id=user_id).first()
+        file_filter = selected_upload.file_name if selected_upload else file_filter
+    elif file_filter:
         # Filter insights directly by file_name
         insights_query = insights_query.filter(EnergyInsight.file_name == file_filter)
     
     # Apply date range filter if provided
     if start_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        insights_query = insights_query.filter(EnergyInsight.created_at >= start_date_obj)
+        insights_query = insights_query.filter(EnergyInsight.created_at >= start_date)
     
     if end_date:
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        insights_query = insights_query.filter(EnergyInsight.created_at <= end_date_obj)
+        insights_query = insights_query.filter(EnergyInsight.created_at <= end_date)
     
     # Get filtered insights
     all_insights = insights_query.order_by(EnergyInsight.created_at.desc()).all()
     
     # Get upload history with sequential numbering (oldest first)
-    upload_history_query = db.session.query(
-        EnergyData.file_name, 
-        EnergyData.upload_date,
-        db.func.count(EnergyData.id).label('record_count'),
-        db.func.min(EnergyData.id).label('min_id'),
-        db.func.max(EnergyData.id).label('max_id')
-    ).filter_by(user_id=current_user.id)\
-    .group_by(EnergyData.file_name, EnergyData.upload_date)\
-    .order_by(EnergyData.upload_date.asc())\
-    .distinct()
+    uploads = Upload.query.filter_by(user_id=user_id).order_by(Upload.upload_date.asc()).all()
     
     upload_history = []
-    upload_number = 1
-    for upload in upload_history_query:
+    for upload_number, upload in enumerate(uploads, start=1):
         upload_history.append({
+            'id': upload.id,
             'file_name': upload.file_name,
             'upload_date': upload.upload_date,
-            'record_count': upload.record_count,
-            'upload_number': upload_number,
-            'min_id': upload.min_id,
-            'max_id': upload.max_id
+            'record_count': upload.row_count,
+            'upload_number': upload_number
         })
-        upload_number += 1
     
     # Reverse the list to show newest first but keep correct numbering
     upload_history = list(reversed(upload_history))
     
-    return render_template('insights.html', 
-                     title='Energy Insights', 
-                     insights=all_insights,
-                     upload_history=upload_history,
-                     current_file_filter=file_filter,
-                     current_start_date=start_date,
-                     current_end_date=end_date)
+    return {
+        'insights': [row_to_dict(insight) for insight in all_insights],
+        'upload_history': upload_history,
+        'file_filter': file_filter
+    }
+
+@bp.route('/uploads/<int:upload_id>/delete', methods=['POST'])
+@login_required
+def delete_upload(upload_id):
+    """Delete an upload with its readings and insights; a background job then rebuilds the user's rollups and baselines"""
+    upload = Upload.query.filter_by(id=upload_id, user_id=current_user.id).first()
+    if not upload:
+        flash('Upload not found', 'error')
+        return redirect(url_for('main.insights'))
+    
+    file_name = upload.file_name
+    try:
+        insight_ids = db.session.query(EnergyInsight.id).filter_by(user_id=current_user.id, upload_id=upload.id)
+        AIRecommendation.query.filter(AIRecommendation.insight_id.in_(insight_ids.scalar_subquery())).delete(synchronize_session=False)
+        AIAnalysis.query.filter(AIAnalysis.insight_id.in_(insight_ids.scalar_subquery())).delete(synchronize_session=False)
+        EnergyInsight.query.filter_by(user_id=current_user.id, upload_id=upload.id).delete(synchronize_session=False)
+        EnergyData.query.filter_by(user_id=current_user.id, upload_id=upload.id).delete(synchronize_session=False)
+        db.session.delete(upload)
+        
+        bump_data_version(current_user.id)
+        db.session.commit()
+        
+        # The IsolationForest was trained on readings that are gone now
+        ModelStore(current_app.config['MULTIVARIATE_MODEL_FOLDER']).invalidate(current_user.id)
+        
+        # Rebuilding reads the user's whole history, too slow for the request
+        create_rebuild_job(current_user.id)
+        flash(f'Deleted upload {file_name}. Totals and baselines are being refreshed in the background.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error deleting upload: {str(e)}', 'error')
+    
+    return redirect(url_for('main.insights'))
+
+def _find_upload(value):
+    """Resolve an upload by id, or by file name (latest upload of that file)"""
+    query = Upload.query.filter_by(user_id=current_user.id)
+    if value.isdigit():
+        return query.filter_by(id=int(value)).first()
+    return query.filter_by(file_name=value).order_by(Upload.upload_date.desc()).first()
 
 @bp.route('/compare-uploads')
 @login_required
 def compare_uploads():
     """Compare two different uploads"""
-    upload1 = request.args.get('upload1')
-    upload2 = request.args.get('upload2')
+    upload1_param = request.args.get('upload1')
+    upload2_param = request.args.get('upload2')
     
-    if not upload1 or not upload2:
+    if not upload1_param or not upload2_param:
         flash('Please select two uploads to compare', 'error')
         return redirect(url_for('main.insights'))
     
-    # Get data for both uploads
-    upload1_data = EnergyData.query.filter_by(user_id=current_user.id, file_name=upload1).all()
-    upload2_data = EnergyData.query.filter_by(user_id=current_user.id, file_name=upload2).all()
+    upload1 = _find_upload(upload1_param)
+    upload2 = _find_upload(upload2_param)
+    if not upload1 or not upload2:
+        flash('Upload not found', 'error')
+        return redirect(url_for('main.insights'))
     
     # Get insights for both uploads
-    upload1_insights = EnergyInsight.query.filter_by(user_id=current_user.id, file_name=upload1).all()
-    upload2_insights = EnergyInsight.query.filter_by(user_id=current_user.id, file_name=upload2).all()
+    upload1_insights = EnergyInsight.query.filter_by(user_id=current_user.id, upload_id=upload1.id).all()
+    upload2_insights = EnergyInsight.query.filter_by(user_id=current_user.id, upload_id=upload2.id).all()
     
-    # Calculate comparison metrics
-    upload1_total = sum(d.energy_kwh for d in upload1_data)
-    upload2_total = sum(d.energy_kwh for d in upload2_data)
-    upload1_cost = sum(d.cost_inr for d in upload1_data)
-    upload2_cost = sum(d.cost_inr for d in upload2_data)
+    # Comparison metrics come straight from the precomputed upload aggregates
+    upload1_total = upload1.total_energy_kwh or 0
+    upload2_total = upload2.total_energy_kwh or 0
+    upload1_cost = upload1.total_cost_inr or 0
+    upload2_cost = upload2.total_cost_inr or 0
     
     comparison_data = {
         'upload1': {
-            'file_name': upload1,
+            'file_name': upload1.file_name,
             'total_energy': upload1_total,
             'total_cost': upload1_cost,
-            'record_count': len(upload1_data),
+            'record_count': upload1.row_count,
             'insight_count': len(upload1_insights),
             'insights': upload1_insights
         },
         'upload2': {
-            'file_name': upload2,
+            'file_name': upload2.file_name,
             'total_energy': upload2_total,
             'total_cost': upload2_cost,
-            'record_count': len(upload2_data),
+            'record_count': upload2.row_count,
             'insight_count': len(upload2_insights),
             'insights': upload2_insights
         },
@@ -274,18 +376,70 @@ def ai_analysis():
         flash('Insight not found', 'error')
         return redirect(url_for('main.insights'))
     
-    # Get AI analysis
+    # A stored analysis renders at once; otherwise the page streams it from Gemini (stream=0 waits for it instead)
     consultant = AIConsultant(user=current_user)
-    analysis = consultant.get_insight_analysis(insight, current_user.id)
+    if consultant.model and request.args.get('stream') != '0':
+        analysis = consultant.get_cached_analysis(insight, current_user.id)
+        if analysis is None:
+            return render_template('ai_analysis.html', title='AI Energy Analysis', insight=insight, analysis=None,
+                                   stream_url=url_for('main.ai_analysis_stream', insight_id=insight.id),
+                                   fallback_url=url_for('main.ai_analysis', insight_id=insight.id, stream=0))
+    else:
+        analysis = consultant.get_insight_analysis(insight, current_user.id)
     
     return render_template('ai_analysis.html', title='AI Energy Analysis', insight=insight, analysis=analysis)
 
+@bp.route('/ai-analysis/stream')
+@login_required
+def ai_analysis_stream():
+    """Server-sent events: Gemini's text as it is generated, then the parsed analysis and timings"""
+    insight = EnergyInsight.query.filter_by(id=request.args.get('insight_id', type=int), user_id=current_user.id).first()
+    if not insight:
+        return jsonify({'error': 'Insight not found'}), 404
+    
+    consultant = AIConsultant(user=current_user)
+    
+    def events():
+        for event, data in consultant.stream_insight_analysis(insight, current_user.id):
+            if event == 'result':
+                data = {
+                    'analysis': data,
+                    'html': render_template('ai_analysis_result.html', analysis=data),
+                    'source_html': render_template('ai_analysis_source.html', analysis=data)
+                }
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    
+    # Disable proxy buffering so chunks reach the browser as they are generated
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
     form = SettingsForm()
+    tariff_form = TariffForm(prefix='tariff')
+    tariff = load_tariff(current_user.id)
     
-    if form.validate_on_submit():
+    if tariff_form.submit.data and tariff_form.validate_on_submit():
+        try:
+            tariff = tariff or Tariff(user_id=current_user.id)
+            tariff_form.populate_tariff(tariff)
+            db.session.add(tariff)
+            
+            # Re-cost the rollups the dashboard and bills read, and invalidate cached views
+            reprice_rollups(current_user.id, compile_rates(tariff))
+            bump_data_version(current_user.id)
+            db.session.commit()
+            
+            # Rewriting every stored reading can take a while: leave it to the worker pool
+            create_reprice_job(current_user.id)
+            flash('Tariff saved. Stored readings are being repriced in the background.', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error saving tariff: {str(e)}', 'error')
+        return redirect(url_for('main.settings'))
+    
+    if not tariff_form.submit.data and form.validate_on_submit():
         # Update user's API key
         current_user.gemini_api_key = form.gemini_api_key.data
         db.session.commit()
@@ -299,7 +453,10 @@ def settings():
         flash('API key disconnected successfully!', 'info')
         return redirect(url_for('main.settings'))
     
-    # Pre-fill form with current API key
+    # Pre-fill forms with the current API key and tariff
     form.gemini_api_key.data = current_user.gemini_api_key or ''
+    if not tariff_form.is_submitted():
+        tariff_form.load_tariff(tariff, default_energy_rate())
     
-    return render_template('settings.html', title='Settings', form=form)
+    return render_template('settings.html', title='Settings', form=form, tariff_form=tariff_form,
+                           bills=monthly_bills(current_user.id, tariff))
@@ -0,0 +1,42 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss_mb():
+    """Resident set size of this process in MB, or None if the platform can't tell us"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if resource is None:
+        return None
+
+    # Fall back to the lifetime peak (KB on Linux, bytes on macOS)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+class PeakMemoryMonitor:
+    """Track the peak RSS seen across explicit sample points of one upload"""
+
+    def __init__(self):
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+
+    def sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+        return rss
+
+    def describe(self):
+        if self.peak_mb is None:
+            return 'peak RSS n/a'
+        return f'peak RSS {self.peak_mb:.1f} MB (started at {self.start_mb:.1f} MB)'
@@ -14,6 +14,9 @@ class User(UserMixin, db.Model):
     # API Configuration
     gemini_api_key = db.Column(db.String(255))
     
+    # Bumped whenever the user's energy data changes; part of every cache key
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     energy_data = db.relationship('EnergyData', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
@@ -25,6 +28,39 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
 
+class Upload(db.Model):
+    """One processed CSV upload with its aggregates, filled in once at ingest"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    file_name = db.Column(db.String(255))
+    upload_date = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Aggregates over the saved readings
+    row_count = db.Column(db.Integer, default=0)
+    total_energy_kwh = db.Column(db.Float, default=0.0)
+    total_cost_inr = db.Column(db.Float, default=0.0)
+    anomaly_count = db.Column(db.Integer, default=0)
+    start_time = db.Column(db.DateTime)
+    end_time = db.Column(db.DateTime)
+    department_totals = db.Column(db.JSON, default=dict)  # {department: kWh}
+    
+    # SHA-256 of the uploaded file, set once the upload has been fully processed
+    content_sha256 = db.Column(db.String(64))
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # insights upload history
+        db.Index('ix_upload_user_date', 'user_id', 'upload_date'),
+        # compare_uploads by file name
+        db.Index('ix_upload_user_file', 'user_id', 'file_name'),
+        # byte-identical re-upload lookup
+        db.Index('ix_upload_user_sha256', 'user_id', 'content_sha256'),
+    )
+    
+    def __repr__(self):
+        return f'<Upload {self.file_name} - {self.row_count} rows>'
+
 class EnergyData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -39,16 +75,116 @@ class EnergyData(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # File tracking
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'))
     file_name = db.Column(db.String(255))
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Indexes matching the hot query shapes (every query is scoped by user_id)
+    __table_args__ = (
+        # dashboard, api.energy_stats: latest readings
+        db.Index('ix_energy_data_user_timestamp', 'user_id', 'timestamp'),
+        # compare_uploads, insights upload history
+        db.Index('ix_energy_data_user_file_upload', 'user_id', 'file_name', 'upload_date'),
+        # prompt_context.window_summary, api.get_insight_details
+        db.Index('ix_energy_data_user_dept_equipment_timestamp', 'user_id', 'department', 'equipment', 'timestamp'),
+        # readings of one upload
+        db.Index('ix_energy_data_user_upload', 'user_id', 'upload_id'),
+    )
+    
     def __repr__(self):
         return f'<EnergyData {self.timestamp} - {self.energy_kwh} kWh>'
 
+class EnergyRollup(db.Model):
+    """Pre-aggregated readings per (user, bucket, department, equipment), maintained at ingest"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # 'hour', 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    department = db.Column(db.String(100), nullable=False)
+    equipment = db.Column(db.String(100), nullable=False)
+    
+    energy_kwh_sum = db.Column(db.Float, nullable=False, default=0.0)
+    cost_inr_sum = db.Column(db.Float, nullable=False, default=0.0)
+    reading_count = db.Column(db.Integer, nullable=False, default=0)
+    energy_kwh_min = db.Column(db.Float)
+    energy_kwh_max = db.Column(db.Float)
+    anomaly_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        # Upsert target; also serves (user, granularity, time range) reads
+        db.UniqueConstraint('user_id', 'granularity', 'bucket_start', 'department', 'equipment',
+                            name='uq_energy_rollup_bucket'),
+        # AIConsultant context for one department/equipment
+        db.Index('ix_energy_rollup_user_series', 'user_id', 'granularity', 'department', 'equipment', 'bucket_start'),
+    )
+    
+    def __repr__(self):
+        return f'<EnergyRollup {self.granularity} {self.bucket_start} - {self.energy_kwh_sum} kWh>'
+
+class RunningStat(db.Model):
+    """Running count/mean/M2/min/max of every reading of one (user, department, equipment) series"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    department = db.Column(db.String(100), nullable=False)
+    equipment = db.Column(db.String(100), nullable=False)
+    
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    m2 = db.Column(db.Float, nullable=False, default=0.0)  # sum of squared deviations from the mean
+    min_kwh = db.Column(db.Float)
+    max_kwh = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Upsert target; also serves loading a user's stats in series order
+        db.UniqueConstraint('user_id', 'department', 'equipment', name='uq_running_stat_series'),
+    )
+    
+    def __repr__(self):
+        return f'<RunningStat {self.department}/{self.equipment} - n={self.count}>'
+
+class EnergyProfile(db.Model):
+    """Robust hour-of-week baseline (median/MAD) for one (user, department, equipment) series"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    department = db.Column(db.String(100), nullable=False)
+    equipment = db.Column(db.String(100), nullable=False)
+    hour_of_week = db.Column(db.Integer, nullable=False)  # 0 = Monday 00:00 ... 167; -1 = all hours
+    
+    median_kwh = db.Column(db.Float, nullable=False)
+    mad_kwh = db.Column(db.Float, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Upsert target; also serves loading a user's profiles
+        db.UniqueConstraint('user_id', 'department', 'equipment', 'hour_of_week', name='uq_energy_profile_slot'),
+    )
+    
+    def __repr__(self):
+        return f'<EnergyProfile {self.department}/{self.equipment} @{self.hour_of_week} - {self.median_kwh} kWh>'
+
+class Tariff(db.Model):
+    """A user's electricity tariff: base energy rate, time-of-day windows, monthly slabs and demand charge"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    name = db.Column(db.String(100), nullable=False, default='Custom tariff')
+    
+    energy_rate_inr = db.Column(db.Float, nullable=False)  # INR per kWh outside any time-of-day window
+    # [{"name": "peak", "days": [0, 1, 2, 3, 4], "start_hour": 18, "end_hour": 22, "surcharge_inr": 1.5}]
+    time_of_day = db.Column(db.JSON, nullable=False, default=list)
+    # [{"up_to_kwh": 50000, "rate_inr": 7.8}, {"up_to_kwh": null, "rate_inr": 8.9}] per month
+    slabs = db.Column(db.JSON, nullable=False, default=list)
+    demand_charge_inr_per_kw = db.Column(db.Float, nullable=False, default=0.0)  # on the month's peak hourly load
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Tariff {self.name} - {self.energy_rate_inr}/kWh>'
+
 class EnergyInsight(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    insight_type = db.Column(db.String(50), nullable=False)  # 'spike', 'trend', 'high_consumption'
+    insight_type = db.Column(db.String(50), nullable=False)  # 'spike', 'trend', 'high_consumption', 'baseline_shift'
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     department = db.Column(db.String(100))
@@ -58,15 +194,25 @@ class EnergyInsight(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # File tracking
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'))
     file_name = db.Column(db.String(255))
     
+    __table_args__ = (
+        # dashboard, insights page date filters
+        db.Index('ix_energy_insight_user_created', 'user_id', 'created_at'),
+        # insights page file filter, compare_uploads
+        db.Index('ix_energy_insight_user_file', 'user_id', 'file_name'),
+        # insights filter, compare_uploads
+        db.Index('ix_energy_insight_user_upload', 'user_id', 'upload_id'),
+    )
+    
     def __repr__(self):
         return f'<EnergyInsight {self.insight_type} - {self.title}>'
 
 class AIRecommendation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    insight_id = db.Column(db.Integer, db.ForeignKey('energy_insight.id'), nullable=False)
+    insight_id = db.Column(db.Integer, db.ForeignKey('energy_insight.id'), nullable=False, index=True)
     recommendation = db.Column(db.Text, nullable=False)
     priority = db.Column(db.String(20), default='medium')
     estimated_savings_inr = db.Column(db.Float)
@@ -77,3 +223,23 @@ class AIRecommendation(db.Model):
     
     def __repr__(self):
         return f'<AIRecommendation {self.priority} priority>'
+
+class AIAnalysis(db.Model):
+    """Cached Gemini analysis of an insight, keyed by a hash of its prompt context"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    insight_id = db.Column(db.Integer, db.ForeignKey('energy_insight.id'), nullable=False, index=True)
+    context_hash = db.Column(db.String(64), nullable=False, unique=True)
+    model_name = db.Column(db.String(100))
+    analysis = db.Column(db.JSON, nullable=False)  # the dict get_insight_analysis returns
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # TTL sweep
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # per-user LRU eviction
+        db.Index('ix_ai_analysis_user_used', 'user_id', 'last_used_at'),
+    )
+    
+    def __repr__(self):
+        return f'<AIAnalysis insight {self.insight_id} ({self.model_name})>'
@@ -0,0 +1,194 @@
+import glob
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from app import db
+from app.baselines import score_readings
+from app.models import EnergyData, User
+
+logger = logging.getLogger(__name__)
+
+SERIES_KEYS = ['department', 'equipment']
+FEATURE_COLUMNS = ['hour', 'weekday', 'energy_kwh', 'rolling_mean_kwh', 'profile_deviation_kwh', 'profile_z_score']
+
+# Readings per series in the rolling mean (a day of hourly readings)
+ROLLING_WINDOW = 24
+
+# Departments with fewer training readings are scored by the user-wide model
+MIN_DEPARTMENT_ROWS = 500
+ALL_DEPARTMENTS = '*'
+
+DEFAULT_MODEL_SCOPE = 'user'  # or 'department'
+DEFAULT_RETRAIN_INTERVAL = 5  # data versions a cached model stays valid for
+DEFAULT_TRAINING_ROWS = 100000
+DEFAULT_CONTAMINATION = 0.01
+
+def build_features(df, profiles):
+    """Feature matrix of hour, weekday, kWh, rolling mean and deviation from the equipment profile
+
+    df must be sorted by timestamp (as _clean_data leaves it) so the rolling
+    mean runs over each series' preceding readings.
+    """
+    timestamps = df['timestamp']
+    rolling_mean = df.groupby(SERIES_KEYS, sort=False)['energy_kwh'] \
+        .rolling(ROLLING_WINDOW, min_periods=1).mean() \
+        .reset_index(level=list(range(len(SERIES_KEYS))), drop=True)
+    z_score, deviation = score_readings(df, profiles)
+
+    return np.column_stack([
+        timestamps.dt.hour.to_numpy(dtype=float),
+        timestamps.dt.dayofweek.to_numpy(dtype=float),
+        df['energy_kwh'].to_numpy(dtype=float),
+        rolling_mean.reindex(df.index).to_numpy(dtype=float),
+        deviation,
+        z_score
+    ])
+
+class MultivariateDetector:
+    """Scaler + IsolationForest pipelines for one user, either user-wide or per department"""
+
+    def __init__(self, scope=DEFAULT_MODEL_SCOPE, contamination=DEFAULT_CONTAMINATION, random_state=42):
+        self.scope = scope
+        self.contamination = contamination
+        self.random_state = random_state
+        self.models = {}
+        self.data_version = None
+        self.trained_rows = 0
+        self.trained_at = None
+        self.train_seconds = 0.0
+
+    def fit(self, df, profiles):
+        started = time.perf_counter()
+        features = build_features(df, profiles)
+
+        self.models = {ALL_DEPARTMENTS: self._fit_model(features)}
+        if self.scope == 'department':
+            departments = df['department'].to_numpy()
+            for department in pd.unique(departments):
+                mask = departments == department
+                if mask.sum() >= MIN_DEPARTMENT_ROWS:
+                    self.models[department] = self._fit_model(features[mask])
+
+        self.trained_rows = len(df)
+        self.trained_at = datetime.utcnow()
+        self.train_seconds = time.perf_counter() - started
+        return self
+
+    def _fit_model(self, features):
+        model = make_pipeline(
+            StandardScaler(),
+            IsolationForest(contamination=self.contamination, random_state=self.random_state, n_jobs=-1)
+        )
+        return model.fit(features)
+
+    def predict(self, df, profiles):
+        """Anomaly flag and kWh deviation from the profile per reading, scored in one batch per model"""
+        features = build_features(df, profiles)
+        is_anomaly = np.zeros(len(df), dtype=bool)
+
+        departments = df['department'].to_numpy()
+        remaining = np.ones(len(df), dtype=bool)
+        for department, model in self.models.items():
+            if department == ALL_DEPARTMENTS:
+                continue
+            mask = departments == department
+            if mask.any():
+                is_anomaly[mask] = model.predict(features[mask]) == -1
+                remaining &= ~mask
+        if remaining.any():
+            is_anomaly[remaining] = self.models[ALL_DEPARTMENTS].predict(features[remaining]) == -1
+
+        return is_anomaly, features[:, FEATURE_COLUMNS.index('profile_deviation_kwh')]
+
+class ModelStore:
+    """Fitted detectors pickled with joblib, one file per user and scope
+
+    A detector remembers the data version it was trained at and is reused
+    until the user's data has changed retrain_interval times.
+    """
+
+    def __init__(self, folder, retrain_interval=DEFAULT_RETRAIN_INTERVAL):
+        self.folder = folder
+        self.retrain_interval = retrain_interval
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, user_id, scope):
+        return os.path.join(self.folder, f'user-{user_id}-{scope}.joblib')
+
+    def load(self, user_id, scope, data_version):
+        try:
+            detector = joblib.load(self._path(user_id, scope))
+        except (OSError, EOFError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Ignoring unreadable model for user {user_id}: {str(e)}")
+            return None
+        if detector.data_version is None or data_version - detector.data_version >= self.retrain_interval:
+            return None
+        return detector
+
+    def save(self, user_id, detector):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        os.close(fd)
+        joblib.dump(detector, tmp_path)
+        os.replace(tmp_path, self._path(user_id, detector.scope))
+
+    def invalidate(self, user_id):
+        """Drop every cached detector of a user so the next upload retrains on their remaining readings"""
+        for path in glob.glob(os.path.join(self.folder, f'user-{user_id}-*.joblib')):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove model {path}: {str(e)}")
+
+def load_training_readings(user_id, limit=DEFAULT_TRAINING_ROWS):
+    """The user's latest stored readings, oldest first"""
+    query = db.session.query(
+        EnergyData.timestamp,
+        EnergyData.department,
+        EnergyData.equipment,
+        EnergyData.energy_kwh
+    ).filter(EnergyData.user_id == user_id).order_by(EnergyData.timestamp.desc()).limit(limit)
+
+    readings = pd.DataFrame(query.all(), columns=['timestamp', 'department', 'equipment', 'energy_kwh'])
+    readings['timestamp'] = pd.to_datetime(readings['timestamp'])
+    return readings.iloc[::-1].reset_index(drop=True)
+
+def get_detector(user_id, profiles, store, scope=DEFAULT_MODEL_SCOPE,
+                 contamination=DEFAULT_CONTAMINATION, training_rows=DEFAULT_TRAINING_ROWS, fallback=None):
+    """The user's cached detector, or one trained on their stored readings
+
+    A user without stored readings gets a detector trained on fallback (the
+    batch being uploaded), or None when there is nothing to train on.
+    Returns the detector and whether it was trained by this call.
+    """
+    user = db.session.get(User, user_id)
+    data_version = (user.data_version or 0) if user else 0
+
+    detector = store.load(user_id, scope, data_version)
+    if detector is not None:
+        return detector, False
+
+    readings = load_training_readings(user_id, training_rows)
+    if readings.empty:
+        if fallback is None or fallback.empty:
+            return None, False
+        readings = fallback.tail(training_rows)
+
+    detector = MultivariateDetector(scope, contamination).fit(readings, profiles)
+    detector.data_version = data_version
+    try:
+        store.save(user_id, detector)
+    except OSError as e:
+        logger.warning(f"Could not cache model for user {user_id}: {str(e)}")
+
+    logger.info(f"Trained {scope} IsolationForest for user {user_id} on {detector.trained_rows} readings "
+                f"in {detector.train_seconds:.2f}s ({len(detector.models)} models)")
+    return detector, True
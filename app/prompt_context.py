@@ -0,0 +1,221 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from flask import current_app
+from app import db
+from app.models import EnergyData, EnergyRollup
+from app.rollups import _filter_rollups
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 900
+CHARS_PER_TOKEN = 4  # rough Gemini tokenizer ratio for English and numbers; no API call needed
+TOP_ANOMALIES = 5
+PERCENTILES = [5, 25, 50, 75, 95]
+RECENT_DAYS = 7  # days kept at daily resolution once older days are folded into weeks
+
+# Compaction levels tried in order until the prompt fits the token budget
+COMPACTION_LEVELS = [
+    ('full',          {'daily_days': None, 'weekly': False, 'hour_block': 1, 'anomalies': TOP_ANOMALIES}),
+    ('weekly',        {'daily_days': RECENT_DAYS, 'weekly': True, 'hour_block': 1, 'anomalies': TOP_ANOMALIES}),
+    ('hour_blocks',   {'daily_days': RECENT_DAYS, 'weekly': True, 'hour_block': 4, 'anomalies': TOP_ANOMALIES}),
+    ('few_anomalies', {'daily_days': RECENT_DAYS, 'weekly': True, 'hour_block': 4, 'anomalies': 2}),
+    ('recent_days',   {'daily_days': RECENT_DAYS, 'weekly': False, 'hour_block': 4, 'anomalies': 2}),
+    ('minimal',       {'daily_days': 3, 'weekly': False, 'hour_block': None, 'anomalies': 0})
+]
+
+def estimate_tokens(text):
+    """Approximate Gemini token count of text"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def window_summary(user_id, department=None, equipment=None, start=None, top_anomalies=TOP_ANOMALIES):
+    """Compact summary of a series' readings since start, from the hourly rollups and the largest anomalies
+
+    Two indexed queries however dense the data is: hourly totals (at most 24
+    rows per day) and the top_anomalies anomalous readings by deviation.
+    """
+    query = db.session.query(
+        EnergyRollup.bucket_start,
+        db.func.sum(EnergyRollup.energy_kwh_sum),
+        db.func.sum(EnergyRollup.cost_inr_sum),
+        db.func.sum(EnergyRollup.reading_count),
+        db.func.sum(EnergyRollup.anomaly_count)
+    )
+    query = _filter_rollups(query, user_id, 'hour', department, equipment, start).group_by(EnergyRollup.bucket_start)
+    hourly = pd.DataFrame(query.all(), columns=['bucket_start', 'energy_kwh', 'cost_inr', 'readings', 'anomalies'])
+
+    query = EnergyData.query.filter_by(user_id=user_id, is_anomaly=True)
+    if department:
+        query = query.filter_by(department=department)
+    if equipment:
+        query = query.filter_by(equipment=equipment)
+    if start is not None:
+        query = query.filter(EnergyData.timestamp >= start)
+    query = query.order_by(db.func.coalesce(EnergyData.anomaly_score, 0).desc()).limit(top_anomalies)
+    anomalies = pd.DataFrame(
+        [(d.timestamp, d.equipment, d.energy_kwh, d.anomaly_score) for d in query.all()],
+        columns=['timestamp', 'equipment', 'energy_kwh', 'anomaly_score']
+    )
+    return summarize(hourly, anomalies)
+
+def summarize(hourly, anomalies):
+    """JSON-ready summary of hourly totals and anomalous readings
+
+    hourly has bucket_start, energy_kwh, cost_inr, readings and anomalies
+    columns; anomalies has timestamp, equipment, energy_kwh and anomaly_score,
+    largest deviation first.
+    """
+    summary = {
+        'data_points': int(hourly['readings'].sum()) if not hourly.empty else 0,
+        'total_consumption': float(hourly['energy_kwh'].sum()) if not hourly.empty else 0.0,
+        'total_cost': float(hourly['cost_inr'].sum()) if not hourly.empty else 0.0,
+        'anomaly_count': int(hourly['anomalies'].sum()) if not hourly.empty else 0,
+        'days': [],
+        'hour_profile': [],
+        'percentiles': {},
+        'top_anomalies': []
+    }
+    if hourly.empty:
+        return summary
+
+    hourly = hourly.assign(bucket_start=pd.to_datetime(hourly['bucket_start']), cost_inr=hourly['cost_inr'].fillna(0))
+    daily = hourly.groupby(hourly['bucket_start'].dt.normalize()).agg(
+        energy_kwh=('energy_kwh', 'sum'),
+        cost_inr=('cost_inr', 'sum'),
+        anomalies=('anomalies', 'sum')
+    )
+    summary['days'] = [
+        {'date': day.strftime('%Y-%m-%d'), 'energy_kwh': round(float(row.energy_kwh), 2),
+         'cost_inr': round(float(row.cost_inr), 2), 'anomalies': int(row.anomalies)}
+        for day, row in daily.iterrows()
+    ]
+
+    # Mean kWh of each hour of the day over the hours that had readings
+    profile = hourly.groupby(hourly['bucket_start'].dt.hour)['energy_kwh'].mean().reindex(range(24))
+    summary['hour_profile'] = [None if np.isnan(value) else round(float(value), 2) for value in profile]
+
+    values = np.percentile(hourly['energy_kwh'].to_numpy(dtype=float), PERCENTILES + [100])
+    summary['percentiles'] = {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, values)}
+    summary['percentiles']['max'] = round(float(values[-1]), 2)
+
+    summary['top_anomalies'] = [
+        {'timestamp': pd.Timestamp(row.timestamp).strftime('%Y-%m-%d %H:%M'), 'equipment': row.equipment,
+         'energy_kwh': round(float(row.energy_kwh), 2),
+         'deviation_kwh': None if pd.isna(row.anomaly_score) else round(float(row.anomaly_score), 2)}
+        for row in anomalies.itertuples(index=False)
+    ]
+    return summary
+
+def render_summary(summary, daily_days=None, weekly=False, hour_block=1, anomalies=TOP_ANOMALIES):
+    """The summary as prompt text at one compaction level
+
+    daily_days keeps only the latest days at daily resolution; the older ones
+    are folded into weekly totals when weekly is set, otherwise left out.
+    hour_block averages the hour-of-day profile over blocks of that many
+    hours (None leaves it out) and anomalies caps the listed anomalies.
+    """
+    if not summary['days']:
+        return "No readings in the analysis window."
+
+    lines = ["Hourly kWh percentiles: " + ", ".join(f"{name} {value:.1f}" for name, value in summary['percentiles'].items())]
+
+    if hour_block:
+        profile = summary['hour_profile']
+        blocks = []
+        for first in range(0, 24, hour_block):
+            values = [value for value in profile[first:first + hour_block] if value is not None]
+            if values:
+                label = f"{first:02d}h" if hour_block == 1 else f"{first:02d}-{first + hour_block:02d}h"
+                blocks.append(f"{label} {sum(values) / len(values):.1f}")
+        lines.append("Average kWh by hour of day: " + ", ".join(blocks))
+
+    days = summary['days']
+    recent = days if daily_days is None else days[-daily_days:]
+    older = days[:len(days) - len(recent)]
+    lines.append("Daily totals:")
+    if weekly and older:
+        weeks = {}
+        for day in older:
+            date = pd.Timestamp(day['date'])
+            week_start = (date - pd.Timedelta(days=date.dayofweek)).strftime('%Y-%m-%d')
+            week = weeks.setdefault(week_start, {'energy_kwh': 0.0, 'cost_inr': 0.0, 'anomalies': 0, 'days': 0})
+            for field in ('energy_kwh', 'cost_inr', 'anomalies'):
+                week[field] += day[field]
+            week['days'] += 1
+        lines.extend(_total_line(f"week of {week_start} ({week['days']}d)", week) for week_start, week in weeks.items())
+    lines.extend(_total_line(day['date'], day) for day in recent)
+
+    if anomalies and summary['top_anomalies']:
+        lines.append("Largest anomalies:")
+        for anomaly in summary['top_anomalies'][:anomalies]:
+            deviation = f" (deviation {anomaly['deviation_kwh']:.1f} kWh)" if anomaly['deviation_kwh'] is not None else ""
+            lines.append(f"- {anomaly['timestamp']} {anomaly['equipment']}: {anomaly['energy_kwh']:.1f} kWh{deviation}")
+
+    return "\n".join(lines)
+
+def _total_line(label, totals):
+    line = f"- {label}: {totals['energy_kwh']:.1f} kWh, ₹{totals['cost_inr']:.0f}"
+    if totals['anomalies']:
+        line += f", {totals['anomalies']} anomal{'y' if totals['anomalies'] == 1 else 'ies'}"
+    return line
+
+def fit_prompt(render, summary, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Build the least compacted prompt that fits the token budget
+
+    render(summary_text) returns the whole prompt. Returns the prompt, its
+    estimated tokens and the compaction level used; a budget of 0 disables
+    compaction. When even the most compact level is over budget it is used
+    anyway (the fixed instructions alone take that much).
+    """
+    for level, options in COMPACTION_LEVELS:
+        prompt = render(render_summary(summary, **options))
+        tokens = estimate_tokens(prompt)
+        if not token_budget or tokens <= token_budget:
+            return prompt, tokens, level
+    logger.warning(f"Analysis prompt of ~{tokens} tokens is over the {token_budget} token budget at the most compact level")
+    return prompt, tokens, level
+
+class PromptMetrics:
+    """Prompt size and model latency of this process's Gemini calls, per model"""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name, prompt_tokens, latency_ms, compaction=None, first_chunk_ms=None):
+        with self._lock:
+            stats = self._models.setdefault(model_name, {
+                'calls': 0, 'prompt_tokens': 0, 'max_prompt_tokens': 0,
+                'latency_ms': 0.0, 'max_latency_ms': 0.0, 'first_chunk_ms': 0.0, 'streamed': 0, 'compaction': {}
+            })
+            stats['calls'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['max_prompt_tokens'] = max(stats['max_prompt_tokens'], prompt_tokens)
+            stats['latency_ms'] += latency_ms
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+            if first_chunk_ms is not None:
+                stats['streamed'] += 1
+                stats['first_chunk_ms'] += first_chunk_ms
+            if compaction:
+                stats['compaction'][compaction] = stats['compaction'].get(compaction, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {model_name: {
+                'calls': stats['calls'],
+                'mean_prompt_tokens': round(stats['prompt_tokens'] / stats['calls'], 1),
+                'max_prompt_tokens': stats['max_prompt_tokens'],
+                'mean_latency_ms': round(stats['latency_ms'] / stats['calls'], 1),
+                'max_latency_ms': round(stats['max_latency_ms'], 1),
+                'mean_first_chunk_ms': round(stats['first_chunk_ms'] / stats['streamed'], 1) if stats['streamed'] else None,
+                'compaction': dict(stats['compaction'])
+            } for model_name, stats in self._models.items()}
+
+def get_prompt_metrics(app=None):
+    """The app's PromptMetrics"""
+    app = app or current_app
+    metrics = app.extensions.get('gemini_prompt_metrics')
+    if metrics is None:
+        metrics = app.extensions.setdefault('gemini_prompt_metrics', PromptMetrics())
+    return metrics
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from app.gemini_clients import key_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_PER_MINUTE = 15
+DEFAULT_BURST = 5
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Adaptive backoff on quota errors: halve the rate (down to MIN_RATE_FRACTION of
+# the configured one) and pause; each success wins back RECOVERY_FRACTION of it
+MIN_RATE_FRACTION = 0.1
+RECOVERY_FRACTION = 0.1
+INITIAL_BACKOFF = 2.0   # seconds
+MAX_BACKOFF = 60.0
+
+def is_quota_error(error):
+    """Whether a Gemini exception means the key is over its quota (HTTP 429 / RESOURCE_EXHAUSTED)"""
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'resource exhausted' in message or 'resourceexhausted' in type(error).__name__.lower()
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate adapts to quota errors
+
+    acquire() blocks until a token is available and returns the seconds it
+    waited. A quota error halves the refill rate, drains the bucket to a
+    single token and pauses it with an exponentially growing backoff;
+    successes restore the rate additively (AIMD).
+    """
+
+    def __init__(self, rate_per_minute=DEFAULT_RATE_PER_MINUTE, burst=DEFAULT_BURST):
+        self.max_rate = rate_per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - started
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self.backoff = 0.0
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FRACTION)
+
+    def record_quota_error(self):
+        """Slow down after a 429; returns the pause in seconds"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                # Calls already in flight when the first 429 arrived; don't back off twice for one burst
+                return self.paused_until - now
+            self._refill(now)
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+            self.backoff = min(MAX_BACKOFF, self.backoff * 2 or INITIAL_BACKOFF)
+            self.paused_until = max(self.paused_until, now + self.backoff)
+            self.tokens = min(self.tokens, 1.0)  # one probe call when the pause ends, then the slower rate
+            return self.backoff
+
+class _KeyLimit:
+    def __init__(self, rate_per_minute, burst, max_concurrency):
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.quota_errors = 0
+        self.waited_seconds = 0.0
+
+class GeminiRateLimiter:
+    """Per-API-key token bucket plus a cap on concurrent Gemini calls, shared by this process's threads"""
+
+    def __init__(self, rate_per_minute=DEFAULT_RATE_PER_MINUTE, burst=DEFAULT_BURST,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _limit(self, api_key):
+        with self._lock:
+            limit = self._keys.get(api_key)
+            if limit is None:
+                limit = self._keys[api_key] = _KeyLimit(self.rate_per_minute, self.burst, self.max_concurrency)
+            return limit
+
+    @contextmanager
+    def slot(self, api_key):
+        """Hold one of the key's concurrent slots and one token for the duration of a call
+
+        Yields the seconds spent waiting for the slot and the token.
+        """
+        limit = self._limit(api_key)
+        started = time.monotonic()
+        with limit.slots:
+            limit.bucket.acquire()
+            waited = time.monotonic() - started
+            with self._lock:
+                limit.in_flight += 1
+                limit.calls += 1
+                limit.waited_seconds += waited
+            try:
+                yield waited
+            finally:
+                with self._lock:
+                    limit.in_flight -= 1
+
+    def record_success(self, api_key):
+        self._limit(api_key).bucket.record_success()
+
+    def record_quota_error(self, api_key):
+        limit = self._limit(api_key)
+        with self._lock:
+            limit.quota_errors += 1
+        pause = limit.bucket.record_quota_error()
+        logger.warning(f"Gemini quota error for key {key_fingerprint(api_key)}; pausing {pause:.0f}s at "
+                       f"{limit.bucket.rate * 60:.1f} requests/min")
+
+    def stats(self):
+        with self._lock:
+            return {key_fingerprint(api_key): {
+                'rate_per_minute': round(limit.bucket.rate * 60, 2),
+                'paused_seconds': round(max(0.0, limit.bucket.paused_until - time.monotonic()), 1),
+                'in_flight': limit.in_flight,
+                'calls': limit.calls,
+                'quota_errors': limit.quota_errors,
+                'waited_seconds': round(limit.waited_seconds, 2)
+            } for api_key, limit in self._keys.items()}
+
+def get_rate_limiter(app=None):
+    """The app's GeminiRateLimiter, built from GEMINI_RATE_LIMIT_* config on first use"""
+    app = app or current_app
+    limiter = app.extensions.get('gemini_rate_limiter')
+    if limiter is None:
+        limiter = app.extensions.setdefault('gemini_rate_limiter', GeminiRateLimiter(
+            app.config['GEMINI_RATE_LIMIT_PER_MINUTE'],
+            app.config['GEMINI_RATE_LIMIT_BURST'],
+            app.config['GEMINI_MAX_CONCURRENCY']
+        ))
+    return limiter
@@ -0,0 +1,174 @@
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import EnergyData, EnergyRollup
+
+logger = logging.getLogger(__name__)
+
+# Granularity name -> pandas floor frequency
+GRANULARITIES = {
+    'hour': 'h',
+    'day': 'D'
+}
+
+BUCKET_KEYS = ['user_id', 'granularity', 'bucket_start', 'department', 'equipment']
+
+def compute_rollups(df, user_id):
+    """Aggregate scored readings into hour and day buckets per department/equipment"""
+    frames = []
+    for granularity, freq in GRANULARITIES.items():
+        buckets = df.assign(bucket_start=df['timestamp'].dt.floor(freq),
+                            is_anomaly=df['is_anomaly'].astype(int))
+        grouped = buckets.groupby(['bucket_start', 'department', 'equipment'], sort=False).agg(
+            energy_kwh_sum=('energy_kwh', 'sum'),
+            cost_inr_sum=('cost_inr', 'sum'),
+            reading_count=('energy_kwh', 'size'),
+            energy_kwh_min=('energy_kwh', 'min'),
+            energy_kwh_max=('energy_kwh', 'max'),
+            anomaly_count=('is_anomaly', 'sum')
+        ).reset_index()
+        grouped.insert(0, 'granularity', granularity)
+        grouped.insert(0, 'user_id', user_id)
+        frames.append(grouped)
+    
+    return pd.concat(frames, ignore_index=True)
+
+def update_rollups(df, user_id, batch_size=5000):
+    """Merge a batch of scored readings into the rollup tables (upsert, same transaction)"""
+    if df.empty:
+        return 0
+    
+    rollups = compute_rollups(df, user_id)
+    connection = db.session.connection()
+    statement = _upsert_statement(connection.dialect.name)
+    
+    records = rollups.astype(object).to_dict('records')
+    for start in range(0, len(records), batch_size):
+        connection.execute(statement, records[start:start + batch_size])
+    
+    return len(records)
+
+def _upsert_statement(dialect_name):
+    table = EnergyRollup.__table__
+    if dialect_name == 'postgresql':
+        statement = postgresql.insert(table)
+        least, greatest = db.func.least, db.func.greatest
+    else:
+        # SQLite's multi-argument min()/max() are scalar functions
+        statement = sqlite.insert(table)
+        least, greatest = db.func.min, db.func.max
+    
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=BUCKET_KEYS,
+        set_={
+            'energy_kwh_sum': table.c.energy_kwh_sum + excluded.energy_kwh_sum,
+            'cost_inr_sum': table.c.cost_inr_sum + excluded.cost_inr_sum,
+            'reading_count': table.c.reading_count + excluded.reading_count,
+            'energy_kwh_min': least(table.c.energy_kwh_min, excluded.energy_kwh_min),
+            'energy_kwh_max': greatest(table.c.energy_kwh_max, excluded.energy_kwh_max),
+            'anomaly_count': table.c.anomaly_count + excluded.anomaly_count
+        }
+    )
+
+def rebuild_rollups(user_id=None, chunk_size=100000):
+    """Regenerate rollups from raw EnergyData, for one user or everyone"""
+    rollup_query = EnergyRollup.query
+    data_query = db.session.query(
+        EnergyData.user_id,
+        EnergyData.timestamp,
+        EnergyData.department,
+        EnergyData.equipment,
+        EnergyData.energy_kwh,
+        EnergyData.cost_inr,
+        EnergyData.is_anomaly
+    )
+    if user_id is not None:
+        rollup_query = rollup_query.filter_by(user_id=user_id)
+        data_query = data_query.filter(EnergyData.user_id == user_id)
+    
+    rollup_query.delete(synchronize_session=False)
+    
+    rows = 0
+    for chunk in pd.read_sql(data_query.statement, db.session.connection(), chunksize=chunk_size):
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+        chunk['cost_inr'] = chunk['cost_inr'].fillna(0.0)
+        chunk['is_anomaly'] = chunk['is_anomaly'].fillna(False).astype(bool)
+        for chunk_user_id, user_chunk in chunk.groupby('user_id'):
+            update_rollups(user_chunk, int(chunk_user_id))
+        rows += len(chunk)
+    
+    db.session.commit()
+    logger.info(f"Rebuilt rollups from {rows} readings" + (f" for user {user_id}" if user_id is not None else ""))
+    return rows
+
+def rollup_totals(user_id, granularity='day', department=None, equipment=None, start=None, end=None):
+    """Totals over a user's rollups, optionally for one series and a [start, end) window"""
+    query = db.session.query(
+        db.func.coalesce(db.func.sum(EnergyRollup.energy_kwh_sum), 0.0),
+        db.func.coalesce(db.func.sum(EnergyRollup.cost_inr_sum), 0.0),
+        db.func.coalesce(db.func.sum(EnergyRollup.reading_count), 0),
+        db.func.coalesce(db.func.sum(EnergyRollup.anomaly_count), 0)
+    )
+    query = _filter_rollups(query, user_id, granularity, department, equipment, start, end)
+    energy, cost, readings, anomalies = query.one()
+    
+    return {
+        'total_consumption': float(energy),
+        'total_cost': float(cost),
+        'data_points': int(readings),
+        'anomaly_count': int(anomalies)
+    }
+
+def usage_summary(user_id, start=None, end=None):
+    """Dashboard totals and kWh per department in one grouped aggregate query"""
+    query = db.session.query(
+        EnergyRollup.department,
+        db.func.sum(EnergyRollup.energy_kwh_sum),
+        db.func.sum(EnergyRollup.cost_inr_sum),
+        db.func.sum(EnergyRollup.reading_count),
+        db.func.sum(EnergyRollup.anomaly_count)
+    )
+    query = _filter_rollups(query, user_id, 'day', start=start, end=end)
+    rows = query.group_by(EnergyRollup.department).all()
+    
+    return {
+        'total_consumption': float(sum(row[1] for row in rows)),
+        'total_cost': float(sum(row[2] for row in rows)),
+        'data_points': int(sum(row[3] for row in rows)),
+        'anomaly_count': int(sum(row[4] for row in rows)),
+        'department_breakdown': {department: float(energy) for department, energy, _, _, _ in rows}
+    }
+
+def date_window(start_date=None, end_date=None):
+    """Turn inclusive YYYY-MM-DD bounds into a [start, end) datetime window"""
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1) if end_date else None
+    return start, end
+
+def time_series(user_id, granularity='day', department=None, equipment=None, start=None, end=None, limit=None):
+    """(bucket_start, kWh, cost) totals per bucket, oldest first; limit keeps the latest buckets"""
+    query = db.session.query(
+        EnergyRollup.bucket_start,
+        db.func.sum(EnergyRollup.energy_kwh_sum),
+        db.func.sum(EnergyRollup.cost_inr_sum)
+    )
+    query = _filter_rollups(query, user_id, granularity, department, equipment, start, end)
+    query = query.group_by(EnergyRollup.bucket_start).order_by(EnergyRollup.bucket_start.desc())
+    if limit:
+        query = query.limit(limit)
+    return list(reversed(query.all()))
+
+def _filter_rollups(query, user_id, granularity, department=None, equipment=None, start=None, end=None):
+    query = query.filter(EnergyRollup.user_id == user_id, EnergyRollup.granularity == granularity)
+    if department:
+        query = query.filter(EnergyRollup.department == department)
+    if equipment:
+        query = query.filter(EnergyRollup.equipment == equipment)
+    if start is not None:
+        query = query.filter(EnergyRollup.bucket_start >= start)
+    if end is not None:
+        query = query.filter(EnergyRollup.bucket_start < end)
+    return query
@@ -0,0 +1,141 @@
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import EnergyData, RunningStat
+
+logger = logging.getLogger(__name__)
+
+MOMENT_COLUMNS = ['count', 'mean', 'm2', 'min', 'max']
+SERIES_KEYS = ['department', 'equipment']
+
+def batch_moments(df, keys, value='energy_kwh'):
+    """Count, mean, sum of squared deviations (M2), min and max of a batch, grouped by keys"""
+    grouped = df.groupby(keys, sort=False)[value]
+    moments = grouped.agg(['count', 'mean', 'var', 'min', 'max'])
+    moments['m2'] = moments['var'].fillna(0) * (moments['count'] - 1)
+    return moments[MOMENT_COLUMNS]
+
+def merge_moments(left, right):
+    """Combine two moment frames indexed by the same keys (Chan et al. parallel update)"""
+    if right is None or right.empty:
+        return left.copy() if left is not None else pd.DataFrame(columns=SERIES_KEYS + MOMENT_COLUMNS).set_index(SERIES_KEYS)
+    if left is None or left.empty:
+        return right.copy()
+
+    left, right = left[MOMENT_COLUMNS].align(right[MOMENT_COLUMNS], join='outer')
+    left_count = left['count'].fillna(0)
+    right_count = right['count'].fillna(0)
+    count = left_count + right_count
+    delta = right['mean'].fillna(0) - left['mean'].fillna(0)
+    weight = (right_count / count).fillna(0)
+
+    return pd.DataFrame({
+        'count': count,
+        'mean': left['mean'].fillna(0) + delta * weight,
+        'm2': left['m2'].fillna(0) + right['m2'].fillna(0) + delta ** 2 * left_count * weight,
+        'min': np.fmin(left['min'], right['min']),
+        'max': np.fmax(left['max'], right['max'])
+    })
+
+def group_moments(moments, level='department'):
+    """Collapse (department, equipment) moments to one row per department"""
+    count = moments['count'].groupby(level=level, sort=False).sum()
+    weighted = (moments['count'] * moments['mean']).groupby(level=level, sort=False).sum()
+    mean = weighted / count
+
+    # Each series' M2 plus the spread of its mean around the department mean
+    spread = moments['count'] * (moments['mean'] - mean.reindex(moments.index.get_level_values(level)).to_numpy()) ** 2
+    m2 = (moments['m2'] + spread).groupby(level=level, sort=False).sum()
+
+    return pd.DataFrame({
+        'count': count,
+        'mean': mean,
+        'm2': m2,
+        'min': moments['min'].groupby(level=level, sort=False).min(),
+        'max': moments['max'].groupby(level=level, sort=False).max()
+    })
+
+def moments_to_baseline(moments):
+    """Mean and sample standard deviation (ddof=1, NaN for single readings)"""
+    variance = moments['m2'] / (moments['count'] - 1).where(moments['count'] > 1)
+    return pd.DataFrame({
+        'mean': moments['mean'],
+        'std': variance.clip(lower=0) ** 0.5
+    })
+
+def load_running_stats(user_id):
+    """A user's persisted per-(department, equipment) moments"""
+    query = db.session.query(
+        RunningStat.department,
+        RunningStat.equipment,
+        RunningStat.count,
+        RunningStat.mean,
+        RunningStat.m2,
+        RunningStat.min_kwh,
+        RunningStat.max_kwh
+    ).filter(RunningStat.user_id == user_id)
+
+    stats = pd.DataFrame(query.all(), columns=SERIES_KEYS + MOMENT_COLUMNS)
+    return stats.set_index(SERIES_KEYS)
+
+def save_running_stats(user_id, moments, batch_size=5000):
+    """Upsert merged moments for a user (same transaction as the upload)"""
+    if moments is None or moments.empty:
+        return 0
+
+    records = moments.rename(columns={'min': 'min_kwh', 'max': 'max_kwh'}).reset_index()
+    records.insert(0, 'user_id', user_id)
+    records['count'] = records['count'].astype(int)
+    records['updated_at'] = datetime.utcnow()
+    records = records.astype(object).to_dict('records')
+
+    connection = db.session.connection()
+    statement = _upsert_statement(connection.dialect.name)
+    for start in range(0, len(records), batch_size):
+        connection.execute(statement, records[start:start + batch_size])
+
+    return len(records)
+
+def _upsert_statement(dialect_name):
+    table = RunningStat.__table__
+    statement = (postgresql if dialect_name == 'postgresql' else sqlite).insert(table)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=['user_id'] + SERIES_KEYS,
+        set_={column: getattr(excluded, column)
+              for column in ('count', 'mean', 'm2', 'min_kwh', 'max_kwh', 'updated_at')}
+    )
+
+def rebuild_running_stats(user_id, chunk_size=100000):
+    """Recompute a user's running statistics from raw EnergyData (e.g. after deleting an upload)"""
+    RunningStat.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+    data_query = db.session.query(
+        EnergyData.department,
+        EnergyData.equipment,
+        EnergyData.energy_kwh
+    ).filter(EnergyData.user_id == user_id)
+
+    moments = None
+    for chunk in pd.read_sql(data_query.statement, db.session.connection(), chunksize=chunk_size):
+        moments = merge_moments(moments, batch_moments(chunk, SERIES_KEYS))
+
+    return save_running_stats(user_id, moments)
+
+def baseline_summary(user_id, limit=20):
+    """Mean, standard deviation and range per (department, equipment) for display"""
+    stats = RunningStat.query.filter_by(user_id=user_id) \
+        .order_by(RunningStat.department, RunningStat.equipment).limit(limit).all()
+
+    return [{
+        'department': stat.department,
+        'equipment': stat.equipment,
+        'count': stat.count,
+        'mean_kwh': stat.mean,
+        'std_kwh': (stat.m2 / (stat.count - 1)) ** 0.5 if stat.count > 1 else None,
+        'min_kwh': stat.min_kwh,
+        'max_kwh': stat.max_kwh
+    } for stat in stats]
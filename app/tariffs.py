@@ -0,0 +1,185 @@
+import logging
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from sqlalchemy import Integer, bindparam, case, cast, extract, literal
+from app import db
+from app.baselines import HOURS_PER_WEEK, hour_of_week
+from app.models import EnergyData, EnergyRollup, Tariff, Upload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENERGY_RATE = 8.50  # INR per kWh for Indian industries
+
+def default_energy_rate():
+    """INDUSTRIAL_ENERGY_RATE, the flat rate of users without a tariff"""
+    return current_app.config.get('INDUSTRIAL_ENERGY_RATE', DEFAULT_ENERGY_RATE) if has_app_context() else DEFAULT_ENERGY_RATE
+
+def load_tariff(user_id):
+    return Tariff.query.filter_by(user_id=user_id).first()
+
+def window_slots(window):
+    """Hour-of-week slots a time-of-day window covers
+
+    end_hour is exclusive; a window ending at or before its start hour wraps
+    past midnight (e.g. 22 to 6).
+    """
+    start, end = int(window['start_hour']) % 24, int(window['end_hour']) % 24
+    hours = np.arange(start, end) if start < end else np.r_[np.arange(start, 24), np.arange(0, end)]
+    days = np.asarray(window.get('days') or range(7), dtype=int)
+    return (days[:, None] * 24 + hours[None, :]).ravel()
+
+def compile_rates(tariff=None):
+    """168-entry INR/kWh lookup table indexed by hour of week (0 = Monday 00:00)
+
+    Slots outside every window pay the energy rate; a slot covered by several
+    windows takes the surcharge of the last one.
+    """
+    energy_rate = float(tariff.energy_rate_inr) if tariff else default_energy_rate()
+    rates = np.full(HOURS_PER_WEEK, energy_rate)
+    for window in (tariff.time_of_day or []) if tariff else []:
+        rates[window_slots(window)] = energy_rate + float(window.get('surcharge_inr') or 0)
+    return rates
+
+def price_readings(df, rates):
+    """cost_inr of every reading with one gather from the hour-of-week rate table"""
+    return df['energy_kwh'].to_numpy(dtype=float) * rates[hour_of_week(df['timestamp']).to_numpy()]
+
+def _hour_of_week_sql(column):
+    # extract('dow') counts from Sunday = 0 on both SQLite and PostgreSQL
+    return ((cast(extract('dow', column), Integer) + 6) % 7) * 24 + cast(extract('hour', column), Integer)
+
+def _rate_groups(rates):
+    """(rate, slots) for each distinct rate; a flat tariff is a single group"""
+    values, inverse = np.unique(rates, return_inverse=True)
+    return [(float(value), np.flatnonzero(inverse == index).tolist()) for index, value in enumerate(values)]
+
+def _rate_expression(timestamp_column, rates):
+    """INR/kWh at each row's timestamp as one CASE over the distinct rates (the most common one is the ELSE)"""
+    groups = sorted(_rate_groups(rates), key=lambda group: len(group[1]))
+    if len(groups) == 1:
+        return literal(groups[0][0])
+    slot = _hour_of_week_sql(timestamp_column)
+    return case(*[(slot.in_(slots), rate) for rate, slots in groups[:-1]], else_=groups[-1][0])
+
+def reprice_rollups(user_id, rates, chunk_size=100000):
+    """Re-cost a user's hourly and daily rollups under new rates
+
+    All readings in an hourly bucket share its hour-of-week slot, so each
+    hourly cost is exactly its kWh times the slot's rate: one UPDATE over the
+    user's hourly rollups, then the daily ones are re-summed from them. The
+    readings themselves are repriced by reprice_readings, in a background
+    job. Nothing is committed. Returns the number of hourly rollups repriced.
+    """
+    repriced = EnergyRollup.query.filter(EnergyRollup.user_id == user_id, EnergyRollup.granularity == 'hour').update(
+        {EnergyRollup.cost_inr_sum: EnergyRollup.energy_kwh_sum * _rate_expression(EnergyRollup.bucket_start, rates)},
+        synchronize_session=False
+    )
+    _resum_daily_costs(user_id, chunk_size)
+
+    logger.info(f"Repriced {repriced} hourly rollups for user {user_id} ({len(_rate_groups(rates))} distinct rates)")
+    return repriced
+
+def reprice_readings(user_id, rates):
+    """Re-cost a user's stored readings and upload totals under new rates in one pass
+
+    Nothing is committed. Returns the number of readings repriced.
+    """
+    repriced = EnergyData.query.filter(EnergyData.user_id == user_id).update(
+        {EnergyData.cost_inr: EnergyData.energy_kwh * _rate_expression(EnergyData.timestamp, rates)},
+        synchronize_session=False
+    )
+    _resum_upload_costs(user_id)
+
+    logger.info(f"Repriced {repriced} readings for user {user_id}")
+    return repriced
+
+def _resum_daily_costs(user_id, chunk_size=100000):
+    hour_query = db.session.query(
+        EnergyRollup.bucket_start,
+        EnergyRollup.department,
+        EnergyRollup.equipment,
+        EnergyRollup.cost_inr_sum
+    ).filter(EnergyRollup.user_id == user_id, EnergyRollup.granularity == 'hour')
+
+    keys = ['bucket_start', 'department', 'equipment']
+    daily = None
+    for chunk in pd.read_sql(hour_query.statement, db.session.connection(), chunksize=chunk_size):
+        chunk['bucket_start'] = pd.to_datetime(chunk['bucket_start']).dt.floor('D')
+        costs = chunk.groupby(keys)['cost_inr_sum'].sum()
+        daily = costs if daily is None else daily.add(costs, fill_value=0)
+    if daily is None:
+        return
+
+    table = EnergyRollup.__table__
+    statement = table.update().where(
+        table.c.user_id == user_id,
+        table.c.granularity == 'day',
+        table.c.bucket_start == bindparam('b_bucket_start'),
+        table.c.department == bindparam('b_department'),
+        table.c.equipment == bindparam('b_equipment')
+    ).values(cost_inr_sum=bindparam('b_cost_inr_sum'))
+
+    records = [{
+        'b_bucket_start': bucket_start.to_pydatetime(),
+        'b_department': department,
+        'b_equipment': equipment,
+        'b_cost_inr_sum': float(cost)
+    } for (bucket_start, department, equipment), cost in daily.items()]
+    db.session.connection().execute(statement, records)
+
+def _resum_upload_costs(user_id):
+    totals = db.session.query(EnergyData.upload_id, db.func.sum(EnergyData.cost_inr)) \
+        .filter(EnergyData.user_id == user_id).group_by(EnergyData.upload_id).all()
+    for upload_id, total_cost in totals:
+        if upload_id is not None:
+            Upload.query.filter_by(id=upload_id, user_id=user_id) \
+                .update({Upload.total_cost_inr: float(total_cost or 0)}, synchronize_session=False)
+
+def slab_adjustment(monthly_kwh, slabs, energy_rate):
+    """Extra (or saved) INR when each month's kWh is billed in consumption blocks
+
+    Slab rates replace the energy rate for the kWh falling inside each block;
+    time-of-day surcharges still apply on top.
+    """
+    monthly_kwh = np.asarray(monthly_kwh, dtype=float)
+    adjustment = np.zeros_like(monthly_kwh)
+    lower = 0.0
+    for slab in slabs or []:
+        upper = float(slab['up_to_kwh']) if slab.get('up_to_kwh') is not None else np.inf
+        in_slab = np.clip(monthly_kwh - lower, 0, upper - lower)
+        adjustment += in_slab * (float(slab['rate_inr']) - energy_rate)
+        lower = upper
+    return adjustment
+
+def monthly_bills(user_id, tariff=None, months=6):
+    """Estimated bill per month from the hourly rollups, latest month first
+
+    The peak demand is the month's highest hourly kWh total, i.e. the average
+    kW drawn over that hour.
+    """
+    query = db.session.query(
+        EnergyRollup.bucket_start,
+        db.func.sum(EnergyRollup.energy_kwh_sum),
+        db.func.sum(EnergyRollup.cost_inr_sum)
+    ).filter(EnergyRollup.user_id == user_id, EnergyRollup.granularity == 'hour') \
+        .group_by(EnergyRollup.bucket_start)
+    hourly = pd.DataFrame(query.all(), columns=['bucket_start', 'energy_kwh', 'cost_inr'])
+    if hourly.empty:
+        return []
+
+    hourly['month'] = pd.to_datetime(hourly['bucket_start']).dt.to_period('M')
+    bills = hourly.groupby('month').agg(
+        energy_kwh=('energy_kwh', 'sum'),
+        energy_charge_inr=('cost_inr', 'sum'),
+        peak_demand_kw=('energy_kwh', 'max')
+    ).sort_index(ascending=False).head(months)
+
+    energy_rate = float(tariff.energy_rate_inr) if tariff else default_energy_rate()
+    demand_rate = float(tariff.demand_charge_inr_per_kw or 0) if tariff else 0.0
+    bills['slab_adjustment_inr'] = slab_adjustment(bills['energy_kwh'], tariff.slabs if tariff else [], energy_rate)
+    bills['demand_charge_inr'] = bills['peak_demand_kw'] * demand_rate
+    bills['total_inr'] = bills['energy_charge_inr'] + bills['slab_adjustment_inr'] + bills['demand_charge_inr']
+
+    return [{'month': str(month), **{column: round(float(value), 2) for column, value in row.items()}}
+            for month, row in bills.iterrows()]
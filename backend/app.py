@@ -174,8 +174,8 @@ def upload_energy_data():
         if not all(col in df.columns for col in required_columns):
             return jsonify({'error': f'CSV must contain columns: {required_columns}'}), 400
         
-        # Add cost calculation (₹6.5 per kWh - Indian industrial rate)
-        df['cost_inr'] = df['energy_kwh'] * 6.5
+        # Add cost calculation (INDUSTRIAL_ENERGY_RATE, ₹8.50 per kWh Indian industrial rate by default)
+        df['cost_inr'] = df['energy_kwh'] * float(os.environ.get('INDUSTRIAL_ENERGY_RATE', 8.50))
         
         conn = sqlite3.connect('wattwise.db')
         cursor = conn.cursor()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vectorized baseline shift detection in app/changepoints.py
+
+Builds synthetic daily kWh matrices where 10% of the series step up by
+20-60% on a random day, and reports how long scanning every series takes at
+100, 1,000 and 10,000 series, plus how many shifts were found, how many
+were false alarms and how often the shift date was exact.
+
+Usage: python benchmark_changepoints.py [series_count ...]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from app.changepoints import DEFAULT_HISTORY_DAYS, MIN_SEGMENT_DAYS, baseline_shifts
+
+DEFAULT_SIZES = [100, 1_000, 10_000]
+SHIFTED_SHARE = 0.1
+
+def make_matrix(series_count, day_count=DEFAULT_HISTORY_DAYS, seed=42):
+    """Daily kWh per series with 5% noise, 5% missing days and a step up in some series"""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2024-01-01', periods=day_count, freq='D')
+
+    scale = rng.uniform(50, 2000, (series_count, 1))
+    matrix = scale * rng.normal(1, 0.05, (series_count, day_count))
+
+    shifted = rng.random(series_count) < SHIFTED_SHARE
+    shift_day = rng.integers(MIN_SEGMENT_DAYS, day_count - MIN_SEGMENT_DAYS, series_count)
+    step = scale[:, 0] * rng.uniform(0.2, 0.6, series_count)
+    after = np.arange(day_count)[None, :] >= shift_day[:, None]
+    matrix += np.where(shifted[:, None] & after, step[:, None], 0)
+    matrix[rng.random(matrix.shape) < 0.05] = np.nan
+
+    series = pd.MultiIndex.from_arrays(
+        [np.repeat('Benchmark', series_count), [f'EQ-{row}' for row in range(series_count)]],
+        names=['department', 'equipment']
+    )
+    return series, matrix, days, shifted, days[shift_day]
+
+def run_benchmark(sizes):
+    print(f"{'series':>10} {'seconds':>10} {'series/sec':>14} {'shifted':>9} {'found':>7} {'false':>7} {'exact date':>11}")
+    for series_count in sizes:
+        series, matrix, days, shifted, shift_dates = make_matrix(series_count)
+
+        start = time.perf_counter()
+        shifts = baseline_shifts(series, matrix, days)
+        elapsed = time.perf_counter() - start
+
+        rows = series.get_indexer(pd.MultiIndex.from_frame(shifts[['department', 'equipment']]))
+        found = shifted[rows]
+        exact = (shifts['shift_date'].to_numpy() == shift_dates[rows].to_numpy())[found]
+        print(f"{series_count:>10,} {elapsed:>10.4f} {series_count / elapsed:>14,.0f} {int(shifted.sum()):>9,} "
+              f"{int(found.sum()):>7,} {int((~found).sum()):>7,} {exact.mean() * 100 if exact.size else 0:>10.1f}%")
+    return 0
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    sys.exit(run_benchmark(sizes))
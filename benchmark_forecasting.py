@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vectorized consumption forecasts in app/forecasting.py
+
+Builds synthetic daily kWh matrices (weekly cycle, noise and missing days)
+and reports how long both forecast methods take to fit every series at once
+at 100, 1,000 and 10,000 series, plus the holdout error against the last week.
+
+Usage: python benchmark_forecasting.py [series_count ...]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from app.forecasting import DEFAULT_HISTORY_DAYS, METHODS, SEASON_LENGTH, forecast_matrix
+
+DEFAULT_SIZES = [100, 1_000, 10_000]
+HORIZONS = [7, 30]
+
+def make_matrix(series_count, day_count=DEFAULT_HISTORY_DAYS, seed=42):
+    """Daily kWh per series: weekday/weekend cycle, slow drift, noise and 5% missing days"""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2024-01-01', periods=day_count, freq='D')
+    weekly = np.where(days.dayofweek < 5, 1.0, 0.4)
+    
+    scale = rng.uniform(50, 2000, (series_count, 1))
+    drift = 1 + rng.normal(0, 0.002, (series_count, 1)) * np.arange(day_count)
+    matrix = scale * weekly * drift * rng.normal(1, 0.05, (series_count, day_count))
+    matrix[rng.random(matrix.shape) < 0.05] = np.nan
+    return matrix, days
+
+def holdout_error(matrix, days, method):
+    """Mean absolute percentage error of a forecast for the last week, fitted on the rest"""
+    history, actual = matrix[:, :-SEASON_LENGTH], matrix[:, -SEASON_LENGTH:]
+    forecast = forecast_matrix(history, days[:-SEASON_LENGTH], SEASON_LENGTH, method)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return float(np.nanmean(np.abs(forecast - actual) / actual)) * 100
+
+def run_benchmark(sizes):
+    print(f"{'series':>10} {'method':>16} {'horizon':>8} {'seconds':>10} {'series/sec':>14} {'holdout MAPE':>13}")
+    for series_count in sizes:
+        matrix, days = make_matrix(series_count)
+        for method in METHODS:
+            error = holdout_error(matrix, days, method)
+            for horizon in HORIZONS:
+                start = time.perf_counter()
+                forecast_matrix(matrix, days, horizon, method)
+                elapsed = time.perf_counter() - start
+                print(f"{series_count:>10,} {method:>16} {horizon:>8} {elapsed:>10.4f} "
+                      f"{series_count / elapsed:>14,.0f} {error:>12.1f}%")
+    return 0
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    sys.exit(run_benchmark(sizes))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark Gemini model setup per request: global genai.configure vs the client pool
+
+The old AIConsultant path called genai.configure(api_key=...) and built a new
+GenerativeModel for every request, which also rebuilt the gRPC client on the
+first generate_content. The pool in app/gemini_clients.py keeps one client
+per API key and reuses model handles. No request is sent to Gemini; the
+benchmark measures setup cost only, and counts how often a request under
+concurrent threads ends up holding another user's key.
+
+Usage: python benchmark_gemini_clients.py [requests] [keys] [threads]
+"""
+
+import sys
+import threading
+import time
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from app.gemini_clients import PRIVATE_CLIENTS, GeminiClientPool
+
+MODEL_NAME = 'gemini-flash-latest'
+
+# Time a request spends between getting its model and calling generate_content (data queries, prompt)
+PROMPT_SECONDS = 0.0005
+
+def configure_per_request(api_key):
+    """What AIConsultant used to do: reconfigure the process and build a fresh model"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+def resolve_client(model):
+    """The client generate_content will call; a fresh model picks up whatever key is configured now"""
+    if model._client is None:
+        model._client = genai_client.get_default_generative_client()
+    return model._client
+
+def client_key(model):
+    return resolve_client(model)._transport._credentials.token
+
+def time_requests(setup, keys, requests):
+    start = time.perf_counter()
+    for index in range(requests):
+        resolve_client(setup(keys[index % len(keys)]))
+    return (time.perf_counter() - start) / requests
+
+def count_key_mixups(setup, keys, requests, threads):
+    """Requests whose model is authenticated with a different key than requested"""
+    mixups = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(thread_index):
+        barrier.wait()
+        for index in range(requests // threads):
+            api_key = keys[(thread_index + index) % len(keys)]
+            model = setup(api_key)
+            time.sleep(PROMPT_SECONDS)
+            if client_key(model) != api_key:
+                with lock:
+                    mixups[0] += 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return mixups[0]
+
+def run_benchmark(requests=2000, key_count=20, threads=8):
+    if not PRIVATE_CLIENTS:
+        print(f"google-generativeai {genai.__version__} binds pooled keys through genai.configure(); "
+              "the benchmark needs per-key clients")
+        return
+    keys = [f'benchmark-key-{index:03d}' for index in range(key_count)]
+    pool = GeminiClientPool()
+
+    # Warm imports and the pool so both paths are measured in steady state
+    configure_per_request(keys[0])
+    for api_key in keys:
+        pool.model(api_key, MODEL_NAME)
+
+    pooled = lambda api_key: pool.model(api_key, MODEL_NAME)
+    results = [
+        ('configure per request', configure_per_request),
+        ('client pool', pooled)
+    ]
+
+    print(f"{requests:,} requests over {key_count} API keys, {threads} threads for the key check")
+    print(f"{'setup':>22} {'per request':>14} {'requests/sec':>14} {'key mix-ups':>12}")
+    for name, setup in results:
+        per_request = time_requests(setup, keys, requests)
+        mixups = count_key_mixups(setup, keys, requests, threads)
+        print(f"{name:>22} {per_request * 1e6:>12.1f}us {1 / per_request:>14,.0f} {mixups:>12,}")
+
+    print(f"Pool: {pool.stats()}")
+    return 0
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    sys.exit(run_benchmark(*args))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark AI analysis prompt size with and without context compaction
+
+Builds 30 days of synthetic readings for one equipment at several meter
+densities and compares three prompts for the same insight: the latest 10
+readings listed line by line (the previous prompt), every reading in the
+window listed line by line, and the compacted summary (daily rollups,
+hour-of-day profile, percentiles and top anomalies) fitted to
+AI_PROMPT_TOKEN_BUDGET. Token counts are estimates (about four characters
+per token).
+
+With --live and GEMINI_API_KEY set, each prompt is also sent to Gemini and
+the model latency is reported (the full-window listing only up to
+--live-max-tokens).
+
+Usage: python benchmark_prompt_compaction.py [--readings-per-hour 1 4 12 60] [--budget N]
+                                             [--live] [--repeat 3] [--live-max-tokens 50000]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from app import create_app
+from app.ai_consultant import AIConsultant
+from app.prompt_context import estimate_tokens, summarize, TOP_ANOMALIES
+
+WINDOW_DAYS = 30
+RATE = 8.50  # INR per kWh
+
+def make_readings(readings_per_hour, seed=42):
+    """One equipment's readings over the window: a day shift load, 5% noise and a few spikes"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now().floor('h')
+    timestamps = pd.date_range(end - pd.Timedelta(days=WINDOW_DAYS), end, freq=pd.Timedelta(hours=1) / readings_per_hour,
+                               inclusive='left')
+    hours = timestamps.hour.to_numpy()
+    load = (20 + 15 * np.clip(np.sin((hours - 6) / 24 * 2 * np.pi), 0, None)) / readings_per_hour
+    energy = load * rng.normal(1, 0.05, len(timestamps))
+    spikes = rng.random(len(timestamps)) < 0.002
+    energy[spikes] *= 4
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'energy_kwh': energy,
+        'cost_inr': energy * RATE,
+        'is_anomaly': spikes,
+        'anomaly_score': np.where(spikes, energy - load, 0.0)
+    })
+
+def summary_of(readings):
+    """What prompt_context.window_summary would read from the hourly rollups and the anomalous readings"""
+    hourly = readings.groupby(readings['timestamp'].dt.floor('h')).agg(
+        energy_kwh=('energy_kwh', 'sum'),
+        cost_inr=('cost_inr', 'sum'),
+        readings=('energy_kwh', 'size'),
+        anomalies=('is_anomaly', 'sum')
+    ).rename_axis('bucket_start').reset_index()
+    anomalies = readings[readings['is_anomaly']].nlargest(TOP_ANOMALIES, 'anomaly_score').assign(equipment='Press-1')
+    return summarize(hourly, anomalies[['timestamp', 'equipment', 'energy_kwh', 'anomaly_score']])
+
+def raw_listing(readings):
+    """Readings listed line by line, newest first, as the prompt used to list the latest 10"""
+    return "\n".join(
+        f"- {row.timestamp:%Y-%m-%d %H:%M}: {row.energy_kwh:.2f} kWh (₹{row.cost_inr:.2f})" + (" [ANOMALY]" if row.is_anomaly else "")
+        for row in readings.iloc[::-1].itertuples(index=False)
+    )
+
+def build_prompts(consultant, readings):
+    insight = SimpleNamespace(
+        insight_type='spike', title='Energy Spike Detected - Production',
+        description='Unusual energy consumption detected on Press-1 in the Production department.',
+        department='Production', equipment='Press-1', severity='high', potential_savings_inr=12500.0
+    )
+    started = time.perf_counter()
+    context = consultant._create_ai_context(insight, summary_of(readings))
+    compacted = consultant._create_analysis_prompt(context)
+    compact_ms = (time.perf_counter() - started) * 1000
+
+    return compact_ms, [
+        ('latest 10 readings', consultant._render_analysis_prompt(context, raw_listing(readings.tail(10))), None),
+        ('all readings', consultant._render_analysis_prompt(context, raw_listing(readings)), None),
+        ('compacted', compacted, consultant.prompt_compaction)
+    ]
+
+def live_latency(consultant, prompt, repeat):
+    latencies = []
+    for _ in range(repeat):
+        consultant._generate(consultant.model, prompt)
+        latencies.append(consultant.call_stats['latency_ms'])
+    return statistics.median(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description='AI analysis prompt size with and without compaction')
+    parser.add_argument('--readings-per-hour', type=int, nargs='+', default=[1, 4, 12, 60])
+    parser.add_argument('--budget', type=int, help='token budget (default: AI_PROMPT_TOKEN_BUDGET)')
+    parser.add_argument('--live', action='store_true', help='send the prompts to Gemini and time the responses')
+    parser.add_argument('--repeat', type=int, default=3, help='live calls per prompt (median reported)')
+    parser.add_argument('--live-max-tokens', type=int, default=50000, help='largest prompt sent in live mode')
+    args = parser.parse_args()
+
+    app = create_app()
+    if args.budget is not None:
+        app.config['AI_PROMPT_TOKEN_BUDGET'] = args.budget
+
+    with app.test_request_context():
+        consultant = AIConsultant()
+        live = args.live and consultant.model is not None
+        if args.live and not live:
+            print("No GEMINI_API_KEY; reporting prompt sizes only")
+
+        print(f"{WINDOW_DAYS} days of readings, token budget {app.config['AI_PROMPT_TOKEN_BUDGET']}")
+        print(f"{'readings/h':>10} {'readings':>9} {'prompt':>20} {'tokens':>9} {'characters':>11} "
+              f"{'compaction':>13} {'build ms':>9}" + (f" {'latency ms':>11}" if live else ""))
+        for readings_per_hour in args.readings_per_hour:
+            readings = make_readings(readings_per_hour)
+            compact_ms, prompts = build_prompts(consultant, readings)
+            for name, prompt, compaction in prompts:
+                tokens = estimate_tokens(prompt)
+                line = (f"{readings_per_hour:>10} {len(readings):>9,} {name:>20} {tokens:>9,} {len(prompt):>11,} "
+                        f"{compaction or '-':>13} " + (f"{compact_ms:>9.1f}" if compaction else f"{'-':>9}"))
+                if live:
+                    latency = live_latency(consultant, prompt, args.repeat) if tokens <= args.live_max_tokens else None
+                    line += f" {latency:>11.0f}" if latency is not None else f" {'skipped':>11}"
+                print(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN every hot route query and fail if any of them falls back to a full table scan
+
+Runs against DATABASE_URL (SQLite or PostgreSQL). Exits non-zero when a query
+is not served by an index, so it can be used as a deployment check after
+running add_query_indexes.py.
+"""
+
+import sys
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Upload, EnergyData, EnergyInsight, EnergyRollup, RunningStat, AIRecommendation, AIAnalysis
+from app.rollups import _filter_rollups
+
+def route_queries():
+    """The query shapes issued by the routes, with placeholder filter values"""
+    user_id = 1
+    since = datetime.utcnow() - timedelta(days=30)
+    
+    return {
+        'main.dashboard: latest readings':
+            EnergyData.query.filter_by(user_id=user_id).order_by(EnergyData.timestamp.desc()).limit(10),
+        'main.dashboard: latest readings in window':
+            EnergyData.query.filter_by(user_id=user_id)
+                .filter(EnergyData.timestamp >= since, EnergyData.timestamp < datetime.utcnow())
+                .order_by(EnergyData.timestamp.desc()).limit(10),
+        'main.dashboard / api.energy_stats: usage summary':
+            _filter_rollups(db.session.query(EnergyRollup.department, db.func.sum(EnergyRollup.energy_kwh_sum)),
+                            user_id, 'day', start=since, end=datetime.utcnow())
+                .group_by(EnergyRollup.department),
+        'main.dashboard: daily series':
+            _filter_rollups(db.session.query(EnergyRollup.bucket_start, db.func.sum(EnergyRollup.energy_kwh_sum)), user_id, 'day')
+                .group_by(EnergyRollup.bucket_start).order_by(EnergyRollup.bucket_start.desc()).limit(30),
+        'main.dashboard: consumption baselines':
+            RunningStat.query.filter_by(user_id=user_id).order_by(RunningStat.department, RunningStat.equipment).limit(20),
+        'api.forecast: latest day':
+            _filter_rollups(db.session.query(db.func.max(EnergyRollup.bucket_start)), user_id, 'day'),
+        'api.forecast: daily matrix':
+            _filter_rollups(db.session.query(EnergyRollup.bucket_start, EnergyRollup.department,
+                                             EnergyRollup.equipment, EnergyRollup.energy_kwh_sum),
+                            user_id, 'day', start=since),
+        'prompt_context.window_summary: hourly totals':
+            _filter_rollups(db.session.query(EnergyRollup.bucket_start, db.func.sum(EnergyRollup.energy_kwh_sum)), user_id, 'hour',
+                            'Production', 'Machine-A', start=since)
+                .group_by(EnergyRollup.bucket_start),
+        'main.dashboard: latest insights':
+            EnergyInsight.query.filter_by(user_id=user_id).order_by(EnergyInsight.created_at.desc()).limit(10),
+        'main.insights: filtered insights':
+            EnergyInsight.query.filter_by(user_id=user_id)
+                .filter(EnergyInsight.created_at >= since, EnergyInsight.created_at <= datetime.utcnow())
+                .order_by(EnergyInsight.created_at.desc()),
+        'main.insights: upload history':
+            Upload.query.filter_by(user_id=user_id).order_by(Upload.upload_date.asc()),
+        'main.insights / main.compare_uploads: upload by file name':
+            Upload.query.filter_by(user_id=user_id, file_name='upload.csv').order_by(Upload.upload_date.desc()).limit(1),
+        'main.upload_data: identical upload by content hash':
+            Upload.query.filter_by(user_id=user_id, content_sha256='0' * 64).limit(1),
+        'EnergyAnalyzer._drop_existing_readings: stored keys in batch range':
+            db.session.query(EnergyData.timestamp, EnergyData.department, EnergyData.equipment)
+                .filter(EnergyData.user_id == user_id, EnergyData.timestamp >= since, EnergyData.timestamp <= datetime.utcnow()),
+        'main.insights: file filtered insights':
+            EnergyInsight.query.filter_by(user_id=user_id, file_name='upload.csv'),
+        'main.insights / main.compare_uploads: upload insights':
+            EnergyInsight.query.filter_by(user_id=user_id, upload_id=1),
+        'prompt_context.window_summary: top anomalies':
+            EnergyData.query.filter_by(user_id=user_id, is_anomaly=True, department='Production', equipment='Machine-A')
+                .filter(EnergyData.timestamp >= since)
+                .order_by(db.func.coalesce(EnergyData.anomaly_score, 0).desc()).limit(5),
+        'api.get_insight_details: department readings':
+            EnergyData.query.filter_by(user_id=user_id, department='Production')
+                .order_by(EnergyData.timestamp.desc()).limit(20),
+        'api.get_insight_details: recommendations':
+            AIRecommendation.query.filter_by(insight_id=1),
+        'api.analyze_insights: insights by severity':
+            db.session.query(EnergyInsight.id).filter(EnergyInsight.user_id == user_id, EnergyInsight.severity == 'high')
+                .order_by(db.func.coalesce(EnergyInsight.potential_savings_inr, 0).desc(), EnergyInsight.id).limit(50),
+        'ai_precompute.queue_upload_insights: upload insights by severity':
+            db.session.query(EnergyInsight.id, EnergyInsight.potential_savings_inr)
+                .filter(EnergyInsight.user_id == user_id, EnergyInsight.upload_id == 1, EnergyInsight.severity == 'high')
+                .order_by(db.func.coalesce(EnergyInsight.potential_savings_inr, 0).desc(), EnergyInsight.id).limit(20),
+        'AnalysisCache.get: stored analysis':
+            AIAnalysis.query.filter(AIAnalysis.context_hash == '0' * 64, AIAnalysis.created_at >= since).limit(1),
+        'AnalysisCache._evict: least recently viewed':
+            db.session.query(AIAnalysis.id).filter(AIAnalysis.user_id == user_id)
+                .order_by(AIAnalysis.last_used_at.desc()).limit(500),
+    }
+
+def explain(connection, query):
+    """Return the plan lines for a query on the current dialect"""
+    compiled = query.statement.compile(dialect=connection.dialect)
+    params = {key: value.isoformat(' ') if isinstance(value, datetime) else value
+              for key, value in compiled.params.items()}
+    
+    if connection.dialect.name == 'postgresql':
+        # Tiny tables would always be seq-scanned; ask whether an index *can* serve the query
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).fetchall()
+        return [row[0] for row in rows]
+    
+    positional = tuple(params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', positional).fetchall()
+    return [row[-1] for row in rows]
+
+def uses_index(plan, dialect_name):
+    if dialect_name == 'postgresql':
+        return any('Index' in line for line in plan) and not any('Seq Scan' in line for line in plan)
+    # SQLite reports "SCAN <table>" without "USING ... INDEX" for full scans
+    return all('USING' in line and 'INDEX' in line for line in plan if line.startswith(('SCAN', 'SEARCH')))
+
+def check_query_indexes():
+    app = create_app()
+    failures = 0
+    
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for name, query in route_queries().items():
+                plan = explain(connection, query)
+                ok = uses_index(plan, connection.dialect.name)
+                failures += not ok
+                print(f"{'✅' if ok else '❌'} {name}")
+                for line in plan:
+                    print(f"     {line}")
+    
+    if failures:
+        print(f"\n{failures} queries are not served by an index. Run: python add_query_indexes.py")
+        return 1
+    
+    print("\nAll route queries use an index!")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(check_query_indexes())
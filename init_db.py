@@ -5,7 +5,7 @@ Run this to create all database tables
 """
 
 from app import create_app, db
-from app.models import User, EnergyData, EnergyInsight, AIRecommendation
+from app.models import User, Upload, EnergyData, EnergyInsight, AIRecommendation
 
 def init_database():
     """Initialize the database with all tables"""
@@ -23,7 +23,13 @@ def init_database():
         print("✅ Database tables created successfully!")
         print("\nTables created:")
         print("  - user")
+        print("  - upload")
         print("  - energy_data")
+        print("  - energy_rollup")
+        print("  - energy_profile")
+        print("  - running_stat")
+        print("  - tariff")
+        print("  - ai_analysis")
         print("  - energy_insight")
         print("  - ai_recommendation")
         
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Regenerate the hourly/daily energy rollups from raw energy data
+
+Usage: python rebuild_rollups.py [user_id]
+"""
+
+import sys
+from app import create_app
+from app.rollups import rebuild_rollups
+
+def main():
+    """Rebuild rollups for one user, or for every user when no id is given"""
+    app = create_app()
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    
+    with app.app_context():
+        try:
+            print(f"Rebuilding rollups for {'user ' + str(user_id) if user_id is not None else 'all users'}...")
+            rows = rebuild_rollups(user_id)
+            print(f"Successfully rebuilt rollups from {rows} energy records!")
+        except Exception as e:
+            print(f"Error rebuilding rollups: {e}")
+            raise
+
+if __name__ == '__main__':
+    main()
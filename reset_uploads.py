@@ -4,7 +4,7 @@ Reset all uploads to start fresh with Upload #1
 """
 
 from app import create_app, db
-from app.models import EnergyData, EnergyInsight
+from app.models import User, Upload, EnergyData, EnergyInsight, EnergyRollup, EnergyProfile, RunningStat, AIRecommendation, AIAnalysis
 
 def reset_all_uploads():
     """Delete all energy data and insights to start fresh"""
@@ -12,7 +12,9 @@ def reset_all_uploads():
     
     with app.app_context():
         try:
-            # Delete all energy insights first (due to potential foreign key constraints)
+            # Delete AI recommendations and insights first (due to potential foreign key constraints)
+            AIRecommendation.query.delete()
+            AIAnalysis.query.delete()
             insights_count = EnergyInsight.query.count()
             print(f"Deleting {insights_count} energy insights...")
             EnergyInsight.query.delete()
@@ -22,6 +24,18 @@ def reset_all_uploads():
             print(f"Deleting {data_count} energy data records...")
             EnergyData.query.delete()
             
+            # Delete uploads and the rollups built from them
+            print(f"Deleting {Upload.query.count()} uploads and their rollups...")
+            EnergyRollup.query.delete()
+            
+            # Anomaly baselines learned from that data
+            RunningStat.query.delete()
+            EnergyProfile.query.delete()
+            Upload.query.delete()
+            
+            # Invalidate every user's cached dashboard/stats responses
+            User.query.update({User.data_version: User.data_version + 1})
+            
             # Commit changes
             db.session.commit()
             print("Successfully reset all uploads!")